@@ -0,0 +1,230 @@
+"""Incremental decoding of b64_json images from a streamed response body.
+
+A generation response is a JSON document whose payload is one or more
+multi-megabyte base64 strings. Parsing it with response.json() holds the
+raw body, the decoded str and the decoded bytes at once; this module
+instead scans the body chunk by chunk and decodes each b64_json value
+straight into its own buffer, so the largest allocation is the image.
+
+A streaming request (stream=true) is answered with server-sent events
+instead: partial images while the model works, then the finished one.
+read_event_stream() handles that form, one event at a time.
+"""
+import binascii
+import re
+import time
+
+import metrics
+
+KEY = b'"b64_json"'
+READ_CHUNK = 256 * 1024
+DECODE_QUANTUM = 4 * 16 * 1024  # base64 decodes in groups of 4 characters
+
+# JSON encoders may escape "/" and some wrap long strings with "\n"
+_ESCAPES = re.compile(rb"\\[nr]")
+_EVENT_TYPE = re.compile(rb'"type"\s*:\s*"([^"]+)"')
+
+PARTIAL_EVENT = "image_generation.partial_image"
+COMPLETED_EVENT = "image_generation.completed"
+EVENT_STREAM = "text/event-stream"
+
+
+class B64ImageDecoder:
+    """Feed body chunks in with feed(); images() returns the decoded buffers.
+
+    Each image is written into a bytearray that is preallocated from the
+    expected size (and grown if the guess was short), then trimmed and
+    handed out as a read-only memoryview, so callers share that one copy.
+    decode_seconds holds the time spent decoding each image, which is
+    spread across the feed() calls that delivered it.
+    """
+
+    def __init__(self, size_hint=None):
+        self.size_hint = size_hint or 0
+        self.bytes_read = 0
+        self.decode_seconds = []
+        self._images = []
+        self._pending = b""    # undecided bytes outside a value, or <4 base64 chars inside one
+        self._in_value = False
+        self._after_key = False
+        self._buffer = None
+        self._length = 0
+        self._seconds = 0.0
+
+    def feed(self, chunk):
+        self.bytes_read += len(chunk)
+        data = self._pending + chunk if self._pending else chunk
+        self._pending = b""
+        position = 0
+        while position < len(data):
+            if self._in_value:
+                position = self._feed_value(data, position)
+            else:
+                position = self._find_value(data, position)
+                if position is None:
+                    return
+
+    def _find_value(self, data, position):
+        # Scan for "b64_json" followed by optional whitespace, a colon and the opening quote
+        if not self._after_key:
+            found = data.find(KEY, position)
+            if found < 0:
+                # Keep a tail in case the key is split across chunks
+                self._pending = data[max(position, len(data) - len(KEY) + 1):]
+                return None
+            position = found + len(KEY)
+            self._after_key = True
+
+        while position < len(data) and data[position:position + 1] in b" \t\r\n:":
+            position += 1
+        if position == len(data):
+            return None
+        if data[position:position + 1] != b'"':
+            # Not a string value after all; keep scanning for the next key
+            self._after_key = False
+            return position
+
+        self._after_key = False
+        self._in_value = True
+        self._buffer = bytearray(max(self.size_hint, DECODE_QUANTUM))
+        self._length = 0
+        self._seconds = 0.0
+        return position + 1
+
+    def _feed_value(self, data, position):
+        end = data.find(b'"', position)
+        text = data[position:] if end < 0 else data[position:end]
+        escape = b""
+        if b"\\" in text:
+            text = _ESCAPES.sub(b"", text).replace(b"\\/", b"/")
+            if end < 0 and text.endswith(b"\\"):
+                # An escape split across chunks; finish it with the next one
+                escape = b"\\"
+                text = text[:-1]
+
+        if end < 0:
+            usable = len(text) - len(text) % 4
+            self._write(text[:usable])
+            self._pending = text[usable:] + escape
+            return len(data)
+
+        if len(text) % 4:
+            text += b"=" * (4 - len(text) % 4)
+        self._write(text)
+        self._finish_value()
+        return end + 1
+
+    def _write(self, text):
+        started = time.perf_counter()
+        for start in range(0, len(text), DECODE_QUANTUM):
+            decoded = binascii.a2b_base64(text[start:start + DECODE_QUANTUM])
+            # Slice assignment grows the bytearray when the size hint was short
+            self._buffer[self._length:self._length + len(decoded)] = decoded
+            self._length += len(decoded)
+        self._seconds += time.perf_counter() - started
+
+    def _finish_value(self):
+        del self._buffer[self._length:]
+        self._images.append(memoryview(self._buffer).toreadonly())
+        self.decode_seconds.append(self._seconds)
+        self._buffer = None
+        self._in_value = False
+        # Later images in the same response are about the same size
+        self.size_hint = self._length
+
+    def images(self):
+        """Decoded images in response order; raises ValueError on a truncated value"""
+        if self._in_value:
+            raise ValueError("Response ended inside an image")
+        return list(self._images)
+
+
+def decoded_size_hint(response):
+    """Upper bound on the decoded image size from Content-Length, or None"""
+    length = response.headers.get("Content-Length")
+    if not length or response.headers.get("Content-Encoding"):
+        return None
+    try:
+        return int(length) * 3 // 4
+    except ValueError:
+        return None
+
+
+def read_images(response, chunk_size=READ_CHUNK):
+    """Consume a streamed (stream=True) response and return its decoded images.
+
+    The response is closed afterwards so its connection returns to the pool.
+    Returns (images, bytes_read).
+    """
+    decoder = B64ImageDecoder(decoded_size_hint(response))
+    try:
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            decoder.feed(chunk)
+    finally:
+        response.close()
+    images = decoder.images()
+    for seconds in decoder.decode_seconds:
+        metrics.observe("b64_decode_seconds", seconds)
+    return images, decoder.bytes_read
+
+
+def is_event_stream(response):
+    return response.headers.get("Content-Type", "").startswith(EVENT_STREAM)
+
+
+def _event_image(data):
+    """(image, decode seconds) of one event's JSON, or (None, 0.0)"""
+    decoder = B64ImageDecoder()
+    decoder.feed(data)
+    images = decoder.images()
+    return (images[0], decoder.decode_seconds[0]) if images else (None, 0.0)
+
+
+def read_event_stream(response, on_partial=None, chunk_size=READ_CHUNK):
+    """Consume a streamed generation answered with server-sent events.
+
+    on_partial(image) is called for each partial image as it arrives.
+    Returns (final images, bytes read); an error event raises ValueError.
+    The response is closed afterwards.
+    """
+    images = []
+    bytes_read = 0
+    event_type = None
+    data = []
+
+    def dispatch():
+        body = b"\n".join(data)
+        kind = event_type
+        if kind is None:
+            match = _EVENT_TYPE.search(body)
+            kind = match.group(1).decode("utf-8", "replace") if match else ""
+        if kind == "error" or kind.endswith(".failed"):
+            raise ValueError(body[:500].decode("utf-8", "replace"))
+        image, seconds = _event_image(body)
+        if image is None:
+            return
+        if kind == PARTIAL_EVENT:
+            if on_partial is not None:
+                on_partial(image)
+        else:
+            metrics.observe("b64_decode_seconds", seconds)
+            images.append(image)
+
+    try:
+        # Events end with a blank line; their data lines hold one JSON document
+        for line in response.iter_lines(chunk_size=chunk_size):
+            bytes_read += len(line) + 1
+            if line.startswith(b"event:"):
+                event_type = line[6:].strip().decode("utf-8", "replace")
+            elif line.startswith(b"data:"):
+                data.append(line[5:].lstrip())
+            elif not line:
+                if data:
+                    dispatch()
+                event_type = None
+                data = []
+        if data:
+            dispatch()
+    finally:
+        response.close()
+    return images, bytes_read
@@ -0,0 +1,396 @@
+"""Generate covers for a whole catalog without the Streamlit UI.
+
+Reads books from a JSONL or CSV file with title, category, summary and
+optional styles, colors, additional, subtitle, author and id columns.
+Finished books are recorded in <output-dir>/manifest.jsonl, so an
+interrupted run can simply be started again and will skip them.
+
+With --local-titles the model paints title-free art and the lettering is
+set locally; books whose art prompt is the same (a series) share one
+request per variation, and the art is kept in <output-dir>/base for
+later runs.
+
+    python batch_generate.py books.jsonl --output-dir covers --concurrency 4 --rpm 20
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import metrics
+from cover_core import (
+    IMAGE_SIZES,
+    OUTPUT_FORMATS,
+    QUALITIES,
+    build_payload,
+    build_prompt,
+    create_session,
+    endpoint_url,
+    request_headers,
+    request_image,
+)
+from hedging import HedgePolicy
+from image_cache import cache_key
+from lettering import DEFAULT_FONT, FONTS, PLACEMENTS, compose_cover
+from rate_limit import Throttle
+from routing import Router, load_deployments
+
+MANIFEST_NAME = "manifest.jsonl"
+
+
+def split_list(value):
+    """Accept a JSON list or a "Vector; Geometric" style string"""
+    if not value:
+        return []
+    if isinstance(value, list):
+        return [str(v).strip() for v in value if str(v).strip()]
+    return [v.strip() for v in re.split(r"[;,]", value) if v.strip()]
+
+
+def read_books(path):
+    """Load book rows from a .jsonl or .csv file"""
+    if path.lower().endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            return list(csv.DictReader(f))
+
+    books = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                books.append(json.loads(line))
+    return books
+
+
+def book_key(book):
+    """Stable identifier used to resume: the explicit id, else a hash of the inputs"""
+    if book.get("id"):
+        return str(book["id"])
+    fields = [
+        book.get("title", ""),
+        book.get("category", ""),
+        book.get("summary", ""),
+        split_list(book.get("styles")),
+        split_list(book.get("colors")),
+        book.get("additional", "")
+    ]
+    # Lettering columns came later; books without them keep the keys earlier runs recorded
+    if book.get("subtitle") or book.get("author"):
+        fields += [book.get("subtitle", ""), book.get("author", "")]
+    encoded = json.dumps(fields, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+
+def slugify(text):
+    return re.sub(r"[^a-z0-9]+", "_", text.lower()).strip("_") or "cover"
+
+
+def load_finished(manifest_path):
+    """Keys of books whose latest manifest entry is a success"""
+    status = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # torn last line from an interrupted run
+                status[entry["key"]] = entry["status"]
+    return {key for key, value in status.items() if value == "done"}
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def generate_request(session, url, headers, payload, retry_options):
+    """Worker task: request one image and time it (throttling happens per attempt)"""
+    started = time.monotonic()
+    try:
+        image, error = request_image(session, url, headers, payload, **retry_options)
+    except Exception as e:
+        image, error = None, str(e)
+    return image, error, time.monotonic() - started
+
+
+def read_base_art(path):
+    """Worker task: base art kept by an earlier run (no latency: nothing was requested)"""
+    with open(path, "rb") as f:
+        return f.read(), None, None
+
+
+def save_base_art(path, image):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(image)
+    os.replace(tmp_path, path)
+
+
+def run(args):
+    books = read_books(args.input)
+    image_dir = os.path.join(args.output_dir, "images")
+    os.makedirs(image_dir, exist_ok=True)
+    manifest_path = os.path.join(args.output_dir, MANIFEST_NAME)
+    finished = load_finished(manifest_path)
+
+    todo = []
+    for book in books:
+        key = book_key(book)
+        if key not in finished:
+            todo.append((key, book))
+
+    stats = {
+        "books": len(books),
+        "skipped": len(books) - len(todo),
+        "done": 0,
+        "failed": 0,
+        "images": 0,
+        "base_reused": 0,
+        "latencies": []
+    }
+    print(f"{len(books)} books, {stats['skipped']} already finished, {len(todo)} to generate")
+
+    session = create_session(pool_size=args.concurrency)
+    throttle = Throttle(
+        requests_per_minute=args.rpm,
+        images_per_minute=args.ipm,
+        max_concurrency=args.concurrency,
+        initial_concurrency=min(4, args.concurrency)
+    )
+    url = endpoint_url()
+    headers = request_headers(args.api_key)
+    retry_options = {
+        "attempt_timeout": args.attempt_timeout,
+        "total_timeout": args.total_timeout,
+        "throttle": throttle
+    }
+    router = None
+    if args.deployments:
+        router = Router(load_deployments(args.deployments, default_api_key=args.api_key))
+        retry_options["router"] = router
+    hedge = None
+    if args.hedge_percentile:
+        hedge = HedgePolicy(percentile=args.hedge_percentile, budget=args.hedge_budget)
+        retry_options["hedge"] = hedge
+
+    started = time.monotonic()
+    executor = ThreadPoolExecutor(max_workers=args.concurrency)
+    base_dir = os.path.join(args.output_dir, "base")
+    futures = {}
+    waiting = {}  # request key -> [(book key, variation)] served by that request
+    books_by_key = {}
+    for key, book in todo:
+        prompt = build_prompt(
+            book.get("title", ""),
+            book.get("summary", ""),
+            book.get("category", ""),
+            split_list(book.get("styles")),
+            split_list(book.get("colors")),
+            book.get("additional", ""),
+            include_title=not args.local_titles
+        )
+        books_by_key[key] = {
+            "book": book,
+            "prompt": prompt,
+            "remaining": args.variations,
+            "files": {},
+            "errors": []
+        }
+        for i in range(args.variations):
+            payload = build_payload(prompt, args.size, args.format, args.quality)
+            # Title-free art depends only on the request, so books with the same prompt share it
+            request_key = cache_key(payload, i) if args.local_titles else f"{key}:{i}"
+            if request_key not in waiting:
+                waiting[request_key] = []
+                base_path = os.path.join(base_dir, f"{request_key}.{args.format}")
+                if args.local_titles and os.path.exists(base_path):
+                    future = executor.submit(read_base_art, base_path)
+                else:
+                    future = executor.submit(generate_request, session, url, headers, payload, retry_options)
+                futures[future] = request_key
+            waiting[request_key].append((key, i))
+
+    try:
+        with open(manifest_path, "a", encoding="utf-8") as manifest:
+            for future in as_completed(futures):
+                request_key = futures[future]
+                image, error, latency = future.result()
+                if latency is None:
+                    stats["base_reused"] += 1
+                else:
+                    stats["latencies"].append(latency)
+                    if args.local_titles and not error:
+                        save_base_art(os.path.join(base_dir, f"{request_key}.{args.format}"), image)
+
+                for key, i in waiting.pop(request_key):
+                    entry = books_by_key[key]
+                    book = entry["book"]
+                    cover, cover_error = image, error
+                    if args.local_titles and not error:
+                        try:
+                            cover = compose_cover(
+                                image,
+                                book.get("title", ""),
+                                book.get("subtitle", ""),
+                                book.get("author", ""),
+                                args.font,
+                                args.placement,
+                                args.format
+                            )
+                        except Exception as e:
+                            cover_error = f"lettering failed: {e}"
+
+                    if cover_error:
+                        entry["errors"].append(f"variation {i + 1}: {cover_error}")
+                    else:
+                        file_name = f"{slugify(book.get('title', ''))}_{key}_{i + 1}.{args.format}"
+                        with open(os.path.join(image_dir, file_name), "wb") as f:
+                            f.write(cover)
+                        entry["files"][i] = os.path.join("images", file_name)
+                        stats["images"] += 1
+
+                    entry["remaining"] -= 1
+                    if entry["remaining"]:
+                        continue
+
+                    status = "failed" if entry["errors"] else "done"
+                    stats[status] += 1
+                    manifest.write(json.dumps({
+                        "key": key,
+                        "status": status,
+                        "title": book.get("title", ""),
+                        "category": book.get("category", ""),
+                        "size": args.size,
+                        "format": args.format,
+                        "quality": args.quality,
+                        "prompt": entry["prompt"],
+                        "files": [entry["files"][n] for n in sorted(entry["files"])],
+                        "errors": entry["errors"],
+                        "finished_at": datetime.now().isoformat()
+                    }, ensure_ascii=False) + "\n")
+                    manifest.flush()
+                    del books_by_key[key]
+
+                    finished_books = stats["done"] + stats["failed"]
+                    print(f"[{finished_books}/{len(todo)}] {status}: {book.get('title', key)}")
+    except KeyboardInterrupt:
+        executor.shutdown(wait=False, cancel_futures=True)
+        print("Interrupted; run the same command again to resume.")
+    else:
+        executor.shutdown()
+
+    stats["elapsed"] = time.monotonic() - started
+    stats["throttle"] = throttle.stats()
+    stats["hedge"] = hedge.stats() if hedge else None
+    stats["deployments"] = router.stats() if router else None
+    return stats
+
+
+def print_stats(stats):
+    elapsed = stats["elapsed"]
+    latencies = stats["latencies"]
+    print()
+    print(f"Books:      {stats['done']} done, {stats['failed']} failed, {stats['skipped']} skipped")
+    print(f"Images:     {stats['images']} in {elapsed:.1f}s")
+    if stats["base_reused"]:
+        print(f"Base art:   {stats['base_reused']} reused from earlier runs")
+    if elapsed > 0:
+        print(f"Throughput: {stats['images'] / elapsed * 60:.1f} images/min")
+    if latencies:
+        print(
+            f"Latency:    mean {sum(latencies) / len(latencies):.1f}s, "
+            f"p50 {percentile(latencies, 50):.1f}s, p95 {percentile(latencies, 95):.1f}s"
+        )
+    throttle = stats["throttle"]
+    print(f"Throttled:  {throttle['throttled']} responses, final concurrency limit {throttle['concurrency_limit']:.1f}")
+    for deployment in stats.get("deployments") or []:
+        print(
+            f"Deployment: {deployment['name']} {deployment['state']}, {deployment['requests']} requests, "
+            f"{deployment['failures']} failed"
+        )
+    hedge = stats.get("hedge")
+    if hedge:
+        print(
+            f"Hedging:    {hedge['fired']} of {hedge['calls']} requests hedged, {hedge['won']} hedges won, "
+            f"{hedge['skipped']} skipped over budget"
+        )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate book covers for a catalog file")
+    parser.add_argument("input", help="JSONL or CSV file of books")
+    parser.add_argument("--output-dir", default="covers", help="Where images and manifest.jsonl are written")
+    parser.add_argument("--size", default=IMAGE_SIZES[0], choices=IMAGE_SIZES)
+    parser.add_argument("--format", default=OUTPUT_FORMATS[0], choices=OUTPUT_FORMATS)
+    parser.add_argument("--quality", default="medium", choices=QUALITIES, help="low is quicker and cheaper")
+    parser.add_argument("--variations", type=int, default=1, help="Images per book")
+    parser.add_argument("--concurrency", type=int, default=4, help="Maximum requests in flight (adapts below this)")
+    parser.add_argument("--rpm", type=float, default=20, help="Global request rate limit per minute")
+    parser.add_argument("--ipm", type=float, default=None, help="Global image rate limit per minute")
+    parser.add_argument("--attempt-timeout", type=float, default=120, help="Seconds per HTTP attempt")
+    parser.add_argument("--total-timeout", type=float, default=300, help="Seconds per image including retries")
+    parser.add_argument(
+        "--hedge-percentile",
+        type=float,
+        default=None,
+        help="Duplicate a request still running past this latency quantile (e.g. 0.95); off by default"
+    )
+    parser.add_argument(
+        "--deployments",
+        default=os.getenv("COVER_DEPLOYMENTS"),
+        help="JSON list (inline or a file) of deployments to spread requests over, each with its own "
+             "quota in place of --rpm/--ipm; see routing.py"
+    )
+    parser.add_argument("--hedge-budget", type=float, default=0.05, help="Most hedges per request sent")
+    parser.add_argument(
+        "--local-titles",
+        action="store_true",
+        help="Generate title-free art (shared by books with the same prompt) and letter it locally"
+    )
+    parser.add_argument("--font", default=DEFAULT_FONT, choices=list(FONTS), help="Lettering font with --local-titles")
+    parser.add_argument("--placement", default=PLACEMENTS[0], choices=PLACEMENTS, help="Lettering placement")
+    parser.add_argument(
+        "--metrics-out",
+        default=None,
+        help="Write stage latency metrics here at the end (.prom for Prometheus text, else JSON lines)"
+    )
+    parser.add_argument("--api-key", default=None, help="Defaults to the BFL_API_KEY environment variable")
+    args = parser.parse_args(argv)
+
+    args.api_key = args.api_key or os.getenv("BFL_API_KEY")
+    if not args.api_key:
+        parser.error("no API key: pass --api-key or set BFL_API_KEY")
+    if args.variations < 1 or args.concurrency < 1 or args.rpm <= 0:
+        parser.error("--variations, --concurrency and --rpm must be positive")
+    if args.hedge_percentile is not None and not 0 < args.hedge_percentile < 1:
+        parser.error("--hedge-percentile must be between 0 and 1")
+    return args
+
+
+def main(argv=None):
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    args = parse_args(argv)
+    stats = run(args)
+    print_stats(stats)
+    if args.metrics_out:
+        with open(args.metrics_out, "w", encoding="utf-8") as f:
+            if args.metrics_out.endswith(".prom"):
+                f.write(metrics.REGISTRY.to_prometheus())
+            else:
+                f.write(metrics.REGISTRY.to_json_lines())
+    return 1 if stats["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+"""Batched generation: several variations per request through the API's n.
+
+One request for n images uploads the prompt once, waits in the service's
+queue once and takes one slot of a requests-per-minute quota, where n
+single requests pay each of those n times. How many images to ask for is
+learned per endpoint: a refused n lowers the ceiling for good, a slow
+answer halves the batch and a complete, timely one grows it again. A
+response with fewer images than asked for (items missing, or without
+b64_json) is topped up by asking again for just the shortfall.
+"""
+import hashlib
+import os
+import threading
+import time
+from functools import partial
+
+import metrics
+from generation import NO_IMAGE_DATA, request_images, run_parallel
+
+MAX_BATCH = 4  # default; COVER_MAX_BATCH overrides it
+# Batches answering slower than this shrink, keeping calls well inside the attempt timeout
+TARGET_SECONDS = 60.0
+# Follow-up requests for one variation after its batch came back short
+MAX_REFILLS = 2
+
+
+def refused_n(error):
+    """Whether an error is the endpoint refusing the number of images asked for"""
+    if not error or not error.startswith("API Error 400"):
+        return False
+    message = error.lower()
+    return "'n'" in message or "n must" in message or "n=1" in message or "number of images" in message
+
+
+class BatchSizer:
+    """How many images to ask for per request.
+
+    limit is the largest n the endpoint hasn't refused; size is the
+    current batch, which grows by one after a complete answer within
+    target_seconds and halves after a slower one. Safe to share between
+    threads.
+    """
+
+    def __init__(self, max_size=None, target_seconds=TARGET_SECONDS):
+        if max_size is None:
+            # Read here rather than at import, after the entry point has loaded .env
+            max_size = int(os.getenv("COVER_MAX_BATCH", MAX_BATCH))
+        self.limit = max(1, max_size)
+        self.size = self.limit
+        self.target_seconds = target_seconds
+        self.requests = 0
+        self.images = 0
+        self.short = 0
+        self.refused = 0
+        self._lock = threading.Lock()
+
+    def chunks(self, indexes):
+        """Split indexes into batches of the current size"""
+        with self._lock:
+            size = self.size
+        return [indexes[start:start + size] for start in range(0, len(indexes), size)]
+
+    def refuse(self, n):
+        """The endpoint refused n images in one request; never ask for that many again"""
+        with self._lock:
+            self.refused += 1
+            self.limit = max(1, min(self.limit, n // 2))
+            self.size = min(self.size, self.limit)
+        metrics.increment("batch_refusals_total")
+
+    def record(self, requested, returned, seconds):
+        """Fold one answered batch into the size"""
+        with self._lock:
+            self.requests += 1
+            self.images += returned
+            if returned < requested:
+                self.short += 1
+            if seconds > self.target_seconds:
+                self.size = max(1, self.size // 2)
+            elif returned >= requested and requested >= self.size:
+                self.size = min(self.limit, self.size + 1)
+        metrics.observe("batch_images", requested, buckets=(1, 2, 4, 6, 8, 10))
+        if returned < requested:
+            metrics.increment("batch_shortfall_images_total", requested - returned)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": self.size,
+                "limit": self.limit,
+                "requests": self.requests,
+                "images": self.images,
+                "short_responses": self.short,
+                "refused": self.refused
+            }
+
+
+def generate_batched(
+    session,
+    url,
+    headers,
+    payload,
+    count,
+    sizer,
+    max_workers=4,
+    scheduler=None,
+    owner=None,
+    keys=None,
+    **retry_options
+):
+    """Request count images of one payload in batches, running batches in parallel.
+
+    Yields (index, image_bytes, error) like generation.generate_variations,
+    where index runs over range(count). keys, one per index, coalesce
+    identical batches through the scheduler. A batch that comes back
+    short is asked again for the missing indexes only, up to MAX_REFILLS
+    times each; a refused n is retried in smaller batches.
+    """
+    # A hedge of a batch would buy every image in it twice, and its latency
+    # would skew the percentile learned from single requests
+    retry_options = {name: value for name, value in retry_options.items() if name != "hedge"}
+    refills = dict.fromkeys(range(count), 0)
+    remaining = list(range(count))
+
+    def timed(n):
+        started = time.perf_counter()
+        images, error = request_images(session, url, headers, {**payload, "n": n}, **retry_options)
+        return (images, time.perf_counter() - started), error
+
+    while remaining:
+        chunks = sizer.chunks(remaining)
+        chunk_keys = None
+        if keys:
+            chunk_keys = [
+                hashlib.sha256("\n".join(keys[i] for i in chunk).encode("utf-8")).hexdigest()
+                for chunk in chunks
+            ]
+        calls = [partial(timed, len(chunk)) for chunk in chunks]
+
+        remaining = []
+        for n, result, error in run_parallel(calls, max_workers, scheduler, owner, chunk_keys):
+            chunk = chunks[n]
+            if refused_n(error) and len(chunk) > 1:
+                sizer.refuse(len(chunk))
+                remaining.extend(chunk)
+                continue
+            if error and error != NO_IMAGE_DATA:
+                for i in chunk:
+                    yield i, None, error
+                continue
+
+            images, seconds = result if result else ([], 0.0)
+            images = images or []
+            sizer.record(len(chunk), len(images), seconds)
+            for i, image in zip(chunk, images):
+                yield i, image, None
+            for i in chunk[len(images):]:
+                if refills[i] >= MAX_REFILLS:
+                    yield i, None, error or f"Only {len(images)} of {len(chunk)} images returned"
+                    continue
+                refills[i] += 1
+                remaining.append(i)
+        remaining.sort()
@@ -0,0 +1,480 @@
+"""Throughput and latency benchmarks against mock_image_server.py.
+
+Runs the real generation path (job queue, scheduler, throttle, pooled
+client, thumbnails, history store) against a local mock endpoint, then
+times history reads and, when Streamlit is installed, full app reruns
+for several history sizes. Each result is one JSON object, appended to
+--output so runs can be compared.
+
+    python benchmark.py --concurrency 1 4 8 --variations 1 4 --history-sizes 100 10000 --output bench.jsonl
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from functools import partial
+
+import metrics
+from batching import BatchSizer
+from hedging import HedgePolicy
+from history_store import HistoryStore
+from http_client import create_session
+from jobs import DONE, JobQueue, run_cover_job
+from mock_image_server import MockConfig, make_png, start_mock_server
+from rate_limit import Throttle
+from routing import Deployment, Router
+from scheduler import FairScheduler
+
+CATEGORIES = ["Personal Growth", "Business Strategy", "Marketing", "History", "Philosophy"]
+
+
+def peak_rss_mb():
+    """High-water mark of this process's resident memory.
+
+    The mark never goes down, so each scenario runs in its own interpreter
+    (see isolated()) and reports a peak of its own.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def percentiles(values):
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0}
+    ordered = sorted(values)
+
+    def pick(pct):
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+    return {"p50": pick(50), "p95": pick(95), "p99": pick(99)}
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_generation(
+    url, concurrency, variations, batches, work_dir, hedge=None, router=None, stream=False, batch_sizer=None
+):
+    """Submit `batches` jobs from distinct owners at once and wait for all of them"""
+    metrics.REGISTRY.reset()
+    store = HistoryStore(os.path.join(work_dir, f"gen_{concurrency}_{variations}"))
+    throttle = Throttle(max_concurrency=concurrency, initial_concurrency=concurrency)
+    retry_options = {"attempt_timeout": 60, "total_timeout": 120, "throttle": throttle}
+    if hedge is not None:
+        retry_options["hedge"] = hedge
+    if router is not None:
+        retry_options["router"] = router
+    runner = partial(
+        run_cover_job,
+        url=url,
+        session=create_session(pool_size=concurrency),
+        history_store=store,
+        retry_options=retry_options,
+        scheduler=FairScheduler(workers=concurrency, name=f"bench-request-{concurrency}"),
+        batch_sizer=batch_sizer
+    )
+    queue = JobQueue(runner, workers=batches)
+    if router is not None:
+        # Full buckets would let a short run finish inside the initial burst and
+        # measure that instead of the quotas' sustained rate
+        for deployment in router.deployments:
+            deployment.throttle.drain()
+
+    started = time.perf_counter()
+    job_ids = [
+        queue.submit(
+            {
+                "api_key": "benchmark",
+                "prompt": f"Benchmark cover {n}",
+                "size": "1024x1024",
+                "format": "png",
+                "count": variations,
+                "max_parallel": variations,
+                "force_fresh": True,
+                "stream_previews": stream,
+                "batched": batch_sizer is not None,
+                "title": f"Benchmark {n}",
+                "category": CATEGORIES[n % len(CATEGORIES)],
+                "summary": "Benchmark run"
+            },
+            owner=f"user-{n}"
+        )
+        for n in range(batches)
+    ]
+
+    jobs = []
+    while True:
+        jobs = [queue.get(job_id) for job_id in job_ids]
+        if all(job["status"] in ("done", "failed") for job in jobs):
+            break
+        time.sleep(0.02)
+    elapsed = time.perf_counter() - started
+
+    images = sum(len(job["cover_ids"]) for job in jobs)
+    batch_latencies = [(job["finished_at"] - job["created_at"]).total_seconds() for job in jobs]
+    request_rows = {row["metric"]: row for row in metrics.REGISTRY.summary()}
+    image_request = request_rows.get("image_request_seconds", {})
+    first_partial = request_rows.get("first_partial_seconds")
+
+    return {
+        "scenario": "generation",
+        "params": {"concurrency": concurrency, "variations": variations, "batches": batches},
+        "elapsed_s": elapsed,
+        "images": images,
+        "failed_batches": sum(1 for job in jobs if job["status"] != DONE),
+        "images_per_s": images / elapsed if elapsed else 0.0,
+        "batch_latency_s": percentiles(batch_latencies),
+        "image_request_s": {k: image_request.get(k, 0.0) for k in ("p50", "p95", "p99")},
+        "first_partial_s": {k: first_partial[k] for k in ("p50", "p95", "p99")} if first_partial else None,
+        "throttle": throttle.stats(),
+        "hedge": hedge.stats() if hedge is not None else None,
+        "deployments": router.stats() if router is not None else None,
+        "batching": batch_sizer.stats() if batch_sizer is not None else None,
+        "http_responses": int(sum(
+            value for name, value in metrics.REGISTRY.counters().items() if name.startswith("responses_total")
+        )),
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+
+def populate_history(directory, size):
+    """Fill a store with `size` covers that share a handful of small images"""
+    store = HistoryStore(directory)
+    images = [make_png(20_000, seed=n) for n in range(8)]
+    started = datetime.now() - timedelta(minutes=size)
+    for n in range(size):
+        store.add(
+            images[n % len(images)],
+            f"Benchmark Book {n}",
+            CATEGORIES[n % len(CATEGORIES)],
+            f"Summary of benchmark book {n} about strategy and growth",
+            f"Create a professional book cover illustration for: \"Benchmark Book {n}\"",
+            "1024x1024",
+            created_at=started + timedelta(minutes=n),
+            thumbnail=images[n % len(images)]
+        )
+    return store
+
+
+def bench_history(size, work_dir, repeats, app_reruns):
+    """Time the reads one history rerun makes, and optionally whole app reruns"""
+    directory = os.path.join(work_dir, f"history_{size}")
+    store = populate_history(directory, size)
+
+    def one_read(**filters):
+        store.count()
+        store.categories()
+        records, cursor = store.page(page_size=24, **filters)
+        return cursor
+
+    timings = {}
+    for label, filters in (
+        ("first_page", {}),
+        ("category_page", {"categories": CATEGORIES[:2]}),
+        ("search_page", {"search": "strategy 42"}),
+    ):
+        samples = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            one_read(**filters)
+            samples.append(time.perf_counter() - started)
+        timings[label] = percentiles(samples)
+
+    # Walk ten pages deep to show the cost doesn't grow with depth
+    cursor = None
+    deep_samples = []
+    for _ in range(10):
+        started = time.perf_counter()
+        _, cursor = store.page(page_size=24, cursor=cursor)
+        deep_samples.append(time.perf_counter() - started)
+        if cursor is None:
+            break
+    timings["page_walk"] = percentiles(deep_samples)
+
+    result = {
+        "scenario": "history",
+        "params": {"history_size": size},
+        "read_s": timings,
+        "peak_rss_mb": peak_rss_mb()
+    }
+    if app_reruns:
+        result["app_rerun_s"] = bench_app_rerun(directory, app_reruns)
+    return result
+
+
+def bench_app_rerun(history_dir, reruns):
+    """Full Streamlit script reruns via AppTest, or None if Streamlit isn't installed.
+
+    Also reports each fragment's own render time: that is what a rerun
+    costs when the interaction happens inside the fragment (e.g. typing in
+    the prompt editor), which AppTest itself can't trigger.
+    """
+    try:
+        import streamlit as st
+        from streamlit.testing.v1 import AppTest
+    except ImportError:
+        return None
+
+    os.environ["COVER_HISTORY_DIR"] = history_dir
+    st.cache_resource.clear()  # the store is cached per process; pick up this directory
+    app = AppTest.from_file(os.path.join(os.path.dirname(os.path.abspath(__file__)), "book_image_v1.py"))
+    app.run(timeout=120)  # first run pays imports and cache setup
+    metrics.REGISTRY.reset()
+
+    samples = []
+    for _ in range(reruns):
+        started = time.perf_counter()
+        app.run(timeout=120)
+        samples.append(time.perf_counter() - started)
+    result = percentiles(samples)
+    result["fragments"] = {
+        row["metric"].split("section=")[1]: {"p50": row["p50"], "p95": row["p95"]}
+        for row in metrics.REGISTRY.summary()
+        if row["metric"].startswith("render_seconds section=")
+    }
+    return result
+
+
+def bench_cold_start(modules, repeats):
+    """Wall time of a fresh interpreter importing each module"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    baseline = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], cwd=here, check=True)
+        baseline.append(time.perf_counter() - started)
+    interpreter = min(baseline)
+
+    import_s = {}
+    for module in modules:
+        samples = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            subprocess.run([sys.executable, "-c", f"import {module}"], cwd=here, check=True)
+            samples.append(time.perf_counter() - started - interpreter)
+        import_s[module] = percentiles(samples)
+    return {
+        "scenario": "cold_start",
+        "params": {"repeats": repeats},
+        "interpreter_s": interpreter,
+        "import_s": import_s
+    }
+
+
+def run_scenario(spec):
+    """Run one generation or history scenario, described by plain values, in this process"""
+    if spec["scenario"] == "history":
+        return bench_history(spec["size"], spec["work_dir"], spec["repeats"], spec["app_reruns"])
+
+    hedge = None
+    if spec["hedge_percentile"]:
+        hedge = HedgePolicy(percentile=spec["hedge_percentile"], budget=spec["hedge_budget"])
+    router = None
+    if len(spec["deployment_urls"]) > 1 or spec["deployment_rpm"]:
+        router = Router([
+            Deployment(
+                f"mock-{n + 1}",
+                endpoint_url,
+                requests_per_minute=spec["deployment_rpm"],
+                max_concurrency=spec["concurrency"]
+            )
+            for n, endpoint_url in enumerate(spec["deployment_urls"])
+        ])
+    batch_sizer = BatchSizer(max_size=spec["batch_size"]) if spec["batch_size"] else None
+    return bench_generation(
+        spec["deployment_urls"][0], spec["concurrency"], spec["variations"], spec["batches"], spec["work_dir"],
+        hedge, router, spec["stream"], batch_sizer
+    )
+
+
+def isolated(spec):
+    """run_scenario(spec) in a fresh interpreter, whose last stdout line is the result"""
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--scenario", json.dumps(spec)],
+        stdout=subprocess.PIPE,
+        text=True,
+        check=True
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def print_result(result):
+    params = " ".join(f"{k}={v}" for k, v in result["params"].items())
+    if result["scenario"] == "generation":
+        print(
+            f"generation {params}: {result['images_per_s']:.2f} images/s, "
+            f"request p50 {result['image_request_s']['p50']:.2f}s p95 {result['image_request_s']['p95']:.2f}s, "
+            + (
+                f"first preview p50 {result['first_partial_s']['p50']:.2f}s, "
+                if result["first_partial_s"] else ""
+            )
+            + f"batch p95 {result['batch_latency_s']['p95']:.2f}s, peak RSS {result['peak_rss_mb']:.0f} MB"
+            + (
+                f", hedges fired {result['hedge']['fired']} won {result['hedge']['won']}"
+                if result["hedge"] else ""
+            )
+            + (
+                f", {result['batching']['requests']} batched requests (size {result['batching']['size']}, "
+                f"{result['batching']['short_responses']} short)"
+                if result["batching"] else ""
+            )
+        )
+    elif result["scenario"] == "cold_start":
+        imports = ", ".join(f"{k} p50 {v['p50'] * 1000:.0f}ms" for k, v in result["import_s"].items())
+        print(f"cold start {params}: {imports}")
+    else:
+        reads = ", ".join(f"{k} p95 {v['p95'] * 1000:.1f}ms" for k, v in result["read_s"].items())
+        rerun = result.get("app_rerun_s")
+        rerun_text = ""
+        if rerun:
+            rerun_text = f", app rerun p50 {rerun['p50'] * 1000:.0f}ms" + "".join(
+                f", {name} p50 {timing['p50'] * 1000:.1f}ms" for name, timing in rerun["fragments"].items()
+            )
+        print(f"history {params}: {reads}{rerun_text}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark cover generation against a local mock endpoint")
+    parser.add_argument("--concurrency", type=int, nargs="*", default=[1, 4, 8])
+    parser.add_argument("--variations", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--batches", type=int, default=4, help="Concurrent jobs (simulated users) per run")
+    parser.add_argument("--history-sizes", type=int, nargs="*", default=[100, 1000])
+    parser.add_argument("--history-repeats", type=int, default=20)
+    parser.add_argument("--app-reruns", type=int, default=0, help="Full app reruns to time per history size")
+    parser.add_argument(
+        "--cold-start", nargs="*", default=[], metavar="MODULE",
+        help="Also time fresh-interpreter imports of these modules, e.g. cover_core batch_generate"
+    )
+    parser.add_argument("--latency-median", type=float, default=0.5)
+    parser.add_argument("--latency-sigma", type=float, default=0.3)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--image-bytes", type=int, default=1_500_000)
+    parser.add_argument("--stream", action="store_true", help="Request partial-image previews (SSE)")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="Fraction of mock requests that hang")
+    parser.add_argument("--stall-seconds", type=float, default=30.0)
+    parser.add_argument(
+        "--hedge-percentile", type=float, default=None,
+        help="Hedge requests slower than this learned latency quantile (a fresh policy per run)"
+    )
+    parser.add_argument("--hedge-budget", type=float, default=0.05)
+    parser.add_argument(
+        "--deployments", type=int, default=1,
+        help="Mock deployments to route across; more than one enables the router"
+    )
+    parser.add_argument("--deployment-rpm", type=float, default=None, help="Request quota of each mock deployment")
+    parser.add_argument(
+        "--batch-size", type=int, default=0,
+        help="Ask for up to this many images per request (0: one request per image)"
+    )
+    parser.add_argument("--max-n", type=int, default=10, help="Largest n the mock accepts")
+    parser.add_argument("--short-rate", type=float, default=0.0, help="Chance the mock leaves an image out")
+    parser.add_argument("--output", default=None, help="Append JSON results to this file")
+    # Internal: run one scenario spec and print its result (see isolated())
+    parser.add_argument("--scenario", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.scenario:
+        print(json.dumps(run_scenario(json.loads(args.scenario))))
+        return
+
+    config = MockConfig(
+        latency_median=args.latency_median,
+        latency_sigma=args.latency_sigma,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        retry_after=0.2,
+        image_bytes=args.image_bytes,
+        stall_rate=args.stall_rate,
+        stall_seconds=args.stall_seconds,
+        max_n=args.max_n,
+        short_rate=args.short_rate,
+        seed=1
+    )
+    server, url = start_mock_server(config=config)
+    servers = [server]
+    deployment_urls = [url]
+    for _ in range(args.deployments - 1):
+        extra_server, extra_url = start_mock_server(config=config)
+        servers.append(extra_server)
+        deployment_urls.append(extra_url)
+
+    run_info = {
+        "run_at": datetime.now().isoformat(),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "mock": {
+            "latency_median": args.latency_median,
+            "latency_sigma": args.latency_sigma,
+            "error_rate": args.error_rate,
+            "throttle_rate": args.throttle_rate,
+            "image_bytes": args.image_bytes,
+            "stall_rate": args.stall_rate,
+            "stall_seconds": args.stall_seconds,
+            "max_n": args.max_n,
+            "short_rate": args.short_rate
+        },
+        "deployments": {"count": args.deployments, "rpm": args.deployment_rpm},
+        "hedging": {"percentile": args.hedge_percentile, "budget": args.hedge_budget} if args.hedge_percentile else None
+    }
+
+    work_dir = tempfile.mkdtemp(prefix="cover-bench-")
+    results = []
+    try:
+        # The mock servers stay in this process; each scenario runs in its own
+        for concurrency in args.concurrency:
+            for variations in args.variations:
+                results.append(isolated({
+                    "scenario": "generation",
+                    "deployment_urls": deployment_urls,
+                    "deployment_rpm": args.deployment_rpm,
+                    "concurrency": concurrency,
+                    "variations": variations,
+                    "batches": args.batches,
+                    "work_dir": work_dir,
+                    "hedge_percentile": args.hedge_percentile,
+                    "hedge_budget": args.hedge_budget,
+                    "stream": args.stream,
+                    "batch_size": args.batch_size
+                }))
+                print_result(results[-1])
+        for size in args.history_sizes:
+            results.append(isolated({
+                "scenario": "history",
+                "size": size,
+                "work_dir": work_dir,
+                "repeats": args.history_repeats,
+                "app_reruns": args.app_reruns
+            }))
+            print_result(results[-1])
+        if args.cold_start:
+            results.append(bench_cold_start(args.cold_start, args.history_repeats))
+            print_result(results[-1])
+    finally:
+        for running in servers:
+            running.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as f:
+            for result in results:
+                f.write(json.dumps({**run_info, **result}) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,40 @@
 import streamlit as st
 import os
-import requests
-import base64
 from dotenv import load_dotenv
 from datetime import datetime
-import io
-from PIL import Image
+
+import tempfile
+import threading
+import time
+import uuid
+from functools import partial
+
+import metrics
+
+from cover_core import (
+    DRAFT_QUALITY,
+    FINAL_QUALITY,
+    IMAGE_SIZES,
+    OUTPUT_FORMATS,
+    build_prompt,
+    create_session,
+    endpoint_url,
+)
+from prompts import BOOK_CATEGORIES, COLOR_OPTIONS, DEFAULT_COLORS, DEFAULT_STYLES, PROMPT_TEMPLATE, STYLE_OPTIONS
+from image_cache import ImageCache
+from derivatives import DERIVATIVES, DerivativeStore
+from history_export import write_zip
+from history_store import HistoryStore
+from near_duplicates import DuplicateIndex
+from lettering import DEFAULT_FONT, FONTS, PLACEMENTS, reletter
+from sweeps import cell_covers, expand_grid
+from thumbnails import THUMBNAIL_FORMAT, make_thumbnail
+from hedging import HedgePolicy
+from batching import BatchSizer
+from rate_limit import Throttle
+from routing import Router, load_deployments
+from jobs import JobQueue, run_cover_job
+from scheduler import FairScheduler
 
 # Load environment variables
 load_dotenv()
@@ -53,16 +82,191 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # Initialize session state
-if "generated_images" not in st.session_state:
-    st.session_state.generated_images = []
+# Only cover ids live in the session; images and metadata are in the history store
+if "generated_ids" not in st.session_state:
+    st.session_state.generated_ids = []
 if "api_key_valid" not in st.session_state:
     st.session_state.api_key_valid = False
 if "current_prompt" not in st.session_state:
     st.session_state.current_prompt = ""
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+if "job_ids" not in st.session_state:
+    st.session_state.job_ids = []
+    st.session_state.collected_job_ids = set()
 
 # Constants
-AZURE_ENDPOINT = "https://porchazureopenai.openai.azure.com/openai/deployments/gpt-image-1.5/images/generations"
-API_VERSION = "2024-02-01"
+HTTP_POOL_SIZE = 16
+REQUEST_ATTEMPT_TIMEOUT = 120  # seconds per HTTP attempt
+REQUEST_TOTAL_TIMEOUT = 300    # seconds per image, including retries
+CACHE_DIR = os.getenv("COVER_CACHE_DIR", os.path.join(".cache", "images"))
+CACHE_MAX_MB = int(os.getenv("COVER_CACHE_MAX_MB", "512"))  # 0 disables the cache
+HISTORY_DIR = os.getenv("COVER_HISTORY_DIR", os.path.join(".data", "history"))
+# Deployment quota; 0 leaves it to adaptive concurrency alone
+RATE_LIMIT_RPM = float(os.getenv("COVER_RATE_LIMIT_RPM", "0"))
+RATE_LIMIT_IPM = float(os.getenv("COVER_RATE_LIMIT_IPM", "0"))
+MAX_CONCURRENCY = int(os.getenv("COVER_MAX_CONCURRENCY", "8"))
+JOB_WORKERS = int(os.getenv("COVER_JOB_WORKERS", "4"))
+# JSON list of deployments (inline or a file path) to spread requests over; see routing.py
+DEPLOYMENTS = os.getenv("COVER_DEPLOYMENTS", "")
+# Latency quantile (e.g. 0.95) after which a request is duplicated; 0 disables hedging
+HEDGE_PERCENTILE = float(os.getenv("COVER_HEDGE_PERCENTILE", "0"))
+HEDGE_BUDGET = float(os.getenv("COVER_HEDGE_BUDGET", "0.05"))  # most hedges per request
+JOB_POLL_SECONDS = 2
+# Export formats prepared for every cover, as comma-separated derivatives.DERIVATIVES names
+EXPORT_DERIVATIVES = [
+    name.strip()
+    for name in os.getenv("COVER_DERIVATIVES", "png,jpeg-print,jpeg-web,webp-web").split(",")
+    if name.strip()
+]
+DERIVATIVE_WORKERS = int(os.getenv("COVER_DERIVATIVE_WORKERS", "2"))
+DERIVATIVE_TIMEOUT = 60  # seconds a download waits for a render still running
+# Streamlit holds a download whole in memory; larger exports go through history_export.py
+EXPORT_MAX_MB = float(os.getenv("COVER_EXPORT_MAX_MB", "25"))
+
+
+@st.cache_resource
+def get_http_session():
+    """One pooled keep-alive session shared by every rerun and browser session"""
+    return create_session(pool_size=HTTP_POOL_SIZE)
+
+
+@st.cache_resource
+def get_throttle():
+    """Rate limits and adaptive concurrency shared by every session in this process"""
+    return Throttle(
+        requests_per_minute=RATE_LIMIT_RPM,
+        images_per_minute=RATE_LIMIT_IPM,
+        max_concurrency=MAX_CONCURRENCY
+    )
+
+
+@st.cache_resource
+def get_hedge_policy():
+    """Latency history and hedge budget shared by every session, or None when disabled"""
+    if HEDGE_PERCENTILE <= 0:
+        return None
+    return HedgePolicy(percentile=HEDGE_PERCENTILE, budget=HEDGE_BUDGET)
+
+
+@st.cache_resource
+def get_batch_sizer():
+    """Images per request learned for batched jobs, shared by every session"""
+    return BatchSizer()
+
+
+@st.cache_resource
+def get_router():
+    """Health-aware routing across COVER_DEPLOYMENTS, or None to use the single endpoint"""
+    if not DEPLOYMENTS:
+        return None
+    return Router(load_deployments(DEPLOYMENTS))
+
+
+@st.cache_resource
+def get_image_cache():
+    """Process-wide generation cache, or None when disabled"""
+    if CACHE_MAX_MB <= 0:
+        return None
+    return ImageCache(CACHE_DIR, CACHE_MAX_MB * 1024 * 1024)
+
+
+@st.cache_resource
+def get_history_store():
+    """Persistent history shared by all sessions (and other processes using HISTORY_DIR)"""
+    return HistoryStore(HISTORY_DIR)
+
+
+@st.cache_resource
+def get_request_scheduler():
+    """Coalesces identical in-flight requests and fair-queues the rest per session"""
+    return FairScheduler(workers=MAX_CONCURRENCY, name="cover-request")
+
+
+@st.cache_resource
+def get_derivative_store():
+    """Export formats rendered in worker processes and kept next to the history"""
+    return DerivativeStore(
+        os.path.join(HISTORY_DIR, "derivatives"),
+        names=EXPORT_DERIVATIVES,
+        workers=DERIVATIVE_WORKERS
+    )
+
+
+@st.cache_resource
+def get_duplicate_index():
+    """Perceptual hashes of every stored cover; older covers are hashed in the background"""
+    index = DuplicateIndex(get_history_store())
+    threading.Thread(target=index.backfill, name="duplicate-backfill", daemon=True).start()
+    return index
+
+
+@st.cache_resource
+def get_job_queue():
+    """Background workers shared by all sessions; jobs keep running across reruns"""
+    runner = partial(
+        run_cover_job,
+        url=endpoint_url(),
+        session=get_http_session(),
+        history_store=get_history_store(),
+        image_cache=get_image_cache(),
+        retry_options={
+            "attempt_timeout": REQUEST_ATTEMPT_TIMEOUT,
+            "total_timeout": REQUEST_TOTAL_TIMEOUT,
+            "throttle": get_throttle(),
+            "hedge": get_hedge_policy(),
+            "router": get_router()
+        },
+        scheduler=get_request_scheduler(),
+        derivatives=get_derivative_store(),
+        duplicate_index=get_duplicate_index(),
+        batch_sizer=get_batch_sizer()
+    )
+    return JobQueue(runner, workers=JOB_WORKERS)
+
+
+history_store = get_history_store()
+derivative_store = get_derivative_store()
+duplicate_index = get_duplicate_index()
+job_queue = get_job_queue()
+
+
+def render_download(record, file_stem, label, key):
+    """Format picker and download button for one cover.
+
+    The original is offered as stored; other formats come from the
+    derivative store, waiting briefly if that render is still running.
+    """
+    options = {f"Original ({record['format'].upper()})": None}
+    for name in derivative_store.options(record):
+        options[DERIVATIVES[name][0]] = name
+    
+    choice = st.selectbox("Format", list(options), key=f"format_{key}", label_visibility="collapsed")
+    name = options[choice]
+    
+    if name is None:
+        path, image_format = record["path"], record["format"]
+    else:
+        try:
+            with st.spinner(f"Preparing {choice}..."):
+                path = derivative_store.ensure(record, name, timeout=DERIVATIVE_TIMEOUT)
+        except Exception as e:
+            st.error(f"❌ Could not prepare {choice}: {e}")
+            return
+        image_format = DERIVATIVES[name][1]
+        file_stem = f"{file_stem}_{name}"
+    
+    with open(path, "rb") as f:
+        data = f.read()
+    st.download_button(
+        label=label,
+        data=data,
+        file_name=f"{file_stem}.{image_format}",
+        mime=f"image/{image_format}",
+        use_container_width=True,
+        key=key
+    )
+
 
 # Sidebar
 with st.sidebar:
@@ -95,7 +299,7 @@ with st.sidebar:
     
     image_size = st.selectbox(
         "Image Size",
-        ["1024x1024", "1024x576", "640x960"],
+        IMAGE_SIZES,
         help="Choose the aspect ratio for your book cover"
     )
     
@@ -107,12 +311,88 @@ with st.sidebar:
         help="Generate multiple variations (more = longer processing)"
     )
     
+    max_parallel = st.slider(
+        "Max Parallel Requests",
+        min_value=1,
+        max_value=4,
+        value=4,
+        help="How many variations are requested from the API at the same time"
+    )
+    
+    stream_previews = st.checkbox(
+        "Live previews",
+        value=False,
+        help="Stream partial images while each cover is generated (each partial frame adds a little output cost)"
+    )
+    
+    batch_requests = st.checkbox(
+        "Batch variations",
+        value=False,
+        help="Ask for several variations in one API call (fewer requests against the quota, no live previews)"
+    )
+    
+    draft_mode = st.checkbox(
+        "✏️ Draft mode",
+        value=False,
+        help="Generate quick low-quality previews, then render only the ones you pick in high quality"
+    )
+    
     output_format = st.selectbox(
         "Output Format",
-        ["png", "jpeg"],
+        OUTPUT_FORMATS,
         help="Image format for download"
     )
     
+    local_lettering = st.checkbox(
+        "🔤 Letter titles locally",
+        value=False,
+        help="Generate title-free artwork once and set the title, subtitle and author on it here; "
+             "re-lettering or a series with the same prompt needs no new generation"
+    )
+    
+    image_cache = get_image_cache()
+    
+    force_fresh = st.checkbox(
+        "Force fresh generation",
+        value=False,
+        disabled=image_cache is None,
+        help="Skip the local cache and always call the API"
+    )
+    
+    replace_duplicates = st.checkbox(
+        "Replace near-duplicates",
+        value=False,
+        help=(
+            "When a new cover looks almost the same as one already in the history, "
+            "request one more variation in its place"
+        )
+    )
+    
+    if image_cache is not None:
+        cache_stats = image_cache.stats()
+        st.caption(
+            f"Cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses · "
+            f"{cache_stats['bytes'] / (1024 * 1024):.1f} of {CACHE_MAX_MB} MB"
+        )
+    
+    throttle_stats = get_throttle().stats()
+    st.caption(
+        f"API concurrency: {throttle_stats['in_flight']} in flight, "
+        f"limit {throttle_stats['concurrency_limit']:.1f} · {throttle_stats['throttled']} throttled"
+    )
+    
+    scheduler_stats = get_request_scheduler().stats()
+    st.caption(
+        f"Request queue: {scheduler_stats['queue_depth']} waiting · "
+        f"{scheduler_stats['coalesced']} of {scheduler_stats['submitted']} requests coalesced"
+    )
+    
+    show_diagnostics = st.checkbox(
+        "Show diagnostics",
+        value=False,
+        help="Latency percentiles per generation stage (filled in at the bottom of the sidebar)"
+    )
+    
     st.divider()
     
     # About
@@ -145,8 +425,9 @@ with col1:
 
 with col2:
     # Stats
-    if st.session_state.generated_images:
-        st.metric("Covers Generated", len(st.session_state.generated_images))
+    history_count = history_store.count()
+    if history_count:
+        st.metric("Covers Generated", history_count)
 
 st.divider()
 
@@ -164,22 +445,7 @@ with col_input1:
     
     book_category = st.selectbox(
         "Book Category *",
-        [
-            "Personal Growth",
-            "Business Strategy",
-            "Marketing",
-            "Sales",
-            "Startups",
-            "Psychology",
-            "Sociology",
-            "Biographies",
-            "History",
-            "Religious",
-            "Spirituality",
-            "Philosophy",
-            "Language Learning",
-            "Children's Books"
-        ],
+        BOOK_CATEGORIES,
         help="Select the category for thematic color palette"
     )
 
@@ -202,32 +468,16 @@ with st.expander("🎨 Advanced Customization"):
     with col_adv1:
         style_preference = st.multiselect(
             "Style Preferences",
-            [
-                "Vector",
-                "Geometric",
-                "Minimalist",
-                "Bold",
-                "Elegant",
-                "Modern",
-                "Classic",
-                "Abstract"
-            ],
-            default=["Vector", "Geometric", "Minimalist"],
+            STYLE_OPTIONS,
+            default=DEFAULT_STYLES,
             help="Select multiple styles for the cover design"
         )
     
     with col_adv2:
         color_preference = st.multiselect(
             "Color Tone",
-            [
-                "Warm",
-                "Cool",
-                "Neutral",
-                "Vibrant",
-                "Pastel",
-                "Bold"
-            ],
-            default=["Warm"],
+            COLOR_OPTIONS,
+            default=DEFAULT_COLORS,
             help="Choose the color tone for your cover"
         )
     
@@ -236,60 +486,30 @@ with st.expander("🎨 Advanced Customization"):
         placeholder="Add any specific requirements or style preferences...",
         height=80
     )
-
-st.divider()
-
-# Build prompt function
-def build_prompt(title, summary, category, styles, colors, additional):
-    """Build the complete prompt for image generation"""
-    
-    category_rules = {
-        "Personal Growth": "warm soft tones",
-        "Business Strategy": "structured warm neutrals with dark accents",
-        "Marketing": "bright high contrast warm colors",
-        "Sales": "warm reds with deep navy",
-        "Startups": "blue dominant tones with warm highlights",
-        "Psychology": "purple blue with subtle warm accents",
-        "Sociology": "natural greens and earth tones",
-        "Biographies": "soft natural colors, stylized portrait or silhouette",
-        "History": "earth tones with deep blues",
-        "Religious": "soft earth tones with golden light",
-        "Spirituality": "warm mystical hues",
-        "Philosophy": "neutral tones with strong contrast",
-        "Language Learning": "warm friendly tones",
-        "Children's Books": "bright playful colors and rounded shapes"
-    }
     
-    styles_str = ", ".join(styles) if styles else "Vector, Geometric, Minimalist"
-    colors_str = ", ".join(colors) if colors else "Warm"
-    color_palette = category_rules.get(category, "warm soft tones")
+    st.caption("🔤 Lettering (used when \"Letter titles locally\" is checked)")
+    col_letter1, col_letter2, col_letter3, col_letter4 = st.columns(4)
     
-    prompt = f"""Create a professional book cover illustration for: "{title}"
-
-Book Category: {category}
-Book Summary: {summary}
-
-Design Requirements:
-- Style: {styles_str}
-- Color Tone: {colors_str}
-- Color Palette: {color_palette}
-- Layout: Vertical (3 by 2 ratio)
-- Format: Clean editorial vector style
-
-Composition Rules:
-- Use large, bold geometric vector shapes
-- Create one clear metaphor that represents the book's core idea
-- Keep forms solid, crisp, and immediately readable
-- Avoid small icons or decorative clutter
-- Use soft gradients and minimal grain texture for depth
-- Include title at bottom: "{title}"
-- No realism - pure vector design
+    with col_letter1:
+        book_subtitle = st.text_input("Subtitle", placeholder="Optional")
+    
+    with col_letter2:
+        book_author = st.text_input("Author", placeholder="Optional")
+    
+    with col_letter3:
+        title_font = st.selectbox("Title Font", list(FONTS), index=list(FONTS).index(DEFAULT_FONT))
+    
+    with col_letter4:
+        title_placement = st.selectbox("Title Placement", PLACEMENTS)
 
-{f'Additional Requirements: {additional}' if additional else ''}
+lettering = {
+    "subtitle": book_subtitle,
+    "author": book_author,
+    "font": title_font,
+    "placement": title_placement
+} if local_lettering else None
 
-Generate a visually striking, professional book cover that immediately communicates the book's theme and appeals to the target audience."""
-    
-    return prompt
+st.divider()
 
 # ============================================================================
 # EDITABLE PROMPT SECTION - MAIN FEATURE
@@ -305,36 +525,57 @@ st.markdown("""
 # Info box
 st.markdown("""
 <div class="prompt-info">
-    <strong>💡 Tip:</strong> The prompt below controls exactly what the AI creates. Edit keywords, add instructions, or completely rewrite it. Click "Auto-Generate" to rebuild from your book details.
+    <strong>💡 Tip:</strong> The prompt below controls exactly what the AI creates.
+    Edit keywords, add instructions, or completely rewrite it.
+    Click "Auto-Generate" to rebuild from your book details.
 </div>
 """, unsafe_allow_html=True)
 
-# Auto-generate button and prompt together
-col_prompt_button, col_prompt_space = st.columns([1, 4])
-
-with col_prompt_button:
-    if st.button("🔄 Auto-Generate Prompt", use_container_width=True):
-        if book_title and book_summary:
-            auto_prompt = build_prompt(
-                book_title,
-                book_summary,
-                book_category,
-                style_preference,
-                color_preference,
-                custom_prompt_addition
+
+def set_prompt(prompt):
+    """Replace the editor text; call from a widget callback, before the editor is drawn"""
+    st.session_state.current_prompt = prompt
+    st.session_state.main_prompt_editor = prompt
+
+
+def auto_generate_prompt(title, summary, category, styles, colors, additional, include_title=True):
+    if title and summary:
+        set_prompt(build_prompt(title, summary, category, styles, colors, additional, include_title))
+
+
+# The editor's widget state is seeded from current_prompt (kept across reruns and by "Load This Prompt")
+if "main_prompt_editor" not in st.session_state:
+    st.session_state.main_prompt_editor = st.session_state.current_prompt
+
+
+@st.fragment
+def render_prompt_editor(
+    book_title, book_summary, book_category, style_preference, color_preference, custom_prompt_addition, include_title
+):
+    """Prompt editor and its actions; editing reruns only this fragment, not the gallery"""
+    render_started = time.perf_counter()
+    
+    # Auto-generate button and prompt together
+    col_prompt_button, col_prompt_space = st.columns([1, 4])
+    
+    with col_prompt_button:
+        if st.button(
+            "🔄 Auto-Generate Prompt",
+            use_container_width=True,
+            on_click=auto_generate_prompt,
+            args=(
+                book_title, book_summary, book_category, style_preference, color_preference, custom_prompt_addition,
+                include_title
             )
-            st.session_state.current_prompt = auto_prompt
-            st.rerun()
-        else:
+        ) and not (book_title and book_summary):
             st.error("Enter title & summary first")
-
-# MAIN EDITABLE PROMPT TEXT AREA
-# This is where users actually edit the prompt
-user_prompt = st.text_area(
-    "Prompt (Editable) *",
-    value=st.session_state.current_prompt,
-    height=400,
-    placeholder="""Enter or edit your prompt here. Example:
+    
+    # MAIN EDITABLE PROMPT TEXT AREA
+    # This is where users actually edit the prompt
+    user_prompt = st.text_area(
+        "Prompt (Editable) *",
+        height=400,
+        placeholder="""Enter or edit your prompt here. Example:
 
 Create a professional book cover for "Book Title"
 - Style: Vector, geometric shapes
@@ -343,70 +584,56 @@ Create a professional book cover for "Book Title"
 - Include: Bold title text at bottom
 - No photographs or realistic images
 - Professional and modern look""",
-    help="This is the actual prompt sent to the AI. Edit it to customize your cover design.",
-    key="main_prompt_editor"
-)
-
-# Update session state with user's edits
-st.session_state.current_prompt = user_prompt
-
-# Quick action buttons below prompt
-col_action1, col_action2, col_action3, col_action4 = st.columns(4)
-
-with col_action1:
-    if st.button("📋 Copy Prompt", use_container_width=True):
-        st.info("✅ Select text above and press Ctrl+C (or Cmd+C on Mac)")
-
-with col_action2:
-    if st.button("🗑️ Clear Prompt", use_container_width=True):
-        st.session_state.current_prompt = ""
-        st.rerun()
-
-with col_action3:
-    if st.button("📥 Load Template", use_container_width=True):
-        template = """Create a professional book cover for: "{TITLE}"
-
-Key Visual Elements:
-- [Describe main visual element]
-- [Describe secondary element]
-- [Describe background]
-
-Style & Colors:
-- Style: [Vector/Realistic/Illustration/Abstract]
-- Primary Colors: [Color 1, Color 2, Color 3]
-- Tone: [Professional/Creative/Modern/Classic]
-
-Text:
-- Title: "{TITLE}" - [Size/Position/Style]
-- Subtitle: [If applicable]
-
-Additional Notes:
-- [Any special requirements]
-- [Avoid: List what to avoid]
-- [Target audience: Who will see this?]"""
-        st.session_state.current_prompt = template
-        st.rerun()
-
-with col_action4:
-    if st.button("✨ Generate", use_container_width=True):
-        st.session_state.generate_now = True
-
-st.divider()
-
-# Character count
-prompt_length = len(st.session_state.current_prompt)
-col_char1, col_char2 = st.columns([3, 1])
+        help="This is the actual prompt sent to the AI. Edit it to customize your cover design.",
+        key="main_prompt_editor"
+    )
+    
+    # Update session state with user's edits
+    st.session_state.current_prompt = user_prompt
+    
+    # Quick action buttons below prompt
+    col_action1, col_action2, col_action3, col_action4 = st.columns(4)
+    
+    with col_action1:
+        if st.button("📋 Copy Prompt", use_container_width=True):
+            st.info("✅ Select text above and press Ctrl+C (or Cmd+C on Mac)")
+    
+    with col_action2:
+        st.button("🗑️ Clear Prompt", use_container_width=True, on_click=set_prompt, args=("",))
+    
+    with col_action3:
+        st.button("📥 Load Template", use_container_width=True, on_click=set_prompt, args=(PROMPT_TEMPLATE,))
+    
+    with col_action4:
+        if st.button("✨ Generate", use_container_width=True):
+            st.session_state.generate_now = True
+            # Generation is handled by the full script, outside this fragment
+            st.rerun()
+    
+    st.divider()
+    
+    # Character count
+    prompt_length = len(st.session_state.current_prompt)
+    col_char1, col_char2 = st.columns([3, 1])
+    
+    with col_char1:
+        st.caption(f"Prompt length: {prompt_length} characters")
+    
+    with col_char2:
+        if prompt_length > 2000:
+            st.warning("⚠️ Prompt may be long")
+        elif prompt_length > 500:
+            st.success("✅ Good length")
+        else:
+            st.info("ℹ️ Add more details")
+    
+    metrics.observe("render_seconds", time.perf_counter() - render_started, section="prompt_editor")
 
-with col_char1:
-    st.caption(f"Prompt length: {prompt_length} characters")
 
-with col_char2:
-    if prompt_length > 2000:
-        st.warning("⚠️ Prompt may be long")
-    elif prompt_length > 500:
-        st.success("✅ Good length")
-    else:
-        st.info("ℹ️ Add more details")
+render_prompt_editor(
+    book_title, book_summary, book_category, style_preference, color_preference, custom_prompt_addition,
+    not local_lettering
+)
 
 st.divider()
 
@@ -425,10 +652,11 @@ with col_button1:
     )
 
 with col_button2:
-    if st.session_state.generated_images:
+    if st.session_state.generated_ids:
         clear_button = st.button(
-            "🗑️ Clear History",
-            use_container_width=True
+            "🗑️ Clear My Covers",
+            use_container_width=True,
+            help="Delete the covers generated in this session; other sessions' covers are kept"
         )
     else:
         clear_button = False
@@ -436,8 +664,102 @@ with col_button2:
 with col_button3:
     st.info(f"⏱️ Processing: ~30-60 seconds")
 
-# Handle generation
-# Update the Generation Logic inside the "Handle generation" block:
+# Sweep: one cover per combination of the chosen styles, colors, categories and sizes
+with st.expander("🧪 Style Sweep"):
+    st.caption("Compare looks in one go: every combination becomes one cover, shown side by side in a matrix")
+    col_sweep1, col_sweep2 = st.columns(2)
+    
+    with col_sweep1:
+        sweep_styles = st.multiselect(
+            "Styles",
+            STYLE_OPTIONS,
+            default=[],
+            help="Each style picked here is compared on its own"
+        )
+        sweep_keep_styles = st.checkbox(
+            "Include my style selection",
+            value=True,
+            help="Also compare the styles chosen under Advanced Customization, as one set"
+        )
+        sweep_colors = st.multiselect(
+            "Color Tones",
+            COLOR_OPTIONS,
+            default=COLOR_OPTIONS[:3]
+        )
+    
+    with col_sweep2:
+        sweep_categories = st.multiselect(
+            "Categories",
+            BOOK_CATEGORIES,
+            default=[book_category],
+            help="Each category brings its own palette"
+        )
+        sweep_sizes = st.multiselect(
+            "Sizes",
+            IMAGE_SIZES,
+            default=[image_size]
+        )
+    
+    style_sets = ([style_preference] if sweep_keep_styles else []) + [[style] for style in sweep_styles]
+    sweep_cells, sweep_grid = [], None
+    try:
+        sweep_cells, sweep_grid = expand_grid(
+            book_title,
+            book_summary,
+            custom_prompt_addition,
+            style_sets,
+            [[color] for color in sweep_colors],
+            sweep_categories,
+            sweep_sizes,
+            include_title=not local_lettering
+        )
+    except ValueError as e:
+        st.warning(f"⚠️ {e}")
+    
+    if sweep_cells:
+        st.caption(
+            f"{len(sweep_cells)} distinct covers for a {len(sweep_grid['rows'])} × {len(sweep_grid['columns'])} "
+            f"matrix, {max_parallel} requested at a time"
+        )
+    
+    sweep_button = st.button(
+        "🧪 Run Sweep",
+        use_container_width=True,
+        disabled=not sweep_cells or not (book_title and book_summary),
+        key="sweep_generate"
+    )
+
+if sweep_button:
+    current_api_key = api_key if api_key else os.getenv("BFL_API_KEY")
+    
+    if not st.session_state.api_key_valid and not current_api_key:
+        st.error("❌ Please provide an Azure API Key")
+    else:
+        job_id = job_queue.submit(
+            {
+                "api_key": current_api_key,
+                "prompt": sweep_cells[0]["prompt"],
+                "size": sweep_cells[0]["size"],
+                "format": output_format,
+                "count": len(sweep_cells),
+                "max_parallel": max_parallel,
+                "force_fresh": force_fresh,
+                "quality": DRAFT_QUALITY if draft_mode else "medium",
+                "stream_previews": stream_previews,
+                "cells": sweep_cells,
+                "sweep": sweep_grid,
+                "lettering": lettering,
+                "title": book_title,
+                "category": book_category,
+                "summary": book_summary
+            },
+            owner=st.session_state.session_id
+        )
+        if job_id not in st.session_state.job_ids:
+            st.session_state.job_ids.append(job_id)
+        st.toast("🧪 Sweep queued")
+
+# Handle generation: enqueue a background job and return immediately
 if generate_button or st.session_state.get("generate_now", False):
     st.session_state.generate_now = False
     
@@ -447,180 +769,634 @@ if generate_button or st.session_state.get("generate_now", False):
         st.error("❌ Please provide an Azure API Key")
     elif not book_title or not st.session_state.current_prompt:
         st.error("❌ Please enter Book Title and Prompt")
+    elif lettering and f'"{book_title}"' in st.session_state.current_prompt and (
+        st.session_state.current_prompt != build_prompt(
+            book_title, book_summary, book_category, style_preference, color_preference, custom_prompt_addition
+        )
+    ):
+        # An edited prompt asking for the title would get it painted in and then lettered over
+        st.error("❌ The prompt asks for the title, which is lettered locally: remove it or click Auto-Generate")
     else:
-        progress_bar = st.progress(0)
-        status_text = st.empty()
-        result_container = st.container()
+        generation_prompt = st.session_state.current_prompt
+        if lettering and f'"{book_title}"' in generation_prompt:
+            # Still the auto-generated prompt from before local lettering was turned on
+            generation_prompt = build_prompt(
+                book_title, book_summary, book_category, style_preference, color_preference, custom_prompt_addition,
+                include_title=False
+            )
         
+        # An identical request still in progress returns the same job id
+        job_id = job_queue.submit(
+            {
+                "api_key": current_api_key,
+                "prompt": generation_prompt,
+                "size": image_size,
+                "format": output_format,
+                "count": num_images,
+                "max_parallel": max_parallel,
+                "force_fresh": force_fresh,
+                "replace_duplicates": replace_duplicates,
+                "quality": DRAFT_QUALITY if draft_mode else "medium",
+                "stream_previews": stream_previews,
+                "batched": batch_requests,
+                "lettering": lettering,
+                "title": book_title,
+                "category": book_category,
+                "summary": book_summary
+            },
+            owner=st.session_state.session_id
+        )
+        if job_id not in st.session_state.job_ids:
+            st.session_state.job_ids.append(job_id)
+        st.toast("🎨 Generation queued")
+
+# Pick up jobs that finished since the last run
+for job_id in st.session_state.job_ids:
+    if job_id in st.session_state.collected_job_ids:
+        continue
+    job = job_queue.get(job_id)
+    if job is None:
+        # Pruned, or lost with a server restart
+        st.session_state.collected_job_ids.add(job_id)
+    elif job["status"] in ("done", "failed"):
+        st.session_state.collected_job_ids.add(job_id)
+        st.session_state.generated_ids.extend(job["cover_ids"])
+        st.session_state.last_job = job
+
+
+def render_jobs_panel():
+    """This session's jobs; polls while any are active and reruns the app when one finishes"""
+    jobs = [job_queue.get(job_id) for job_id in reversed(st.session_state.job_ids)]
+    jobs = [job for job in jobs if job]
+    if not jobs:
+        return
+    
+    active = [job for job in jobs if job["status"] in ("queued", "running")]
+    status_icons = {"queued": "⏳", "running": "🎨", "done": "✅", "failed": "❌"}
+    
+    with st.expander(f"🧾 Jobs ({len(active)} active, {job_queue.depth()} queued overall)", expanded=bool(active)):
+        for job in jobs[:10]:
+            st.markdown(
+                f"{status_icons[job['status']]} **{job['spec']['title']}** · "
+                f"{job['status']} · {job['completed']}/{job['total']} images · "
+                f"{job['created_at'].strftime('%H:%M:%S')}"
+            )
+            if job["status"] == "running":
+                st.progress(job["completed"] / max(job["total"], 1))
+    
+    # Partial frames of images still generating; the finished covers replace them
+    for job in active:
+        if not job["previews"]:
+            continue
+        st.caption(f"🎨 Live preview: {job['spec']['title']}")
+        cols = st.columns(max(job["total"], 1))
+        for index, preview in sorted(job["previews"].items()):
+            with cols[index % len(cols)]:
+                st.image(preview, caption=f"Variation {index + 1}", use_container_width=True)
+    
+    finished = [
+        job for job in jobs
+        if job["status"] in ("done", "failed") and job["id"] not in st.session_state.collected_job_ids
+    ]
+    if finished:
+        st.rerun()
+
+
+if any(job_id not in st.session_state.collected_job_ids for job_id in st.session_state.job_ids):
+    st.fragment(render_jobs_panel, run_every=JOB_POLL_SECONDS)()
+else:
+    render_jobs_panel()
+
+
+def finalize_drafts(last_job, draft_ids, api_key):
+    """Queue high-quality renders of the picked drafts, each from its own preview"""
+    spec = last_job["spec"]
+    job_id = job_queue.submit(
+        {
+            "api_key": api_key,
+            "prompt": spec["prompt"],
+            "size": spec["size"],
+            "format": spec["format"],
+            "count": len(draft_ids),
+            "max_parallel": spec["max_parallel"],
+            "force_fresh": False,
+            "quality": FINAL_QUALITY,
+            "draft_ids": draft_ids,
+            "stream_previews": spec.get("stream_previews", False),
+            "lettering": spec.get("lettering"),
+            "title": spec["title"],
+            "category": spec["category"],
+            "summary": spec["summary"]
+        },
+        owner=st.session_state.session_id
+    )
+    if job_id not in st.session_state.job_ids:
+        st.session_state.job_ids.append(job_id)
+
+
+def reletter_results(last_job, records, title, subtitle, author, font, placement):
+    """Set new lettering on the batch's base art; the new covers become the latest results"""
+    cover_ids = []
+    for record in records:
+        cover_id = reletter(history_store, record, title, subtitle, author, font, placement)
+        if cover_id is None:
+            continue
+        cover_ids.append(cover_id)
+        new_record = history_store.get(cover_id)
         try:
-            prompt = st.session_state.current_prompt
-            
-            # Updated Headers: Using Bearer token as per your curl example
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {current_api_key}"
+            duplicate_index.check(new_record)
+        except Exception:
+            pass
+        derivative_store.submit(new_record)
+    
+    spec = last_job["spec"]
+    st.session_state.generated_ids.extend(cover_ids)
+    st.session_state.last_job = {
+        **last_job,
+        "cover_ids": cover_ids,
+        "errors": [],
+        "spec": {
+            **spec,
+            "title": title,
+            "lettering": {
+                **spec["lettering"],
+                "subtitle": subtitle,
+                "author": author,
+                "font": font,
+                "placement": placement
             }
-            
-            url = f"{AZURE_ENDPOINT}?api-version={API_VERSION}"
-            
-            generated_this_batch = []
-            
-            for i in range(num_images):
-                status_text.text(f"🎨 Generating image {i+1}/{num_images}...")
-                progress_bar.progress((i) / num_images)
+        }
+    }
+
+
+def render_sweep(last_job):
+    """A finished sweep as a matrix: style and color down, category and size across"""
+    spec = last_job["spec"]
+    grid = spec["sweep"]
+    records = [history_store.get(cover_id) for cover_id in last_job["cover_ids"]]
+    covers = cell_covers(spec["cells"], [record for record in records if record])
+    
+    st.success(f"✅ Sweep finished: {len(covers)} of {len(spec['cells'])} covers")
+    
+    widths = [1] + [2] * len(grid["columns"])
+    header = st.columns(widths)
+    header[0].markdown("**Style · Color**")
+    for col, label in zip(header[1:], grid["columns"]):
+        col.markdown(f"**{label}**")
+    
+    for label, row in zip(grid["rows"], grid["matrix"]):
+        cols = st.columns(widths)
+        cols[0].markdown(label)
+        for col, index in zip(cols[1:], row):
+            with col:
+                record = covers.get(index)
+                if record is None:
+                    st.caption("❌ Not generated")
+                    continue
+                st.image(record["thumb_path"] or record["path"], use_container_width=True)
+                if record["duplicate_of"]:
+                    st.caption("♊ Near-duplicate of an earlier cover")
+
+
+@st.fragment
+def render_results(last_job, api_key):
+    """The latest finished batch; picking a download format or a draft reruns only this grid"""
+    render_started = time.perf_counter()
+    is_draft = last_job["spec"].get("quality") == DRAFT_QUALITY
+    
+    for error in last_job["errors"]:
+        st.error(f"❌ {error}")
+    
+    if last_job["spec"].get("sweep"):
+        render_sweep(last_job)
+        metrics.observe("render_seconds", time.perf_counter() - render_started, section="results")
+        return
+    
+    generated_this_batch = [history_store.get(cover_id) for cover_id in last_job["cover_ids"]]
+    generated_this_batch = [img_data for img_data in generated_this_batch if img_data]
+    
+    if generated_this_batch:
+        if is_draft:
+            st.success(f"✅ Generated {len(generated_this_batch)} draft(s): pick the ones to render in high quality")
+        else:
+            st.success(f"✅ Generated {len(generated_this_batch)} cover(s)")
+        
+        # Display in grid
+        cols = st.columns(min(len(generated_this_batch), 2))
+        
+        for idx, img_data in enumerate(generated_this_batch):
+            with cols[idx % len(cols)]:
+                st.image(img_data["path"], use_container_width=True)
+                if img_data["duplicate_of"]:
+                    st.caption("♊ Near-duplicate of an earlier cover")
+                if is_draft:
+                    st.checkbox("✏️ Pick this draft", key=f"pick_{img_data['id']}")
                 
-                # Updated Payload: Added quality and compression
-                payload = {
-                    "prompt": prompt,
-                    "size": image_size,
-                    "quality": "medium",      # Required for 1.5
-                    "output_compression": 100, # Required for 1.5
-                    "output_format": output_format,
-                    "n": 1
-                }
+                col_down1, col_down2 = st.columns(2)
                 
-                response = requests.post(url, headers=headers, json=payload, timeout=120)
+                with col_down1:
+                    render_download(
+                        img_data,
+                        f"{img_data['title'].lower().replace(' ', '_')}_{idx+1}",
+                        f"⬇️ Download {idx+1}",
+                        f"batch_download_{img_data['id']}"
+                    )
                 
-                if response.status_code == 200:
-                    result = response.json()
-                    
-                    if "data" in result and len(result["data"]) > 0:
-                        item = result["data"][0]
-                        
-                        # Process b64_json
-                        if "b64_json" in item:
-                            image_data = base64.b64decode(item["b64_json"])
-                            
-                            generated_this_batch.append({
-                                "image": image_data,
-                                "title": book_title,
-                                "category": book_category,
-                                "timestamp": datetime.now(),
-                                "size": image_size,
-                                "summary": book_summary,
-                                "prompt": prompt
-                            })
-                    else:
-                        st.error(f"❌ No data returned for image {i+1}")
-                else:
-                    st.error(f"❌ API Error {response.status_code}: {response.text}")
-            
-            progress_bar.progress(100)
-            status_text.text("✅ Generation complete!")
-            
-            # Display results
-            if generated_this_batch:
-                st.session_state.generated_images.extend(generated_this_batch)
+                with col_down2:
+                    st.info(f"Generated: {img_data['timestamp'].strftime('%H:%M:%S')}")
+        
+        letters = last_job["spec"].get("lettering")
+        if letters:
+            with st.form("reletter_form"):
+                st.markdown("**🔤 Change the lettering** (no new generation)")
+                col_form1, col_form2, col_form3 = st.columns(3)
                 
-                with result_container:
-                    st.success(f"✅ Generated {len(generated_this_batch)} cover(s)")
-                    
-                    # Display in grid
-                    cols = st.columns(min(len(generated_this_batch), 2))
-                    
-                    for idx, img_data in enumerate(generated_this_batch):
-                        with cols[idx % len(cols)]:
-                            st.image(img_data["image"], use_container_width=True)
-                            
-                            col_down1, col_down2 = st.columns(2)
-                            
-                            with col_down1:
-                                st.download_button(
-                                    label=f"⬇️ Download {idx+1}",
-                                    data=img_data["image"],
-                                    file_name=f"{book_title.lower().replace(' ', '_')}_{idx+1}.{output_format}",
-                                    mime=f"image/{output_format}",
-                                    use_container_width=True
-                                )
-                            
-                            with col_down2:
-                                st.info(f"Generated: {img_data['timestamp'].strftime('%H:%M:%S')}")
+                with col_form1:
+                    new_title = st.text_input("Title", value=last_job["spec"]["title"])
+                    new_font = st.selectbox(
+                        "Font",
+                        list(FONTS),
+                        index=list(FONTS).index(letters.get("font", DEFAULT_FONT))
+                    )
+                
+                with col_form2:
+                    new_subtitle = st.text_input("Subtitle", value=letters.get("subtitle", ""))
+                    new_placement = st.selectbox(
+                        "Placement", PLACEMENTS, index=PLACEMENTS.index(letters.get("placement", "bottom"))
+                    )
+                
+                with col_form3:
+                    new_author = st.text_input("Author", value=letters.get("author", ""))
+                
+                if st.form_submit_button("🔤 Re-letter", use_container_width=True) and new_title:
+                    reletter_results(
+                        last_job, generated_this_batch, new_title, new_subtitle, new_author, new_font, new_placement
+                    )
+                    st.rerun()
         
-        except Exception as e:
-            st.error(f"❌ Error: {str(e)}")
+        if is_draft:
+            picked = [
+                img_data["id"] for img_data in generated_this_batch
+                if st.session_state.get(f"pick_{img_data['id']}")
+            ]
+            # A full rerun starts polling the new job
+            if st.button(
+                f"✨ Render {len(picked)} picked draft(s) in high quality",
+                type="primary",
+                disabled=not picked or not api_key
+            ):
+                finalize_drafts(last_job, picked, api_key)
+                st.rerun()
+    
+    metrics.observe("render_seconds", time.perf_counter() - render_started, section="results")
+
 
-# Clear history
+# Display the latest finished batch
+last_job = st.session_state.get("last_job")
+if last_job:
+    render_results(last_job, api_key)
+
+# Clear this session's covers; the store is shared, so nobody else's are touched
 if clear_button:
-    st.session_state.generated_images = []
-    st.success("✅ History cleared")
+    removed = history_store.delete(st.session_state.generated_ids)
+    derivative_store.remove(removed)
+    duplicate_index.reload()
+    st.session_state.generated_ids = []
+    st.session_state.last_job = None
+    st.success("✅ Your covers were deleted")
     st.rerun()
 
 st.divider()
 
-# Display history
-if st.session_state.generated_images:
+
+def gallery_thumbnail(record):
+    """Preview path for a history record, creating it once for older covers"""
+    if record["thumb_path"]:
+        return record["thumb_path"]
+    # Cached pages can predate a backfill made by an earlier rerun
+    existing = history_store.thumbnail_path(record["image_hash"], THUMBNAIL_FORMAT)
+    if os.path.exists(existing):
+        return existing
+    try:
+        thumbnail = make_thumbnail(record["path"])
+        return history_store.set_thumbnail(record["image_hash"], thumbnail)
+    except Exception:
+        return record["path"]
+
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def cached_history_page(version, categories, search, newest_first, page_size, cursor, hide_duplicates):
+    """History reads keyed by the store version, so a new or cleared cover invalidates them"""
+    return history_store.page(list(categories), search, newest_first, page_size, cursor, hide_duplicates)
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def cached_match_count(version, categories, search, hide_duplicates):
+    """(covers, summed image bytes) a filter selects"""
+    return (
+        history_store.count_matching(list(categories), search, hide_duplicates),
+        history_store.bytes_matching(list(categories), search, hide_duplicates)
+    )
+
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def cached_categories(version):
+    return history_store.categories()
+
+
+def select_download(cover_id):
+    st.session_state.selected_download = cover_id
+
+
+def history_page_back():
+    st.session_state.history_cursors.pop()
+
+
+def history_page_forward(cursor):
+    st.session_state.history_cursors.append(cursor)
+
+
+@st.fragment
+def render_history():
+    """Filters, export and the paged gallery; interacting here reruns only this fragment"""
+    render_started = time.perf_counter()
+    # Re-read: this run may have just added the first covers
+    version = history_store.version()
+    if not version[1]:
+        return
+    
     st.subheader("📚 Generation History")
     
     # Filter options
-    col_filter1, col_filter2 = st.columns(2)
+    col_filter1, col_filter2, col_filter3, col_filter4 = st.columns([2, 2, 1, 1])
     
     with col_filter1:
         filter_category = st.multiselect(
             "Filter by Category",
-            sorted(set([img["category"] for img in st.session_state.generated_images])),
+            cached_categories(version),
             help="Filter history by book category"
         )
     
     with col_filter2:
+        search_text = st.text_input(
+            "Search",
+            placeholder="Title, summary or prompt words",
+            help="Full-text search over title, summary and prompt"
+        )
+    
+    with col_filter3:
         sort_order = st.selectbox(
             "Sort by",
             ["Newest First", "Oldest First"],
             help="Sort generation history"
         )
     
-    # Filter and sort
-    filtered_images = st.session_state.generated_images
+    with col_filter4:
+        page_size = st.selectbox(
+            "Per page",
+            [12, 24, 48],
+            index=1,
+            help="Covers shown per page"
+        )
+    
+    hide_duplicates = st.checkbox(
+        "Hide near-duplicates",
+        value=True,
+        help="Leave out covers that look almost the same as an earlier one"
+    )
     
-    if filter_category:
-        filtered_images = [img for img in filtered_images if img["category"] in filter_category]
+    # Page cursors are only valid for the filters they were fetched with
+    history_filters = (tuple(filter_category), search_text, sort_order, page_size, hide_duplicates)
+    if st.session_state.get("history_filters") != history_filters:
+        st.session_state.history_filters = history_filters
+        st.session_state.history_cursors = [None]
     
-    if sort_order == "Oldest First":
-        filtered_images = sorted(filtered_images, key=lambda x: x["timestamp"])
-    else:
-        filtered_images = sorted(filtered_images, key=lambda x: x["timestamp"], reverse=True)
+    # Bulk export of everything the filters select, built only when clicked
+    export_count, export_bytes = cached_match_count(version, tuple(filter_category), search_text, hide_duplicates)
+    col_export1, col_export2 = st.columns([3, 1])
+    
+    with col_export1:
+        st.caption(f"{export_count} cover(s) match the current filters")
+    
+    with col_export2:
+        if export_bytes > EXPORT_MAX_MB * 1024 * 1024:
+            st.caption(
+                f"📦 {export_bytes / (1024 * 1024):.0f} MB is over {EXPORT_MAX_MB:g} MB: "
+                "export with `python history_export.py`"
+            )
+        elif export_count:
+            def build_export(
+                categories=tuple(filter_category),
+                search=search_text,
+                newest_first=sort_order != "Oldest First",
+                hide_duplicates=hide_duplicates
+            ):
+                # Spool to disk while building; only the finished archive is handed to Streamlit
+                archive = tempfile.TemporaryFile()
+                records = history_store.iter_records(
+                    list(categories), search, newest_first, hide_duplicates=hide_duplicates
+                )
+                write_zip(records, archive)
+                archive.seek(0)
+                return archive
+        
+            st.download_button(
+                label=f"📦 Export {export_count} (ZIP)",
+                data=build_export,
+                file_name=f"book_covers_{datetime.now().strftime('%Y%m%d_%H%M')}.zip",
+                mime="application/zip",
+                on_click="ignore",
+                use_container_width=True,
+                key="export_history"
+            )
+    
+    # Filter, sort and page in the store; records carry metadata and file paths, not bytes
+    filtered_images, next_cursor = cached_history_page(
+        version,
+        tuple(filter_category),
+        search_text,
+        sort_order != "Oldest First",
+        page_size,
+        st.session_state.history_cursors[-1],
+        hide_duplicates
+    )
     
     if filtered_images:
         # Display in gallery
         cols_per_row = 4
         for i in range(0, len(filtered_images), cols_per_row):
             cols = st.columns(cols_per_row)
-            
+        
             for col_idx, col in enumerate(cols):
                 img_idx = i + col_idx
-                
+            
                 if img_idx < len(filtered_images):
                     img_data = filtered_images[img_idx]
-                    
+                
                     with col:
-                        st.image(img_data["image"], use_container_width=True)
+                        st.image(gallery_thumbnail(img_data), use_container_width=True)
                         st.caption(f"📖 {img_data['title']}")
                         st.caption(f"🏷️ {img_data['category']}")
                         st.caption(f"⏰ {img_data['timestamp'].strftime('%H:%M')}")
-                        
+                        if img_data["duplicate_of"]:
+                            st.caption("♊ Near-duplicate")
+                    
                         with st.expander("📝 View Details"):
                             st.markdown("**Summary:**")
                             st.write(img_data['summary'])
                             st.markdown("**Prompt:**")
                             st.code(img_data['prompt'], language="text")
-                            
+                        
                             # Button to load this prompt
-                            if st.button(f"📥 Load This Prompt", key=f"load_prompt_{img_idx}"):
-                                st.session_state.current_prompt = img_data['prompt']
+                            # The editor is another fragment, so loading reruns the whole app
+                            if st.button(
+                                f"📥 Load This Prompt",
+                                key=f"load_prompt_{img_data['id']}",
+                                on_click=set_prompt,
+                                args=(img_data['prompt'],)
+                            ):
                                 st.rerun()
                         
-                        st.download_button(
-                            label="⬇️ Download",
-                            data=img_data["image"],
-                            file_name=f"{img_data['title'].lower().replace(' ', '_')}.{output_format}",
-                            mime=f"image/{output_format}",
-                            use_container_width=True,
-                            key=f"download_{img_idx}"
-                        )
+                            # Full resolution is only sent when asked for
+                            if st.button("🖼️ Show Full Size", key=f"full_size_{img_data['id']}"):
+                                st.image(img_data["path"], use_container_width=True)
+                    
+                        # The download button embeds the file, so only the
+                        # selected cover carries its full-size bytes
+                        if st.session_state.get("selected_download") == img_data["id"]:
+                            render_download(
+                                img_data,
+                                img_data['title'].lower().replace(' ', '_'),
+                                "⬇️ Save Image",
+                                f"download_{img_data['id']}"
+                            )
+                        else:
+                            st.button(
+                                "⬇️ Download",
+                                use_container_width=True,
+                                key=f"prepare_download_{img_data['id']}",
+                                on_click=select_download,
+                                args=(img_data["id"],)
+                            )
+    
+        # Page navigation
+        page_number = len(st.session_state.history_cursors)
+        col_page1, col_page2, col_page3 = st.columns([1, 2, 1])
+    
+        with col_page1:
+            st.button(
+                "⬅️ Previous",
+                use_container_width=True,
+                disabled=page_number == 1,
+                on_click=history_page_back
+            )
+    
+        with col_page2:
+            st.caption(f"Page {page_number}")
+    
+        with col_page3:
+            st.button(
+                "Next ➡️",
+                use_container_width=True,
+                disabled=next_cursor is None,
+                on_click=history_page_forward,
+                args=(next_cursor,)
+            )
     else:
         st.info("No covers match the selected filters")
+    
+    metrics.observe("render_seconds", time.perf_counter() - render_started, section="history")
+
+
+# Display history
+render_history()
 
 st.divider()
 
+# Diagnostics (rendered last so this run's render timings are included)
+if show_diagnostics:
+    with st.sidebar:
+        st.subheader("📈 Diagnostics")
+        
+        summary_rows = metrics.REGISTRY.summary()
+        if summary_rows:
+            st.dataframe(
+                [
+                    {
+                        "stage": row["metric"],
+                        "n": row["count"],
+                        "mean": round(row["mean"], 3),
+                        "p50": round(row["p50"], 3),
+                        "p95": round(row["p95"], 3),
+                        "p99": round(row["p99"], 3)
+                    }
+                    for row in summary_rows
+                ],
+                hide_index=True,
+                use_container_width=True
+            )
+        else:
+            st.caption("No measurements yet")
+        
+        for name, value in metrics.REGISTRY.counters().items():
+            st.caption(f"{name}: {value:g}")
+        
+        router = get_router()
+        if router is not None:
+            st.dataframe(
+                [
+                    {
+                        "deployment": deployment["name"],
+                        "state": deployment["state"],
+                        "requests": deployment["requests"],
+                        "failures": deployment["failures"],
+                        "latency": round(deployment["latency_s"], 2) if deployment["latency_s"] is not None else None,
+                        "in flight": deployment["in_flight"]
+                    }
+                    for deployment in router.stats()
+                ],
+                hide_index=True,
+                use_container_width=True
+            )
+        
+        batch_stats = get_batch_sizer().stats()
+        if batch_stats["requests"]:
+            st.caption(
+                f"Batching: {batch_stats['images']} images in {batch_stats['requests']} requests, "
+                f"{batch_stats['short_responses']} short · batch size {batch_stats['size']} "
+                f"(endpoint limit {batch_stats['limit']})"
+            )
+        
+        hedge_policy = get_hedge_policy()
+        if hedge_policy is not None:
+            hedge_stats = hedge_policy.stats()
+            hedge_after = hedge_stats["hedge_after_s"]
+            st.caption(
+                f"Hedging: {hedge_stats['fired']} of {hedge_stats['calls']} requests hedged, "
+                f"{hedge_stats['won']} won, {hedge_stats['skipped']} over budget · "
+                + (f"hedge after {hedge_after:.1f}s" if hedge_after is not None else "still learning latencies")
+            )
+        
+        col_diag1, col_diag2 = st.columns(2)
+        
+        with col_diag1:
+            st.download_button(
+                "Prometheus",
+                data=metrics.REGISTRY.to_prometheus(),
+                file_name="cover_metrics.prom",
+                mime="text/plain",
+                use_container_width=True
+            )
+        
+        with col_diag2:
+            st.download_button(
+                "JSON lines",
+                data=metrics.REGISTRY.to_json_lines(),
+                file_name="cover_metrics.jsonl",
+                mime="application/x-ndjson",
+                use_container_width=True
+            )
+
 # Footer
 st.markdown("""
 ---
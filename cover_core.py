@@ -0,0 +1,51 @@
+"""Import-light core of the cover generator, usable without Streamlit.
+
+Everything a worker, the batch CLI or another service needs to turn book
+details into images: prompt building, payload construction, request
+execution and response decoding. Heavy dependencies (requests, Pillow)
+are imported on first use, and nothing here imports Streamlit, so
+`import cover_core` costs milliseconds. book_image_v1.py is the UI layer
+on top of this.
+"""
+from generation import (
+    API_VERSION,
+    AZURE_ENDPOINT,
+    DRAFT_QUALITY,
+    FINAL_QUALITY,
+    IMAGE_SIZES,
+    OUTPUT_FORMATS,
+    QUALITIES,
+    build_payload,
+    endpoint_url,
+    generate_variations,
+    request_headers,
+    request_image,
+    request_images,
+)
+from b64_stream import read_images
+from http_client import create_session, post_with_retry
+from prompts import BOOK_CATEGORIES, CATEGORY_PALETTES, build_prompt
+from thumbnails import make_thumbnail
+
+__all__ = [
+    "API_VERSION",
+    "AZURE_ENDPOINT",
+    "BOOK_CATEGORIES",
+    "CATEGORY_PALETTES",
+    "DRAFT_QUALITY",
+    "FINAL_QUALITY",
+    "IMAGE_SIZES",
+    "OUTPUT_FORMATS",
+    "QUALITIES",
+    "build_payload",
+    "build_prompt",
+    "create_session",
+    "endpoint_url",
+    "generate_variations",
+    "make_thumbnail",
+    "post_with_retry",
+    "read_images",
+    "request_headers",
+    "request_image",
+    "request_images",
+]
@@ -0,0 +1,271 @@
+"""Other formats and sizes of stored covers, rendered outside the UI process.
+
+A derivative is a named recipe (format, longest side, quality) applied to
+the stored original. Pillow encoding is CPU-bound, so renders run in
+worker processes instead of competing with Streamlit's threads for the GIL.
+Outputs are files keyed by the original's content hash, so each one is
+made once no matter how many covers or sessions share the image, and a
+different format never needs another API call.
+"""
+import json
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+
+import metrics
+
+# name -> (label, format, largest longest side in pixels or None for the original size, quality);
+# smaller originals keep their size, since upscaling only adds bytes, not detail
+DERIVATIVES = {
+    "png": ("PNG master", "png", None, None),
+    "jpeg-print": ("JPEG print (up to 2048px)", "jpeg", 2048, 95),
+    "webp-print": ("WebP print (up to 2048px)", "webp", 2048, 90),
+    "jpeg-web": ("JPEG web (1024px)", "jpeg", 1024, 85),
+    "webp-web": ("WebP web (1024px)", "webp", 1024, 80),
+    "webp-small": ("WebP small (512px)", "webp", 512, 80),
+}
+DEFAULT_DERIVATIVES = ["png", "jpeg-print", "jpeg-web", "webp-web"]
+
+
+def render_derivative(source_path, target_path, image_format, max_side=None, quality=None):
+    """Re-encode source_path into target_path; returns the seconds spent.
+
+    Runs in a worker process, so it only takes and returns plain values.
+    """
+    from PIL import Image
+
+    started = time.perf_counter()
+    with Image.open(source_path) as img:
+        img.load()
+        if max_side and max(img.size) > max_side:
+            scale = max_side / max(img.size)
+            img = img.resize(
+                (max(1, round(img.width * scale)), max(1, round(img.height * scale))),
+                Image.LANCZOS
+            )
+        if image_format == "jpeg" and img.mode != "RGB":
+            img = img.convert("RGB")
+        elif img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "transparency" in img.info else "RGB")
+
+        options = {}
+        if quality:
+            options["quality"] = quality
+        if image_format == "jpeg":
+            options.update(optimize=True, progressive=True)
+
+        # Write next to the target and rename, so readers never see a partial file
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target_path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                img.save(f, format=image_format.upper(), **options)
+            os.replace(tmp_path, target_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    return time.perf_counter() - started
+
+
+def serve():
+    """Worker loop: one JSON render request per stdin line, one JSON answer per stdout line"""
+    for line in sys.stdin:
+        try:
+            answer = {"seconds": render_derivative(**json.loads(line))}
+        except Exception as e:
+            answer = {"error": f"{type(e).__name__}: {e}"}
+        sys.stdout.write(json.dumps(answer) + "\n")
+        sys.stdout.flush()
+
+
+class RenderWorkers:
+    """Up to `workers` render processes, each running this file as a script.
+
+    multiprocessing workers would re-import the host's __main__ (under
+    Streamlit, the app script); plain subprocesses load only this module,
+    and starting them changes no interpreter-wide state. Processes start
+    on demand, serve one render at a time and exit when the host does.
+    """
+
+    def __init__(self, workers=2):
+        self._threads = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="derivative")
+        self._idle = queue.SimpleQueue()
+        self._processes = []
+        self._lock = threading.Lock()
+
+    def _process(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            process = subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__)],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                text=True
+            )
+            with self._lock:
+                self._processes.append(process)
+            return process
+
+    def _render(self, request):
+        process = self._process()
+        try:
+            process.stdin.write(json.dumps(request) + "\n")
+            process.stdin.flush()
+            line = process.stdout.readline()
+        except OSError:
+            line = ""
+        if not line:
+            # The worker died; the next render starts a fresh one
+            process.kill()
+            with self._lock:
+                self._processes.remove(process)
+            raise RuntimeError("Derivative worker exited")
+        self._idle.put(process)
+        answer = json.loads(line)
+        if "error" in answer:
+            raise RuntimeError(answer["error"])
+        return answer["seconds"]
+
+    def submit(self, source_path, target_path, image_format, max_side=None, quality=None):
+        """Render in a worker; returns a Future of the seconds spent"""
+        # A worker resolves relative paths against the directory it was started in
+        request = {
+            "source_path": os.path.abspath(source_path),
+            "target_path": os.path.abspath(target_path),
+            "image_format": image_format,
+            "max_side": max_side,
+            "quality": quality
+        }
+        return self._threads.submit(self._render, request)
+
+    def shutdown(self):
+        self._threads.shutdown(wait=True)
+        with self._lock:
+            processes, self._processes = self._processes, []
+        for process in processes:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+            process.wait()
+
+
+class DerivativeStore:
+    """Derivative files for history records, rendered on demand by RenderWorkers.
+
+    names is the configured set (keys of DERIVATIVES) that submit() prepares
+    for every new cover. The workers are started on first use.
+    """
+
+    def __init__(self, directory, names=None, workers=2):
+        unknown = [name for name in names or [] if name not in DERIVATIVES]
+        if unknown:
+            raise ValueError(f"Unknown derivatives: {', '.join(unknown)}")
+        self.directory = directory
+        self.names = list(names) if names is not None else list(DEFAULT_DERIVATIVES)
+        self.workers = workers
+        self._pool = None
+        self._in_flight = {}  # target path -> Future, while rendering
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _executor(self):
+        # Caller holds the lock
+        if self._pool is None:
+            self._pool = RenderWorkers(self.workers)
+        return self._pool
+
+    def options(self, record):
+        """Configured derivative names worth offering for a record.
+
+        A full-size recipe in the record's own format is the original, so it
+        is left out.
+        """
+        return [
+            name for name in self.names
+            if not (DERIVATIVES[name][2] is None and DERIVATIVES[name][1] == record["format"])
+        ]
+
+    def path(self, record, name):
+        """Where a derivative of record lives (the original itself for an identity recipe)"""
+        _, image_format, max_side, _ = DERIVATIVES[name]
+        if max_side is None and image_format == record["format"]:
+            return record["path"]
+        image_hash = record["image_hash"]
+        return os.path.join(self.directory, image_hash[:2], f"{image_hash}.{name}.{image_format}")
+
+    def submit(self, record, names=None):
+        """Start rendering any missing derivatives; returns {name: Future of the file path}"""
+        futures = {}
+        for name in self.names if names is None else names:
+            target = self.path(record, name)
+            with self._lock:
+                if target in self._in_flight:
+                    futures[name] = self._in_flight[target]
+                    continue
+                if os.path.exists(target):
+                    futures[name] = Future()
+                    futures[name].set_result(target)
+                    continue
+                _, image_format, max_side, quality = DERIVATIVES[name]
+                rendering = self._executor().submit(record["path"], target, image_format, max_side, quality)
+                future = Future()
+                self._in_flight[target] = futures[name] = future
+            rendering.add_done_callback(partial(self._finish, target, name, future))
+        return futures
+
+    def _finish(self, target, name, future, rendering):
+        with self._lock:
+            self._in_flight.pop(target, None)
+        try:
+            seconds = rendering.result()
+        except BaseException as e:
+            metrics.increment("derivatives_total", derivative=name, status="failed")
+            future.set_exception(e)
+            return
+        metrics.observe("derivative_seconds", seconds, derivative=name)
+        metrics.increment("derivatives_total", derivative=name, status="done")
+        future.set_result(target)
+
+    def ensure(self, record, name, timeout=None):
+        """Path of one derivative, waiting for it to render if needed"""
+        return self.submit(record, [name])[name].result(timeout=timeout)
+
+    def remove(self, image_hashes):
+        """Delete the derivative files of images that are gone from the history"""
+        for image_hash in image_hashes:
+            shard = os.path.join(self.directory, image_hash[:2])
+            try:
+                names = os.listdir(shard)
+            except OSError:
+                continue
+            for name in names:
+                if name.startswith(f"{image_hash}."):
+                    try:
+                        os.remove(os.path.join(shard, name))
+                    except OSError:
+                        pass
+
+    def clear(self):
+        """Delete every derivative file (renders still running may recreate theirs)"""
+        for entry in os.listdir(self.directory):
+            shutil.rmtree(os.path.join(self.directory, entry), ignore_errors=True)
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown()
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,265 @@
+"""Image generation requests against the Azure image endpoint"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+
+import metrics
+from b64_stream import is_event_stream, read_event_stream, read_images
+from http_client import DEFAULT_TOTAL_TIMEOUT, post_with_retry
+
+# COVER_AZURE_ENDPOINT overrides it, e.g. to point the app at mock_image_server.py
+AZURE_ENDPOINT = "https://porchazureopenai.openai.azure.com/openai/deployments/gpt-image-1.5/images/generations"
+API_VERSION = "2024-02-01"
+
+IMAGE_SIZES = ["1024x1024", "1024x576", "640x960"]
+OUTPUT_FORMATS = ["png", "jpeg"]
+QUALITIES = ["low", "medium", "high"]
+# Draft mode previews every variation cheaply, then renders only the picked ones at full quality
+DRAFT_QUALITY = "low"
+FINAL_QUALITY = "high"
+
+# Bodies are read after post_with_retry returns, so a dropped transfer gets its own retry
+BODY_ATTEMPTS = 2
+# Partial frames requested per image in streaming mode (the API allows 0-3)
+PARTIAL_IMAGES = 2
+# Error for a response that held no images; a batch treats it as a shortfall to re-request
+NO_IMAGE_DATA = "No image data in response"
+# Endpoint URLs that refused a streaming request; they get plain requests from then on
+_NO_STREAMING = set()
+
+
+def endpoint_url(endpoint=None, api_version=API_VERSION):
+    """Request URL of an endpoint; the configured one by default.
+
+    The environment is read per call, not at import, so a .env the entry
+    point loads after importing this module still applies.
+    """
+    endpoint = endpoint or os.getenv("COVER_AZURE_ENDPOINT", AZURE_ENDPOINT)
+    return f"{endpoint}?api-version={api_version}"
+
+
+def edits_url(url):
+    """The images/edits endpoint of the same deployment, for rendering from a reference image"""
+    return url.replace("/images/generations", "/images/edits", 1)
+
+
+def request_headers(api_key):
+    """Headers for the image endpoint (Bearer token as per the curl example)"""
+    return {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {api_key}"
+    }
+
+
+def build_payload(prompt, size, output_format, quality="medium"):
+    """Build the request body for a single image"""
+    return {
+        "prompt": prompt,
+        "size": size,
+        "quality": quality,       # low, medium or high on 1.5
+        "output_compression": 100, # Required for 1.5
+        "output_format": output_format,
+        "n": 1
+    }
+
+
+def request_image(session, url, headers, payload, reference=None, **options):
+    """Send one generation request and return (image, error).
+
+    The image comes back as a read-only memoryview over the only full copy
+    made; anything that accepts bytes (files, hashlib, Pillow via BytesIO)
+    takes it. Options are those of request_images.
+    """
+    images, error = request_images(session, url, headers, payload, reference, **options)
+    if error:
+        return None, error
+    return images[0], None
+
+
+def request_images(
+    session,
+    url,
+    headers,
+    payload,
+    reference=None,
+    hedge=None,
+    router=None,
+    on_partial=None,
+    **retry_options
+):
+    """Send one generation request and return (images, error).
+
+    A payload with "n" above 1 asks for several images in one call; the
+    list holds those that came back, which may be fewer than requested.
+    The body is streamed and its base64 decoded as it arrives.
+    With a reference image (encoded bytes), the request goes to the edits
+    endpoint of the deployment and renders the prompt from that image.
+    With a hedging.HedgePolicy, a request slower than its learned
+    percentile is duplicated and the first image back is used. With a
+    routing.Router, url is ignored: the request goes to a deployment the
+    router picks (with that deployment's key and throttle, if it has
+    them) and fails over to another one when it doesn't succeed.
+
+    With on_partial, a single image is requested in streaming mode and
+    on_partial(image) receives each partial image as the server sends it.
+    Endpoints that don't stream get the plain request instead.
+    """
+    if hedge is not None:
+        return hedge.run(
+            partial(
+                request_images, session, url, headers, payload, reference,
+                router=router, on_partial=on_partial, **retry_options
+            ),
+            ok=lambda result: result[1] is None
+        )
+    if router is not None:
+        def routed(deployment, throttle):
+            options = {**retry_options, "throttle": throttle, "max_attempts": router.attempts_per_hop}
+            deployment_headers = request_headers(deployment.api_key) if deployment.api_key else headers
+            return request_images(
+                session, deployment.url, deployment_headers, payload, reference, on_partial=on_partial, **options
+            )
+
+        return router.run(routed)
+
+    files = None
+    if reference is not None:
+        url = edits_url(url)
+        files = {"image": ("reference.png", bytes(reference), "image/png")}
+
+    # Partial frames carry no variation index, so only single-image requests stream
+    streaming = on_partial is not None and payload.get("n", 1) == 1 and url not in _NO_STREAMING
+    request_started = time.perf_counter()
+    first_partial = []
+
+    def partial_image(image):
+        if not first_partial:
+            first_partial.append(time.perf_counter() - request_started)
+            metrics.observe("first_partial_seconds", first_partial[0])
+        metrics.increment("partial_images_total")
+        on_partial(image)
+
+    # Body retries and the fallback from streaming share one deadline with the first request
+    total_timeout = retry_options.pop("total_timeout", DEFAULT_TOTAL_TIMEOUT)
+    deadline = time.monotonic() + total_timeout
+
+    with metrics.timer("image_request_seconds"):
+        for attempt in range(BODY_ATTEMPTS + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None, f"Gave up after {total_timeout}s"
+            body = {**payload, "stream": True, "partial_images": PARTIAL_IMAGES} if streaming else payload
+            response = post_with_retry(
+                session, url, headers, body, stream=True, files=files, total_timeout=remaining, **retry_options
+            )
+
+            if response.status_code == 400 and streaming and "stream" in response.text.lower():
+                # This deployment doesn't support streaming; remember that and ask again without it
+                _NO_STREAMING.add(url)
+                metrics.increment("stream_fallbacks_total")
+                streaming = False
+                continue
+            if response.status_code != 200:
+                return None, f"API Error {response.status_code}: {response.text}"
+
+            started = time.perf_counter()
+            failed = True
+            try:
+                if is_event_stream(response):
+                    images, body_bytes = read_event_stream(response, partial_image)
+                else:
+                    images, body_bytes = read_images(response)
+                failed = False
+            except ValueError as e:
+                return None, f"Malformed response: {e}"
+            except OSError:
+                # The connection dropped mid-body (requests errors are OSErrors)
+                metrics.increment("request_errors_total", kind="body")
+                if attempt + 1 >= BODY_ATTEMPTS:
+                    raise
+                continue
+            finally:
+                # Frees the throttle slot and times the attempt only now that the image is in
+                response.finish_attempt(failed)
+            metrics.observe("download_seconds", time.perf_counter() - started)
+            metrics.observe("response_bytes", body_bytes, buckets=metrics.BYTES_BUCKETS)
+            break
+
+    if not images:
+        return None, NO_IMAGE_DATA
+    return images, None
+
+
+def _collect(futures):
+    for future in as_completed(futures):
+        i = futures[future]
+        try:
+            result, error = future.result()
+        except Exception as e:
+            result, error = None, str(e)
+        yield i, result, error
+
+
+def run_parallel(calls, max_workers=4, scheduler=None, owner=None, keys=None):
+    """Run calls that each return (result, error); yields (index, result, error) as they finish.
+
+    With a scheduler.FairScheduler the calls go through the shared
+    process-wide workers instead of a private pool: max_workers caps this
+    owner's calls in flight, and calls whose keys match one already in
+    flight (from any session) share its result.
+    """
+    if not calls:
+        return
+
+    if scheduler is not None:
+        futures = {}
+        for i, call in enumerate(calls):
+            future = scheduler.submit(owner, keys[i] if keys else None, call, limit=max_workers)
+            futures[future] = i
+        yield from _collect(futures)
+        return
+
+    workers = max(1, min(max_workers, len(calls)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(call): i for i, call in enumerate(calls)}
+        yield from _collect(futures)
+
+
+def generate_variations(
+    session,
+    url,
+    headers,
+    payloads,
+    max_workers=4,
+    scheduler=None,
+    owner=None,
+    keys=None,
+    references=None,
+    on_partial=None,
+    **retry_options
+):
+    """Run one request per payload in parallel.
+
+    Yields (index, image_bytes, error) as each request finishes, in completion
+    order; callers that need a stable order should key results by index.
+
+    Requests share a scheduler and coalesce by key as in run_parallel.
+    references, when given, holds a reference image (or None) per payload;
+    keys must then tell different references apart. With on_partial,
+    images are streamed and on_partial(index, image) receives their
+    partial frames.
+    """
+    references = references or [None] * len(payloads)
+
+    def partial_callback(i):
+        return partial(on_partial, i) if on_partial is not None else None
+
+    calls = [
+        partial(
+            request_image, session, url, headers, payload, references[i],
+            on_partial=partial_callback(i), **retry_options
+        )
+        for i, payload in enumerate(payloads)
+    ]
+    yield from run_parallel(calls, max_workers, scheduler, owner, keys)
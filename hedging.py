@@ -0,0 +1,126 @@
+"""Hedged requests: a second attempt for calls that run slower than usual.
+
+Most image requests finish near the median, but a few stall until their
+timeout. A hedge starts a duplicate of a call that has been running longer
+than a percentile of recently observed latencies and takes whichever copy
+succeeds first. The percentile is learned from every completed call, and
+a budget caps hedges to a fraction of all calls so the tail is cut without
+multiplying spend.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+
+import metrics
+
+
+class HedgePolicy:
+    """When to hedge, and how many hedges are still affordable.
+
+    percentile is the latency quantile (0-1) after which a call is
+    hedged; budget is the largest ratio of hedges to calls. No call is
+    hedged until min_samples latencies have been seen, nor sooner than
+    min_delay seconds. Safe to share between threads.
+    """
+
+    def __init__(self, percentile=0.95, budget=0.05, window=200, min_samples=20, min_delay=1.0):
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.calls = 0
+        self.fired = 0
+        self.won = 0
+        self.skipped = 0
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        """Record the latency of one completed call"""
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def delay(self):
+        """Seconds after which a call is hedged, or None while still learning"""
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            ordered = sorted(self._latencies)
+        position = min(len(ordered) - 1, int(len(ordered) * self.percentile))
+        return max(self.min_delay, ordered[position])
+
+    def _take_budget(self):
+        with self._lock:
+            affordable = self.fired + 1 <= self.budget * self.calls
+            if affordable:
+                self.fired += 1
+            else:
+                self.skipped += 1
+        metrics.increment("hedges_total", outcome="fired" if affordable else "skipped")
+        return affordable
+
+    def _start(self, fn):
+        # A thread per copy rather than a pool: a waiting copy must never queue behind stalled ones
+        future = Future()
+
+        def call():
+            started = time.perf_counter()
+            try:
+                future.set_result(fn())
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                self.observe(time.perf_counter() - started)
+
+        threading.Thread(target=call, name="hedged-call", daemon=True).start()
+        return future
+
+    def run(self, fn, ok=None):
+        """Call fn(), hedging it if it is slow; returns the first acceptable result.
+
+        ok(result) says whether a result is worth keeping (default: any
+        result); a call that raises is never acceptable. If no copy
+        succeeds, the primary's outcome is returned (or raised). A losing
+        copy is left to finish in the background and its result dropped.
+        """
+        with self._lock:
+            self.calls += 1
+        hedge_after = self.delay()
+        if hedge_after is None:
+            started = time.perf_counter()
+            try:
+                return fn()
+            finally:
+                self.observe(time.perf_counter() - started)
+
+        primary = self._start(fn)
+
+        done, _ = wait([primary], timeout=hedge_after)
+        if done or not self._take_budget():
+            return primary.result()
+
+        metrics.observe("hedge_delay_seconds", hedge_after)
+        hedge = self._start(fn)
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None and (ok is None or ok(future.result())):
+                    if future is hedge:
+                        with self._lock:
+                            self.won += 1
+                        metrics.increment("hedges_total", outcome="won")
+                    return future.result()
+        return primary.result()
+
+    def stats(self):
+        hedge_after = self.delay()
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "fired": self.fired,
+                "won": self.won,
+                "skipped": self.skipped,
+                "hedge_after_s": hedge_after
+            }
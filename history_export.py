@@ -0,0 +1,189 @@
+"""Export history covers as a ZIP of images plus CSV and JSON-lines manifests.
+
+The archive is produced as a stream of chunks: images are copied from disk
+a block at a time and stored uncompressed (PNG/JPEG/WebP don't shrink
+further), and manifest rows are spooled to temporary files until the end,
+so memory stays flat however many covers are exported.
+
+    python history_export.py covers.zip --category Marketing --search "growth"
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+import zipfile
+
+import metrics
+from history_store import HistoryStore
+
+CHUNK_SIZE = 256 * 1024
+SPOOL_SIZE = 256 * 1024  # manifest text kept in memory before spilling to disk
+MANIFEST_FIELDS = [
+    "file", "id", "title", "subtitle", "author", "category", "summary", "prompt", "size", "quality", "format", "bytes",
+    "created_at"
+]
+
+
+def slugify(text):
+    return re.sub(r"[^a-z0-9]+", "_", text.lower()).strip("_") or "cover"
+
+
+def archive_name(record):
+    """Unique, readable path of a cover inside the archive"""
+    return f"images/{record['id']:06d}_{slugify(record['title'])[:60]}.{record['format']}"
+
+
+def manifest_row(record, name):
+    return {
+        "file": name,
+        "id": record["id"],
+        "title": record["title"],
+        "subtitle": record["subtitle"],
+        "author": record["author"],
+        "category": record["category"],
+        "summary": record["summary"],
+        "prompt": record["prompt"],
+        "size": record["size"],
+        "quality": record["quality"],
+        "format": record["format"],
+        "bytes": record["bytes"],
+        "created_at": record["timestamp"].isoformat()
+    }
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only, unseekable file that hands back what was written since the last drain"""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self.total = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self.total += len(data)
+        return len(data)
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_zip(records, chunk_size=CHUNK_SIZE):
+    """Yield a ZIP archive of the records' images and manifests, chunk by chunk.
+
+    records may be any iterable (e.g. HistoryStore.iter_records()); it is
+    consumed once. Covers whose image file is missing are skipped.
+    """
+    started = time.perf_counter()
+    sink = _ChunkSink()
+    exported = 0
+    # The manifests are written last, so spool rows to disk rather than a list
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE, mode="w+", newline="", encoding="utf-8") as csv_file, \
+            tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE, mode="w+", encoding="utf-8") as json_file:
+        writer = csv.DictWriter(csv_file, fieldnames=MANIFEST_FIELDS)
+        writer.writeheader()
+
+        # zipfile writes data descriptors when the output can't seek
+        with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED) as archive:
+            for record in records:
+                name = archive_name(record)
+                try:
+                    source = open(record["path"], "rb")
+                except OSError:
+                    continue
+                with source:
+                    info = zipfile.ZipInfo(name, date_time=record["timestamp"].timetuple()[:6])
+                    info.file_size = record["bytes"]
+                    with archive.open(info, "w") as target:
+                        while True:
+                            block = source.read(chunk_size)
+                            if not block:
+                                break
+                            target.write(block)
+                            yield sink.drain()
+
+                row = manifest_row(record, name)
+                writer.writerow(row)
+                json_file.write(json.dumps(row, ensure_ascii=False) + "\n")
+                exported += 1
+                yield sink.drain()
+
+            for manifest_name, spool in (("manifest.csv", csv_file), ("manifest.jsonl", json_file)):
+                spool.seek(0)
+                info = zipfile.ZipInfo(manifest_name, date_time=time.localtime()[:6])
+                info.compress_type = zipfile.ZIP_DEFLATED
+                with archive.open(info, "w") as target:
+                    while True:
+                        text = spool.read(chunk_size)
+                        if not text:
+                            break
+                        target.write(text.encode("utf-8"))
+                        yield sink.drain()
+        yield sink.drain()
+
+    metrics.observe("export_seconds", time.perf_counter() - started)
+    metrics.observe("export_bytes", sink.total, buckets=metrics.BYTES_BUCKETS)
+    metrics.increment("exported_covers_total", exported)
+
+
+def write_zip(records, fileobj, chunk_size=CHUNK_SIZE):
+    """Write the archive for records to an open binary file; returns bytes written"""
+    written = 0
+    for chunk in iter_zip(records, chunk_size):
+        if chunk:
+            fileobj.write(chunk)
+            written += len(chunk)
+    return written
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Export cover history as a ZIP with a manifest")
+    parser.add_argument("output", help="Archive to write, or - for stdout")
+    parser.add_argument(
+        "--history-dir",
+        default=os.getenv("COVER_HISTORY_DIR", os.path.join(".data", "history"))
+    )
+    parser.add_argument("--category", action="append", default=[], help="Repeat to include several")
+    parser.add_argument("--search", default=None, help="Full-text filter over title, summary and prompt")
+    parser.add_argument("--oldest-first", action="store_true")
+    parser.add_argument("--hide-duplicates", action="store_true", help="Leave out covers flagged as near-duplicates")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    store = HistoryStore(args.history_dir)
+    records = store.iter_records(
+        args.category, args.search, newest_first=not args.oldest_first, hide_duplicates=args.hide_duplicates
+    )
+    if args.output == "-":
+        write_zip(records, sys.stdout.buffer)
+        return 0
+
+    # Build next to the target and rename, so a failed export leaves no partial archive
+    directory = os.path.dirname(os.path.abspath(args.output))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            written = write_zip(records, f)
+        os.replace(tmp_path, args.output)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    print(f"Wrote {args.output} ({written / (1024 * 1024):.1f} MB)", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
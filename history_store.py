@@ -0,0 +1,547 @@
+"""Persistent cover history: SQLite metadata plus content-addressed image files"""
+import hashlib
+import os
+import sqlite3
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    hash TEXT PRIMARY KEY,
+    format TEXT NOT NULL,
+    bytes INTEGER NOT NULL,
+    thumb_format TEXT,
+    phash INTEGER,
+    dhash INTEGER,
+    duplicate_of TEXT
+);
+CREATE TABLE IF NOT EXISTS covers (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    image_hash TEXT NOT NULL REFERENCES images(hash),
+    title TEXT NOT NULL,
+    category TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    size TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    quality TEXT,
+    base_key TEXT,
+    subtitle TEXT,
+    author TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_covers_created ON covers (created_at, id);
+CREATE INDEX IF NOT EXISTS idx_covers_category_created ON covers (category, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_covers_image ON covers (image_hash, id);
+
+-- Title-free artwork for locally lettered covers, keyed by the hash of the request that made it
+CREATE TABLE IF NOT EXISTS base_art (
+    key TEXT PRIMARY KEY,
+    image_hash TEXT NOT NULL,
+    format TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    size TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+
+-- Per-category totals kept up to date by triggers, so the category filter
+-- and cover count never scan the covers table
+CREATE TABLE IF NOT EXISTS category_counts (
+    category TEXT PRIMARY KEY,
+    covers INTEGER NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS covers_count_insert AFTER INSERT ON covers BEGIN
+    INSERT INTO category_counts (category, covers) VALUES (new.category, 1)
+    ON CONFLICT (category) DO UPDATE SET covers = covers + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS covers_count_delete AFTER DELETE ON covers BEGIN
+    UPDATE category_counts SET covers = covers - 1 WHERE category = old.category;
+    DELETE FROM category_counts WHERE category = old.category AND covers <= 0;
+END;
+"""
+
+# Full-text index over the searchable fields, mirrored from covers by triggers
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS covers_fts USING fts5 (
+    title, summary, prompt, content='covers', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS covers_fts_insert AFTER INSERT ON covers BEGIN
+    INSERT INTO covers_fts (rowid, title, summary, prompt)
+    VALUES (new.id, new.title, new.summary, new.prompt);
+END;
+CREATE TRIGGER IF NOT EXISTS covers_fts_delete AFTER DELETE ON covers BEGIN
+    INSERT INTO covers_fts (covers_fts, rowid, title, summary, prompt)
+    VALUES ('delete', old.id, old.title, old.summary, old.prompt);
+END;
+"""
+
+COVER_COLUMNS = (
+    "covers.id, covers.image_hash, covers.title, covers.category, covers.summary, "
+    "covers.prompt, covers.size, covers.created_at, images.format, images.bytes, images.thumb_format, "
+    "images.duplicate_of, covers.quality, covers.base_key, covers.subtitle, covers.author"
+)
+
+
+def _signed64(value):
+    # SQLite integers are signed; perceptual hashes are unsigned 64-bit
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def fts_query(text):
+    """Turn free text into an FTS5 query: every word must match as a prefix"""
+    terms = []
+    for word in text.split():
+        terms.append('"' + word.replace('"', '""') + '"*')
+    return " ".join(terms)
+
+
+def detect_format(data):
+    """Return the image format from its magic bytes ("png", "jpeg" or "webp")"""
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "png"
+    if data[:3] == b"\xff\xd8\xff":
+        return "jpeg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    return "bin"
+
+
+class HistoryStore:
+    """Cover history shared by every session and worker process.
+
+    Image bytes live on disk once per distinct content hash; rows only hold
+    metadata, so callers can page through history without loading images.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.image_dir = os.path.join(directory, "images")
+        self.base_dir = os.path.join(directory, "base")
+        self.db_path = os.path.join(directory, "history.db")
+        os.makedirs(self.image_dir, exist_ok=True)
+
+        with self._connect() as conn:
+            # WAL lets readers in other processes proceed while one writes
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            # Databases created before thumbnails or perceptual hashes existed lack the columns
+            columns = [row["name"] for row in conn.execute("PRAGMA table_info(images)")]
+            for column, kind in (
+                ("thumb_format", "TEXT"), ("phash", "INTEGER"), ("dhash", "INTEGER"), ("duplicate_of", "TEXT")
+            ):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE images ADD COLUMN {column} {kind}")
+            cover_columns = [row["name"] for row in conn.execute("PRAGMA table_info(covers)")]
+            for column in ("quality", "base_key", "subtitle", "author"):
+                if column not in cover_columns:
+                    conn.execute(f"ALTER TABLE covers ADD COLUMN {column} TEXT")
+            # Keeps the backlog of images awaiting perceptual hashes cheap to find and count
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_images_unhashed ON images (hash) WHERE phash IS NULL")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_covers_base ON covers (base_key) WHERE base_key IS NOT NULL")
+
+            # Rebuild the derived tables for databases that predate them
+            has_covers = conn.execute("SELECT 1 FROM covers LIMIT 1").fetchone()
+            has_counts = conn.execute("SELECT 1 FROM category_counts LIMIT 1").fetchone()
+            if has_covers and not has_counts:
+                conn.execute(
+                    "INSERT INTO category_counts (category, covers) "
+                    "SELECT category, COUNT(*) FROM covers GROUP BY category"
+                )
+
+            fts_exists = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'covers_fts'"
+            ).fetchone()
+            try:
+                conn.executescript(FTS_SCHEMA)
+                self.has_fts = True
+            except sqlite3.OperationalError:
+                # SQLite built without FTS5; search falls back to LIKE
+                self.has_fts = False
+            if self.has_fts and not fts_exists and has_covers:
+                conn.execute("INSERT INTO covers_fts (covers_fts) VALUES ('rebuild')")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def image_path(self, image_hash, image_format):
+        """Location of an image file; sharded by hash prefix to keep directories small"""
+        return os.path.join(self.image_dir, image_hash[:2], f"{image_hash}.{image_format}")
+
+    def thumbnail_path(self, image_hash, thumb_format):
+        return os.path.join(self.image_dir, image_hash[:2], f"{image_hash}.thumb.{thumb_format}")
+
+    def _write_file(self, path, data):
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def add(
+        self,
+        image,
+        title,
+        category,
+        summary,
+        prompt,
+        size,
+        created_at=None,
+        thumbnail=None,
+        quality=None,
+        base_key=None,
+        subtitle=None,
+        author=None
+    ):
+        """Store a generated cover (and optionally its preview) and return its id.
+
+        Locally lettered covers pass the base_key of their title-free art
+        (see put_base_art) and the subtitle and author lettered on it.
+        """
+        image_hash = hashlib.sha256(image).hexdigest()
+        image_format = detect_format(image)
+        thumb_format = detect_format(thumbnail) if thumbnail else None
+        created_at = created_at or datetime.now()
+
+        self._write_file(self.image_path(image_hash, image_format), image)
+        if thumbnail:
+            self._write_file(self.thumbnail_path(image_hash, thumb_format), thumbnail)
+
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO images (hash, format, bytes, thumb_format) VALUES (?, ?, ?, ?)",
+                (image_hash, image_format, len(image), thumb_format)
+            )
+            if thumb_format:
+                conn.execute(
+                    "UPDATE images SET thumb_format = ? WHERE hash = ? AND thumb_format IS NULL",
+                    (thumb_format, image_hash)
+                )
+            cursor = conn.execute(
+                "INSERT INTO covers "
+                "(image_hash, title, category, summary, prompt, size, created_at, quality, base_key, subtitle, author) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    image_hash, title, category, summary, prompt, size, created_at.isoformat(), quality,
+                    base_key, subtitle, author
+                )
+            )
+            return cursor.lastrowid
+
+    def _to_record(self, row):
+        record = dict(row)
+        record["timestamp"] = datetime.fromisoformat(record.pop("created_at"))
+        record["path"] = self.image_path(record["image_hash"], record["format"])
+        thumb_format = record.pop("thumb_format")
+        record["thumb_path"] = (
+            self.thumbnail_path(record["image_hash"], thumb_format) if thumb_format else None
+        )
+        return record
+
+    def get(self, cover_id):
+        """Metadata for one cover (no image bytes), or None"""
+        with self._connect() as conn:
+            row = conn.execute(
+                f"SELECT {COVER_COLUMNS} FROM covers JOIN images ON images.hash = covers.image_hash "
+                "WHERE covers.id = ?",
+                (cover_id,)
+            ).fetchone()
+        return self._to_record(row) if row else None
+
+    def _filters(self, categories, search, hide_duplicates=False):
+        clauses = []
+        params = []
+        if hide_duplicates:
+            # Near-duplicate images, and repeats of one image (cache hits) after its first cover
+            clauses.append("images.duplicate_of IS NULL")
+            clauses.append(
+                "covers.id = (SELECT MIN(earlier.id) FROM covers AS earlier WHERE earlier.image_hash = covers.image_hash)"
+            )
+        if categories:
+            clauses.append(f"covers.category IN ({', '.join('?' for _ in categories)})")
+            params.extend(categories)
+        if search and search.strip():
+            if self.has_fts:
+                clauses.append("covers.id IN (SELECT rowid FROM covers_fts WHERE covers_fts MATCH ?)")
+                params.append(fts_query(search))
+            else:
+                for word in search.split():
+                    clauses.append("(covers.title LIKE ? OR covers.summary LIKE ? OR covers.prompt LIKE ?)")
+                    params.extend([f"%{word}%"] * 3)
+        return clauses, params
+
+    def page(
+        self,
+        categories=None,
+        search=None,
+        newest_first=True,
+        page_size=24,
+        cursor=None,
+        hide_duplicates=False
+    ):
+        """One page of cover metadata plus the cursor for the next page.
+
+        Uses keyset pagination on (created_at, id), which the indexes serve
+        directly, so a page costs the same however deep into history it is.
+        The returned cursor is None on the last page. hide_duplicates leaves
+        out covers whose image was flagged as a near-duplicate of an older one,
+        and all but the first cover of an image stored more than once.
+        """
+        clauses, params = self._filters(categories, search, hide_duplicates)
+        comparison = "<" if newest_first else ">"
+        if cursor:
+            clauses.append(f"(covers.created_at, covers.id) {comparison} (?, ?)")
+            params.extend(cursor)
+
+        order = "DESC" if newest_first else "ASC"
+        query = f"SELECT {COVER_COLUMNS} FROM covers JOIN images ON images.hash = covers.image_hash"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += f" ORDER BY covers.created_at {order}, covers.id {order} LIMIT ?"
+        # One extra row tells us whether another page exists
+        params.append(page_size + 1)
+
+        with self._connect() as conn:
+            rows = conn.execute(query, params).fetchall()
+
+        next_cursor = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            next_cursor = (rows[-1]["created_at"], rows[-1]["id"])
+        return [self._to_record(row) for row in rows], next_cursor
+
+    def iter_records(self, categories=None, search=None, newest_first=True, batch_size=500, hide_duplicates=False):
+        """Every matching cover record, fetched a page at a time"""
+        cursor = None
+        while True:
+            records, cursor = self.page(categories, search, newest_first, batch_size, cursor, hide_duplicates)
+            yield from records
+            if cursor is None:
+                return
+
+    def count_matching(self, categories=None, search=None, hide_duplicates=False):
+        """Number of covers a filter selects (count() is cheaper when unfiltered)"""
+        clauses, params = self._filters(categories, search, hide_duplicates)
+        if not clauses:
+            return self.count()
+        query = (
+            "SELECT COUNT(*) FROM covers JOIN images ON images.hash = covers.image_hash WHERE "
+            + " AND ".join(clauses)
+        )
+        with self._connect() as conn:
+            return conn.execute(query, params).fetchone()[0]
+
+    def bytes_matching(self, categories=None, search=None, hide_duplicates=False):
+        """Summed stored image size of the covers a filter selects"""
+        clauses, params = self._filters(categories, search, hide_duplicates)
+        query = "SELECT COALESCE(SUM(images.bytes), 0) FROM covers JOIN images ON images.hash = covers.image_hash"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        with self._connect() as conn:
+            return conn.execute(query, params).fetchone()[0]
+
+    def categories(self):
+        """Distinct categories present in the history"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT category FROM category_counts ORDER BY category").fetchall()
+        return [row["category"] for row in rows]
+
+    def version(self):
+        """(newest id, cover count, unhashed images): changes whenever covers are
+        added or cleared, or near-duplicate flags are set"""
+        with self._connect() as conn:
+            return tuple(conn.execute(
+                "SELECT (SELECT COALESCE(MAX(id), 0) FROM covers), "
+                "(SELECT COALESCE(SUM(covers), 0) FROM category_counts), "
+                "(SELECT COUNT(*) FROM images WHERE phash IS NULL)"
+            ).fetchone())
+
+    def count(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COALESCE(SUM(covers), 0) FROM category_counts").fetchone()[0]
+
+    def load_image(self, record):
+        """Read the full image bytes for a cover record"""
+        with open(record["path"], "rb") as f:
+            return f.read()
+
+    def set_thumbnail(self, image_hash, thumbnail):
+        """Attach a preview to an already stored image and return its path"""
+        thumb_format = detect_format(thumbnail)
+        path = self.thumbnail_path(image_hash, thumb_format)
+        self._write_file(path, thumbnail)
+        with self._connect() as conn:
+            conn.execute("UPDATE images SET thumb_format = ? WHERE hash = ?", (thumb_format, image_hash))
+        return path
+
+    def perceptual_hash(self, image_hash):
+        """(phash, dhash, duplicate_of) of a stored image, or None if not hashed yet"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT phash, dhash, duplicate_of FROM images WHERE hash = ? AND phash IS NOT NULL",
+                (image_hash,)
+            ).fetchone()
+        if row is None:
+            return None
+        return row["phash"] & (2 ** 64 - 1), row["dhash"] & (2 ** 64 - 1), row["duplicate_of"]
+
+    def set_perceptual_hash(self, image_hash, phash, dhash, duplicate_of=None):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE images SET phash = ?, dhash = ?, duplicate_of = ? WHERE hash = ?",
+                (_signed64(phash), _signed64(dhash), duplicate_of, image_hash)
+            )
+
+    def first_cover_id(self, image_hash):
+        """Id of the oldest cover showing an image, or None"""
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT MIN(id) FROM covers WHERE image_hash = ?", (image_hash,)
+            ).fetchone()[0]
+
+    def perceptual_hashes(self):
+        """(image hash, phash, dhash) rows for every hashed image, as stored (signed)"""
+        with self._connect() as conn:
+            return conn.execute("SELECT hash, phash, dhash FROM images WHERE phash IS NOT NULL").fetchall()
+
+    def unhashed_images(self, limit=500):
+        """Images still missing perceptual hashes, oldest first, with their file paths"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT hash, format, thumb_format FROM images WHERE phash IS NULL ORDER BY rowid LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return [
+            {
+                "image_hash": row["hash"],
+                "path": self.image_path(row["hash"], row["format"]),
+                "thumb_path": (
+                    self.thumbnail_path(row["hash"], row["thumb_format"]) if row["thumb_format"] else None
+                )
+            }
+            for row in rows
+        ]
+
+    def base_art_path(self, image_hash, image_format):
+        return os.path.join(self.base_dir, image_hash[:2], f"{image_hash}.{image_format}")
+
+    def put_base_art(self, key, image, prompt, size):
+        """Keep title-free artwork under key (the hash of the request that made it)"""
+        image_hash = hashlib.sha256(image).hexdigest()
+        image_format = detect_format(image)
+        self._write_file(self.base_art_path(image_hash, image_format), image)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO base_art (key, image_hash, format, prompt, size, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, image_hash, image_format, prompt, size, datetime.now().isoformat())
+            )
+
+    def base_art(self, key):
+        """Encoded title-free artwork stored under key, or None"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT image_hash, format FROM base_art WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        try:
+            with open(self.base_art_path(row["image_hash"], row["format"]), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def same_base_images(self, image_hash):
+        """Hashes of other images lettered on the same base art as this one"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT DISTINCT siblings.image_hash FROM covers AS own "
+                "JOIN covers AS siblings ON siblings.base_key = own.base_key "
+                "WHERE own.image_hash = ? AND own.base_key IS NOT NULL AND siblings.image_hash != ?",
+                (image_hash, image_hash)
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def _remove_files(self, image_rows, base_rows):
+        paths = [self.base_art_path(row["image_hash"], row["format"]) for row in base_rows]
+        for row in image_rows:
+            paths.append(self.image_path(row["hash"], row["format"]))
+            if row["thumb_format"]:
+                paths.append(self.thumbnail_path(row["hash"], row["thumb_format"]))
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def delete(self, cover_ids):
+        """Delete covers by id; returns the hashes of images no other cover shows.
+
+        Those images, their thumbnails and any base art no remaining cover
+        was lettered on are removed too, and covers flagged as near
+        duplicates of a removed image are unflagged.
+        """
+        cover_ids = list(cover_ids)
+        if not cover_ids:
+            return []
+        marks = ", ".join("?" * len(cover_ids))
+        with self._connect() as conn:
+            hashes = [row[0] for row in conn.execute(
+                f"SELECT DISTINCT image_hash FROM covers WHERE id IN ({marks})", cover_ids
+            )]
+            base_keys = [row[0] for row in conn.execute(
+                f"SELECT DISTINCT base_key FROM covers WHERE id IN ({marks}) AND base_key IS NOT NULL", cover_ids
+            )]
+            conn.execute(f"DELETE FROM covers WHERE id IN ({marks})", cover_ids)
+
+            image_rows = [
+                row for row in (
+                    conn.execute(
+                        "SELECT hash, format, thumb_format FROM images WHERE hash = ? "
+                        "AND NOT EXISTS (SELECT 1 FROM covers WHERE image_hash = images.hash)",
+                        (image_hash,)
+                    ).fetchone()
+                    for image_hash in hashes
+                )
+                if row is not None
+            ]
+            removed = [row["hash"] for row in image_rows]
+            for image_hash in removed:
+                conn.execute("DELETE FROM images WHERE hash = ?", (image_hash,))
+                conn.execute("UPDATE images SET duplicate_of = NULL WHERE duplicate_of = ?", (image_hash,))
+
+            base_rows = []
+            for key in base_keys:
+                if conn.execute("SELECT 1 FROM covers WHERE base_key = ? LIMIT 1", (key,)).fetchone():
+                    continue
+                row = conn.execute("SELECT image_hash, format FROM base_art WHERE key = ?", (key,)).fetchone()
+                conn.execute("DELETE FROM base_art WHERE key = ?", (key,))
+                # Base art files are content-addressed; another key may still point at the same file
+                if row and not conn.execute(
+                    "SELECT 1 FROM base_art WHERE image_hash = ? LIMIT 1", (row["image_hash"],)
+                ).fetchone():
+                    base_rows.append(row)
+
+        self._remove_files(image_rows, base_rows)
+        return removed
+
+    def clear(self):
+        """Delete every cover, its base art and the image files they referenced"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT hash, format, thumb_format FROM images").fetchall()
+            base_rows = conn.execute("SELECT image_hash, format FROM base_art").fetchall()
+            conn.execute("DELETE FROM covers")
+            conn.execute("DELETE FROM images")
+            conn.execute("DELETE FROM base_art")
+        self._remove_files(rows, base_rows)
@@ -0,0 +1,204 @@
+"""Shared HTTP session with connection pooling and retry/backoff.
+
+requests is imported on first use rather than at module import, so
+workers and the CLI that only build prompts or payloads start quickly.
+"""
+import random
+import time
+
+import metrics
+
+# Throttling and transient server errors are worth another attempt
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+DEFAULT_POOL_SIZE = 8
+DEFAULT_ATTEMPT_TIMEOUT = 120  # seconds for a single HTTP attempt
+DEFAULT_TOTAL_TIMEOUT = 300    # seconds across all attempts and backoff
+DEFAULT_MAX_ATTEMPTS = 4
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 30.0
+
+
+def create_session(pool_size=DEFAULT_POOL_SIZE):
+    """Create a keep-alive session with a bounded connection pool.
+
+    Retries are handled by post_with_retry, so the adapter itself never
+    retries. pool_block makes extra threads wait for a free connection
+    instead of opening (and discarding) connections beyond the bound.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=pool_size,
+        pool_block=True,
+        max_retries=0
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def retry_after_seconds(response):
+    """Return the server-requested delay in seconds, or None"""
+    # Azure sends the millisecond variant alongside the standard header
+    retry_after_ms = response.headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return max(0.0, float(retry_after_ms) / 1000)
+        except ValueError:
+            pass
+
+    retry_after = response.headers.get("Retry-After")
+    if not retry_after:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    from email.utils import parsedate_to_datetime
+
+    try:
+        retry_at = parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_MAX):
+    """Exponential backoff with full jitter for the given attempt (0-based)"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def record_response(response, attempt_seconds, streamed=False):
+    """Split one attempt into time-to-headers and body transfer, plus size and status.
+
+    requests folds connection setup into elapsed, so upstream time includes
+    any TCP/TLS handshake (near zero once the pool is warm). A successful
+    streamed body hasn't been read yet; whoever reads it records its
+    transfer time and size.
+    """
+    upstream = response.elapsed.total_seconds()
+    status = response.status_code
+    metrics.increment("responses_total", status=status)
+    metrics.observe("upstream_seconds", upstream, status=status)
+    if streamed and status == 200:
+        return
+    # Error bodies are small; reading them also frees a streamed connection
+    metrics.observe("download_seconds", max(0.0, attempt_seconds - upstream))
+    metrics.observe("response_bytes", len(response.content), buckets=metrics.BYTES_BUCKETS)
+
+
+def _form_value(value):
+    """A payload value as a multipart field; booleans are spelled as in JSON"""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def _attempt_finisher(throttle=None, ticket=None, status=None):
+    """Release a held throttle ticket once, when the caller is done with the response"""
+    held = [throttle is not None]
+
+    def finish(failed=False):
+        if held[0]:
+            held[0] = False
+            throttle.release(ticket, None if failed else status)
+
+    return finish
+
+
+def post_with_retry(
+    session,
+    url,
+    headers,
+    payload,
+    attempt_timeout=DEFAULT_ATTEMPT_TIMEOUT,
+    total_timeout=DEFAULT_TOTAL_TIMEOUT,
+    max_attempts=DEFAULT_MAX_ATTEMPTS,
+    throttle=None,
+    stream=False,
+    files=None
+):
+    """POST JSON, retrying throttled/transient failures until the deadline.
+
+    Returns the last response received. Connection errors and timeouts are
+    retried as well and re-raised once attempts or time run out. When a
+    rate_limit.Throttle is given, every attempt waits for it and reports
+    its outcome back to it. With stream=True the body of a 200 response is
+    left unread for the caller, who must consume or close it and then call
+    response.finish_attempt(failed=False): the throttle slot stays taken,
+    and the attempt is timed, until the body has been read. With files
+    ({field: (filename, bytes, content type)}) the payload is sent as
+    multipart form fields alongside them instead.
+    """
+    import requests
+
+    deadline = time.monotonic() + total_timeout
+    attempt = 0
+    body = {"json": payload}
+    if files:
+        # requests sets the multipart Content-Type (with its boundary) itself
+        headers = {k: v for k, v in headers.items() if k.lower() != "content-type"}
+        body = {"data": {k: _form_value(v) for k, v in payload.items()}, "files": files}
+
+    while True:
+        ticket = None
+        if throttle:
+            with metrics.timer("throttle_wait_seconds"):
+                ticket = throttle.acquire(images=payload.get("n", 1))
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            if throttle:
+                throttle.release(ticket)
+            raise requests.Timeout(f"Gave up after {total_timeout}s")
+
+        response = None
+        attempt_started = time.perf_counter()
+        try:
+            response = session.post(
+                url,
+                headers=headers,
+                timeout=min(attempt_timeout, remaining),
+                stream=stream,
+                **body
+            )
+        except (requests.ConnectionError, requests.Timeout) as e:
+            metrics.increment("request_errors_total", kind=type(e).__name__)
+            if throttle:
+                throttle.release(ticket)
+            if attempt + 1 >= max_attempts:
+                raise
+            delay = backoff_delay(attempt)
+        except BaseException:
+            if throttle:
+                throttle.release(ticket)
+            raise
+        else:
+            record_response(response, time.perf_counter() - attempt_started, streamed=stream)
+            server_delay = retry_after_seconds(response)
+            final = response.status_code not in RETRYABLE_STATUS or attempt + 1 >= max_attempts
+            if stream:
+                response.finish_attempt = _attempt_finisher()
+                if final and response.status_code == 200:
+                    # A streamed generation is still running while its body arrives
+                    response.finish_attempt = _attempt_finisher(throttle, ticket, response.status_code)
+                    return response
+            if throttle:
+                throttle.release(ticket, response.status_code, server_delay)
+            if final:
+                return response
+            delay = server_delay if server_delay is not None else backoff_delay(attempt)
+
+        # Don't sleep past the deadline; hand back what we have instead
+        if time.monotonic() + delay >= deadline:
+            if response is not None:
+                return response
+            raise requests.Timeout(f"Gave up after {total_timeout}s")
+
+        metrics.increment("retries_total")
+        time.sleep(delay)
+        attempt += 1
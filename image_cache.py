@@ -0,0 +1,125 @@
+"""Content-addressed on-disk cache of generated images with LRU eviction"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+def cache_key(payload, variation):
+    """Hash every request field that affects the image, plus the variation slot"""
+    fields = {k: v for k, v in payload.items() if k != "n"}
+    fields["variation"] = variation
+    encoded = json.dumps(fields, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class ImageCache:
+    """Decoded image bytes stored as files named by key, bounded by total size.
+
+    Recency is tracked in memory and mirrored to file mtimes, so a restarted
+    process picks up the previous LRU order when it rescans the directory.
+    Safe to share between threads.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> size, least recently used first
+        self._total_bytes = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.bin")
+
+    def _load(self):
+        found = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".bin"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            found.append((stat.st_mtime, name[:-4], stat.st_size))
+
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._total_bytes += size
+        self._evict()
+
+    def get(self, key):
+        """Return cached bytes for key, or None on a miss"""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+
+        try:
+            with open(self._path(key), "rb") as f:
+                data = f.read()
+            os.utime(self._path(key))
+        except OSError:
+            # Removed behind our back; forget it and count as a miss
+            with self._lock:
+                size = self._entries.pop(key, None)
+                if size is not None:
+                    self._total_bytes -= size
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key, data):
+        """Store bytes under key, evicting least recently used entries if needed"""
+        if len(data) > self.max_bytes:
+            return
+
+        # Write to a temp file first so readers never see a partial image
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        with self._lock:
+            old_size = self._entries.pop(key, None)
+            if old_size is not None:
+                self._total_bytes -= old_size
+            self._entries[key] = len(data)
+            self._total_bytes += len(data)
+            self._evict()
+
+    def _evict(self):
+        # Caller holds the lock (or is the constructor)
+        while self._total_bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def stats(self):
+        """Snapshot of hit/miss counters and current usage"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes
+            }
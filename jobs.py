@@ -0,0 +1,404 @@
+"""Background generation jobs that outlive the Streamlit script run"""
+import hashlib
+import json
+import threading
+import uuid
+from datetime import datetime
+
+import metrics
+from batching import generate_batched
+from generation import build_payload, generate_variations, request_headers
+from image_cache import cache_key
+from lettering import DEFAULT_FONT, compose_cover
+from scheduler import FairScheduler
+from thumbnails import make_thumbnail
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Spec fields that are never shown back to the UI
+PRIVATE_FIELDS = {"api_key"}
+
+
+def job_key(spec, owner=None):
+    """Idempotency key: the same request from the same owner maps to one job"""
+    fields = {k: v for k, v in spec.items() if k not in PRIVATE_FIELDS}
+    fields["owner"] = owner
+    encoded = json.dumps(fields, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class Job:
+    """State of one job; mutated by its worker, read by any thread via snapshot()"""
+
+    def __init__(self, spec, owner, key):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.spec = spec
+        self.owner = owner
+        self.status = QUEUED
+        self.completed = 0
+        self.total = spec.get("count", 1)
+        self.cover_ids = []
+        self.errors = []
+        self.previews = {}  # variation index -> small preview of its latest partial frame
+        self.created_at = datetime.now()
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def progress(self, completed, total=None):
+        with self._lock:
+            self.completed = completed
+            if total is not None:
+                self.total = total
+
+    def set_preview(self, index, preview):
+        with self._lock:
+            self.previews[index] = preview
+
+    def add_error(self, message):
+        with self._lock:
+            self.errors.append(message)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "id": self.id,
+                "status": self.status,
+                "completed": self.completed,
+                "total": self.total,
+                "cover_ids": list(self.cover_ids),
+                "errors": list(self.errors),
+                "previews": dict(self.previews),
+                "spec": {k: v for k, v in self.spec.items() if k not in PRIVATE_FIELDS},
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at
+            }
+
+
+class JobQueue:
+    """Jobs executed by a fixed pool of daemon worker threads.
+
+    runner(job) does the work and returns the ids of the covers it stored;
+    raising marks the job failed. Submitting a request identical to one
+    still queued or running returns the existing job instead of a new one.
+    Workers take jobs round-robin across owners, so one session queueing
+    many jobs does not delay everyone else's.
+    """
+
+    def __init__(self, runner, workers=2, max_finished=500):
+        self.runner = runner
+        self.max_finished = max_finished
+        self._jobs = {}
+        self._active_keys = {}  # idempotency key -> job id while queued/running
+        self._scheduler = FairScheduler(workers=workers, name="cover-job")
+        self._lock = threading.Lock()
+
+    def submit(self, spec, owner=None):
+        """Enqueue a job and return its id (or the id of an identical pending job)"""
+        key = job_key(spec, owner)
+        with self._lock:
+            existing = self._active_keys.get(key)
+            if existing:
+                return existing
+            job = Job(spec, owner, key)
+            self._jobs[job.id] = job
+            self._active_keys[key] = job.id
+        self._scheduler.submit(owner, None, lambda: self._run(job))
+        return job.id
+
+    def get(self, job_id):
+        """Snapshot of a job, or None if unknown (or pruned)"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return job.snapshot() if job else None
+
+    def list(self, owner=None):
+        """Snapshots of known jobs, newest first"""
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if owner is None or job.owner == owner]
+        jobs.sort(key=lambda job: job.created_at, reverse=True)
+        return [job.snapshot() for job in jobs]
+
+    def depth(self):
+        """Jobs waiting for a worker"""
+        return self._scheduler.stats()["queue_depth"]
+
+    def _run(self, job):
+        with job._lock:
+            job.status = RUNNING
+            job.started_at = datetime.now()
+        try:
+            with metrics.timer("job_seconds"):
+                cover_ids = self.runner(job)
+            status = DONE if cover_ids else FAILED
+        except Exception as e:
+            cover_ids = []
+            job.add_error(str(e))
+            status = FAILED
+
+        with job._lock:
+            job.cover_ids = list(cover_ids)
+            job.previews = {}  # the stored covers replace them
+            job.status = status
+            job.finished_at = datetime.now()
+        metrics.increment("jobs_total", status=status)
+        with self._lock:
+            self._active_keys.pop(job.key, None)
+            self._prune()
+
+    def _prune(self):
+        # Caller holds the lock; forget the oldest finished jobs beyond the bound
+        finished = [job for job in self._jobs.values() if job.status in (DONE, FAILED)]
+        if len(finished) <= self.max_finished:
+            return
+        finished.sort(key=lambda job: job.finished_at)
+        for job in finished[:len(finished) - self.max_finished]:
+            del self._jobs[job.id]
+
+
+def run_cover_job(
+    job,
+    url,
+    session,
+    history_store,
+    image_cache=None,
+    retry_options=None,
+    scheduler=None,
+    derivatives=None,
+    duplicate_index=None,
+    batch_sizer=None
+):
+    """Generate the covers described by job.spec and store them in the history.
+
+    Spec fields: api_key, prompt, size, format, count, max_parallel,
+    force_fresh, replace_duplicates, quality, draft_ids, stream_previews,
+    batched, cells, lettering, title, category and summary. Returns the
+    stored cover ids in variation order.
+
+    Each optional collaborator adds a stage: a scheduler fair-queues
+    requests per job owner and shares identical in-flight ones, a
+    derivatives.DerivativeStore renders export formats as covers are
+    stored, a near_duplicates.DuplicateIndex checks every cover against
+    the history, and a batching.BatchSizer sizes multi-image requests.
+    """
+    spec = job.spec
+    retry_options = retry_options or {}
+    count = spec["count"]
+    quality = spec.get("quality", "medium")
+    # Covers to re-render, one per variation, each sent as its request's reference
+    # image so a final keeps the composition of the draft it was picked from
+    drafts = [history_store.get(cover_id) for cover_id in spec.get("draft_ids", [])]
+    # A sweep's requests (from sweeps.expand_grid), one per variation; count must match
+    cells = spec.get("cells") or []
+    # Subtitle, author, font and placement: the prompt asks for title-free art,
+    # which is kept as base art and lettered here by lettering.compose_cover
+    lettering = spec.get("lettering")
+    base_keys = {}  # variation index -> key of its base art, when lettering
+    replacement_for = {}  # replacement slot -> variation it stands in for
+
+    def cell(i):
+        # A sweep gives every variation its own request; otherwise they all share the spec's
+        i = replacement_for.get(i, i)
+        if i < len(cells):
+            return cells[i]
+        return {"prompt": spec["prompt"], "size": spec["size"], "category": spec["category"]}
+
+    # Requests only coalesce when made with the same key, so one user's
+    # credentials never produce images for another
+    key_hash = hashlib.sha256(spec["api_key"].encode("utf-8")).hexdigest()[:16]
+
+    def generate(indexes, completed, total):
+        # Identical requests for the same variation slot are served from
+        # the local cache; only the misses go to the API
+        images_by_index = {}
+        pending = []  # (variation index, cache key, payload)
+
+        for i in indexes:
+            payload = build_payload(cell(i)["prompt"], cell(i)["size"], spec["format"], quality)
+            draft = drafts[i] if i < len(drafts) else None
+            # Renders of different drafts must never share a cache entry; a sweep
+            # cell is its prompt's first variation, shared with plain generation
+            key = cache_key(
+                {**payload, "reference": draft["image_hash"]} if draft else payload,
+                0 if i < len(cells) else i
+            )
+
+            cached = None
+            if lettering:
+                base_keys[i] = key
+                if not spec.get("force_fresh"):
+                    # Base art outlives the cache, so a series or a retitle never pays for it again
+                    cached = history_store.base_art(key)
+            if cached is None and image_cache is not None and not spec.get("force_fresh"):
+                cached = image_cache.get(key)
+                if cached is not None and lettering:
+                    history_store.put_base_art(key, cached, cell(i)["prompt"], cell(i)["size"])
+
+            if cached is not None:
+                images_by_index[i] = cached
+            else:
+                pending.append((i, key, payload))
+
+        completed += len(images_by_index)
+        job.progress(completed, total)
+
+        # With stream_previews, each partial frame is the variation's preview until its image lands
+        def show_partial(pending_idx, image):
+            try:
+                job.set_preview(pending[pending_idx][0], make_thumbnail(image))
+            except Exception:
+                pass
+
+        references = []
+        for i, _, _ in pending:
+            draft = drafts[i] if i < len(drafts) else None
+            reference = None
+            if draft and draft["base_key"]:
+                # Render from the draft's art, not its lettering, so the final stays title-free
+                reference = history_store.base_art(draft["base_key"])
+            if draft and reference is None:
+                reference = history_store.load_image(draft)
+            references.append(reference)
+
+        batchable = len(pending) > 1 and not any(references) and not cells
+        if spec.get("batched") and batch_sizer is not None and batchable:
+            # Several images per call, in batches the sizer picks. Every pending payload
+            # is the same request (no drafts, no sweep cells); only the slot differs,
+            # and batched requests don't stream previews
+            variations = generate_batched(
+                session,
+                url,
+                request_headers(spec["api_key"]),
+                pending[0][2],
+                len(pending),
+                batch_sizer,
+                max_workers=spec.get("max_parallel", 4),
+                scheduler=scheduler,
+                owner=job.owner,
+                keys=[f"{key_hash}:{key}" for _, key, _ in pending],
+                **retry_options
+            )
+        else:
+            variations = generate_variations(
+                session,
+                url,
+                request_headers(spec["api_key"]),
+                [payload for _, _, payload in pending],
+                max_workers=spec.get("max_parallel", 4),
+                scheduler=scheduler,
+                owner=job.owner,
+                keys=[f"{key_hash}:{key}" for _, key, _ in pending],
+                references=references,
+                on_partial=show_partial if spec.get("stream_previews") else None,
+                **retry_options
+            )
+
+        # Requests run in parallel and finish in any order; keep results
+        # keyed by variation so the batch is stored in a stable order
+        for pending_idx, image_data, error in variations:
+            i, key, _ = pending[pending_idx]
+            completed += 1
+            job.progress(completed)
+
+            if error:
+                job.add_error(f"Image {i+1}: {error}")
+            else:
+                images_by_index[i] = image_data
+                if image_cache is not None:
+                    image_cache.put(key, image_data)
+                if lettering:
+                    history_store.put_base_art(key, image_data, cell(i)["prompt"], cell(i)["size"])
+                if spec.get("stream_previews"):
+                    show_partial(pending_idx, image_data)
+        return images_by_index, completed
+
+    def store(images_by_index):
+        # Returns [(variation index, cover id, duplicated image hash or None)]
+        stored = []
+        for i in sorted(images_by_index):
+            # Release each image as soon as it is on disk
+            image_data = images_by_index.pop(i)
+            if lettering:
+                try:
+                    image_data = compose_cover(
+                        image_data,
+                        spec["title"],
+                        lettering.get("subtitle", ""),
+                        lettering.get("author", ""),
+                        lettering.get("font", DEFAULT_FONT),
+                        lettering.get("placement", "bottom"),
+                        spec["format"]
+                    )
+                except Exception as e:
+                    job.add_error(f"Image {i+1}: lettering failed: {e}")
+                    continue
+
+            with metrics.timer("storage_write_seconds"):
+                cover_id = history_store.add(
+                    image_data,
+                    spec["title"],
+                    cell(i)["category"],
+                    spec["summary"],
+                    cell(i)["prompt"],
+                    cell(i)["size"],
+                    created_at=datetime.now(),
+                    quality=quality,
+                    base_key=base_keys.get(i),
+                    subtitle=lettering.get("subtitle") if lettering else None,
+                    author=lettering.get("author") if lettering else None
+                )
+
+            # Previews are made once here, from the stored file, so the gallery never ships full images
+            record = history_store.get(cover_id)
+            if record and not record["thumb_path"]:
+                try:
+                    with metrics.timer("thumbnail_seconds"):
+                        thumbnail = make_thumbnail(record["path"])
+                    record["thumb_path"] = history_store.set_thumbnail(record["image_hash"], thumbnail)
+                except Exception:
+                    pass
+            duplicate_of = None
+            if record and duplicate_index is not None:
+                try:
+                    draft = drafts[i] if i < len(drafts) else None
+                    duplicate_of = duplicate_index.check(record, [draft["image_hash"]] if draft else ())
+                except Exception:
+                    pass
+            if record and derivatives is not None:
+                derivatives.submit(record)
+            stored.append((i, cover_id, duplicate_of))
+        return stored
+
+    images_by_index, completed = generate(range(count), 0, count)
+    stored = store(images_by_index)
+    cover_ids = [cover_id for _, cover_id, _ in stored]
+
+    duplicates = [i for i, _, duplicate_of in stored if duplicate_of]
+    if duplicates and spec.get("replace_duplicates"):
+        # Each near duplicate is swapped for one extra variation, kept even if it matches too.
+        # Replacements take fresh variation slots, so they never hit the cache entry of the duplicate
+        replacement_for.update({count + n: i for n, i in enumerate(duplicates)})
+        images_by_index, completed = generate(list(replacement_for), completed, count + len(duplicates))
+        positions = {i: position for position, (i, _, _) in enumerate(stored)}
+        replaced = []
+        for slot, cover_id, _ in store(images_by_index):
+            position = positions[replacement_for[slot]]
+            replaced.append(cover_ids[position])
+            cover_ids[position] = cover_id
+            metrics.increment("duplicate_replacements_total")
+
+        # A replaced duplicate is no longer one of the job's covers; leaving it stored would
+        # keep it out of reach of the session that made it
+        if replaced:
+            removed = history_store.delete(replaced)
+            if derivatives is not None:
+                derivatives.remove(removed)
+            if duplicate_index is not None:
+                duplicate_index.reload()
+
+    return cover_ids
@@ -0,0 +1,224 @@
+"""Title, subtitle and author lettering composited onto title-free cover art.
+
+Generating a cover with its title painted in by the model means a new
+generation for every title and every typo. In local-lettering mode the
+model paints only the artwork, and the text is set here with Pillow:
+each line auto-fits its box in a placement template for the cover size,
+and the text color is chosen against the art beneath it. Re-lettering a
+stored base image takes milliseconds instead of another API call.
+"""
+import io
+import os
+import time
+from functools import lru_cache
+
+import metrics
+
+# Candidate font files per family, tried in order; Pillow also searches the system font directories
+FONTS = {
+    "Sans Bold": ["DejaVuSans-Bold.ttf", "LiberationSans-Bold.ttf", "Arial Bold.ttf", "arialbd.ttf"],
+    "Serif Bold": ["DejaVuSerif-Bold.ttf", "LiberationSerif-Bold.ttf", "Georgia Bold.ttf", "georgiab.ttf"],
+    "Sans": ["DejaVuSans.ttf", "LiberationSans-Regular.ttf", "Arial.ttf", "arial.ttf"],
+    "Serif": ["DejaVuSerif.ttf", "LiberationSerif-Regular.ttf", "Georgia.ttf", "georgia.ttf"]
+}
+DEFAULT_FONT = "Sans Bold"
+
+# Text boxes as (left, top, right, bottom) fractions of the cover, per size and placement
+TEMPLATES = {
+    "640x960": {
+        "bottom": {
+            "title": (0.08, 0.68, 0.92, 0.85),
+            "subtitle": (0.1, 0.85, 0.9, 0.9),
+            "author": (0.1, 0.92, 0.9, 0.97)
+        },
+        "top": {
+            "title": (0.08, 0.04, 0.92, 0.21),
+            "subtitle": (0.1, 0.21, 0.9, 0.26),
+            "author": (0.1, 0.92, 0.9, 0.97)
+        },
+        "center": {
+            "title": (0.08, 0.38, 0.92, 0.55),
+            "subtitle": (0.1, 0.55, 0.9, 0.6),
+            "author": (0.1, 0.92, 0.9, 0.97)
+        }
+    },
+    "1024x1024": {
+        "bottom": {
+            "title": (0.08, 0.66, 0.92, 0.83),
+            "subtitle": (0.1, 0.83, 0.9, 0.89),
+            "author": (0.1, 0.91, 0.9, 0.96)
+        },
+        "top": {
+            "title": (0.08, 0.05, 0.92, 0.22),
+            "subtitle": (0.1, 0.22, 0.9, 0.28),
+            "author": (0.1, 0.91, 0.9, 0.96)
+        },
+        "center": {
+            "title": (0.08, 0.36, 0.92, 0.55),
+            "subtitle": (0.1, 0.55, 0.9, 0.61),
+            "author": (0.1, 0.91, 0.9, 0.96)
+        }
+    },
+    "1024x576": {
+        "bottom": {
+            "title": (0.06, 0.6, 0.94, 0.81),
+            "subtitle": (0.1, 0.81, 0.9, 0.88),
+            "author": (0.1, 0.89, 0.9, 0.96)
+        },
+        "top": {
+            "title": (0.06, 0.05, 0.94, 0.26),
+            "subtitle": (0.1, 0.26, 0.9, 0.33),
+            "author": (0.1, 0.89, 0.9, 0.96)
+        },
+        "center": {
+            "title": (0.06, 0.33, 0.94, 0.56),
+            "subtitle": (0.1, 0.56, 0.9, 0.63),
+            "author": (0.1, 0.89, 0.9, 0.96)
+        }
+    }
+}
+PLACEMENTS = ["bottom", "top", "center"]
+MAX_LINES = {"title": 3, "subtitle": 2, "author": 1}
+LINE_SPACING = 1.15
+
+
+def _template(width, height, placement):
+    """Boxes for the template whose aspect ratio is closest to the image's"""
+    def aspect_gap(size):
+        template_width, template_height = (int(n) for n in size.split("x"))
+        return abs(template_width / template_height - width / height)
+
+    size = f"{width}x{height}"
+    if size not in TEMPLATES:
+        size = min(TEMPLATES, key=aspect_gap)
+    templates = TEMPLATES[size]
+    return templates.get(placement, templates["bottom"])
+
+
+@lru_cache(maxsize=256)
+def load_font(family, size):
+    """A TrueType font of the family at a pixel size, falling back to Pillow's default"""
+    from PIL import ImageFont
+
+    # A directory of extra .ttf/.otf files searched first (e.g. licensed brand fonts)
+    font_dir = os.getenv("COVER_FONT_DIR", "")
+    for name in FONTS.get(family, FONTS[DEFAULT_FONT]):
+        candidates = [os.path.join(font_dir, name), name] if font_dir else [name]
+        for candidate in candidates:
+            try:
+                return ImageFont.truetype(candidate, size)
+            except OSError:
+                continue
+    return ImageFont.load_default(size)
+
+
+def _wrap(text, font, width, max_lines):
+    """Greedy word wrap; None if the text needs more than max_lines at this size"""
+    lines = []
+    for word in text.split():
+        if lines and font.getlength(f"{lines[-1]} {word}") <= width:
+            lines[-1] = f"{lines[-1]} {word}"
+            continue
+        if font.getlength(word) > width:
+            return None
+        lines.append(word)
+        if len(lines) > max_lines:
+            return None
+    return lines
+
+
+def fit_text(text, family, width, height, max_lines=3):
+    """(font, lines) for the largest size at which text fits a width x height box"""
+    low, high = 8, max(8, int(height))
+    best = None
+    while low <= high:
+        size = (low + high) // 2
+        font = load_font(family, size)
+        lines = _wrap(text, font, width, max_lines)
+        if lines is not None and len(lines) * size * LINE_SPACING <= height:
+            best = (font, lines)
+            low = size + 1
+        else:
+            high = size - 1
+    if best is None:
+        # Too long for the box even at the smallest size: cut it rather than overflow
+        font = load_font(family, 8)
+        best = font, (_wrap(text, font, width, max_lines * 8) or [text])[:max_lines]
+    return best
+
+
+def _draw_block(draw, image, text, family, box, max_lines):
+    from PIL import ImageStat
+
+    left, top, right, bottom = box
+    font, lines = fit_text(text, family, right - left, bottom - top, max_lines)
+    size = font.size if hasattr(font, "size") else int((bottom - top) / max_lines)
+
+    # Light text on dark art and the reverse, outlined for busy backgrounds
+    luminance = ImageStat.Stat(image.crop(box).convert("L")).mean[0]
+    fill, outline = ((255, 255, 255), (0, 0, 0)) if luminance < 150 else ((20, 20, 20), (255, 255, 255))
+    stroke = max(1, size // 20)
+
+    line_height = size * LINE_SPACING
+    y = top + ((bottom - top) - line_height * len(lines)) / 2
+    for line in lines:
+        x = left + ((right - left) - font.getlength(line)) / 2
+        draw.text((x, y), line, font=font, fill=fill, stroke_width=stroke, stroke_fill=outline)
+        y += line_height
+
+
+def compose_cover(base, title, subtitle="", author="", font=DEFAULT_FONT, placement="bottom", output_format="png"):
+    """Letter the title, subtitle and author onto base art; returns the encoded cover.
+
+    base is an encoded image (bytes-like) or a file path. Empty texts are
+    left out; the boxes come from the template for the image's size.
+    """
+    from PIL import Image, ImageDraw
+
+    started = time.perf_counter()
+    source = base if isinstance(base, (str, os.PathLike)) else io.BytesIO(base)
+    with Image.open(source) as opened:
+        image = opened.convert("RGB")
+    width, height = image.size
+    boxes = _template(width, height, placement)
+
+    draw = ImageDraw.Draw(image)
+    for field, text in (("title", title), ("subtitle", subtitle), ("author", author)):
+        if not text or not text.strip():
+            continue
+        left, top, right, bottom = boxes[field]
+        box = (int(left * width), int(top * height), int(right * width), int(bottom * height))
+        _draw_block(draw, image, text.strip(), font, box, MAX_LINES[field])
+
+    buffer = io.BytesIO()
+    if output_format == "jpeg":
+        image.save(buffer, format="JPEG", quality=95)
+    else:
+        # Fast zlib level: the cover is stored once and a re-letter should stay interactive
+        image.save(buffer, format="PNG", compress_level=1)
+    metrics.observe("lettering_seconds", time.perf_counter() - started)
+    return buffer.getvalue()
+
+
+def reletter(history_store, record, title, subtitle="", author="", font=DEFAULT_FONT, placement="bottom"):
+    """Letter a stored cover's base art anew and store it as a new cover.
+
+    Returns the new cover id, or None when the cover has no base art (it
+    was generated with its title painted in, or the art was cleared).
+    """
+    base = history_store.base_art(record["base_key"]) if record.get("base_key") else None
+    if base is None:
+        return None
+    cover = compose_cover(base, title, subtitle, author, font, placement, record["format"])
+    return history_store.add(
+        cover,
+        title,
+        record["category"],
+        record["summary"],
+        record["prompt"],
+        record["size"],
+        quality=record["quality"],
+        base_key=record["base_key"],
+        subtitle=subtitle or None,
+        author=author or None
+    )
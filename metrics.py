@@ -0,0 +1,184 @@
+"""In-process latency/size histograms and counters for the generation path.
+
+Instrumented code records into the module-level REGISTRY; the UI and the
+batch CLI read it back as percentiles, Prometheus text or JSON lines.
+"""
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+SECONDS_BUCKETS = (
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+    20, 30, 45, 60, 90, 120, 180, 300
+)
+BYTES_BUCKETS = tuple(1024 * 4 ** n for n in range(10))  # 1 KiB .. 256 MiB
+
+METRIC_PREFIX = "cover_"
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Histogram:
+    """Cumulative-bucket histogram, the same shape Prometheus uses"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets) + (math.inf,)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def quantile(self, q):
+        """Estimate a quantile by interpolating inside the bucket that holds it"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for bound, n in zip(self.buckets, self.counts):
+            if n and seen + n >= rank:
+                if math.isinf(bound):
+                    return lower
+                return lower + (bound - lower) * (rank - seen) / n
+            seen += n
+            lower = bound
+        return lower
+
+
+class Registry:
+    """Thread-safe collection of labelled histograms and counters"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}  # (name, labels) -> Histogram
+        self._counters = {}    # (name, labels) -> float
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def observe(self, name, value, buckets=SECONDS_BUCKETS, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def increment(self, name, amount=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Record the duration of the with-block in seconds"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def summary(self):
+        """Rows of count/mean/p50/p95/p99 per histogram, for display"""
+        with self._lock:
+            items = sorted(self._histograms.items())
+            rows = []
+            for (name, labels), histogram in items:
+                rows.append({
+                    "metric": name + "".join(f" {k}={v}" for k, v in labels),
+                    "count": histogram.count,
+                    "mean": histogram.sum / histogram.count if histogram.count else 0.0,
+                    "p50": histogram.quantile(0.50),
+                    "p95": histogram.quantile(0.95),
+                    "p99": histogram.quantile(0.99)
+                })
+        return rows
+
+    def counters(self):
+        with self._lock:
+            return {
+                name + "".join(f" {k}={v}" for k, v in labels): value
+                for (name, labels), value in sorted(self._counters.items())
+            }
+
+    def to_prometheus(self):
+        """Prometheus text exposition format"""
+        def label_str(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{k}="{_escape_label(v)}"' for k, v in pairs) + "}"
+
+        lines = []
+        with self._lock:
+            typed = set()
+            for (name, labels), value in sorted(self._counters.items()):
+                metric = METRIC_PREFIX + name
+                if metric not in typed:
+                    lines.append(f"# TYPE {metric} counter")
+                    typed.add(metric)
+                lines.append(f"{metric}{label_str(labels)} {value}")
+
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                metric = METRIC_PREFIX + name
+                if metric not in typed:
+                    lines.append(f"# TYPE {metric} histogram")
+                    typed.add(metric)
+                cumulative = 0
+                for bound, n in zip(histogram.buckets, histogram.counts):
+                    cumulative += n
+                    le = "+Inf" if math.isinf(bound) else repr(bound)
+                    lines.append(f"{metric}_bucket{label_str(labels, [('le', le)])} {cumulative}")
+                lines.append(f"{metric}_sum{label_str(labels)} {histogram.sum}")
+                lines.append(f"{metric}_count{label_str(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def to_json_lines(self):
+        """One JSON object per metric series, stamped with the export time"""
+        now = time.time()
+        lines = []
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                lines.append(json.dumps({
+                    "ts": now, "metric": name, "labels": dict(labels), "type": "counter", "value": value
+                }))
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                lines.append(json.dumps({
+                    "ts": now,
+                    "metric": name,
+                    "labels": dict(labels),
+                    "type": "histogram",
+                    "count": histogram.count,
+                    "sum": histogram.sum,
+                    "p50": histogram.quantile(0.50),
+                    "p95": histogram.quantile(0.95),
+                    "p99": histogram.quantile(0.99),
+                    "buckets": [
+                        ["+Inf" if math.isinf(bound) else bound, n]
+                        for bound, n in zip(histogram.buckets, histogram.counts)
+                    ]
+                }))
+        return "\n".join(lines) + ("\n" if lines else "")
+
+
+REGISTRY = Registry()
+observe = REGISTRY.observe
+increment = REGISTRY.increment
+timer = REGISTRY.timer
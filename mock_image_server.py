@@ -0,0 +1,279 @@
+"""Local stand-in for the Azure images/generations endpoint.
+
+Answers POSTs to any path ending in /images/generations (JSON) or
+/images/edits (multipart with a reference image) with b64_json images
+after a sampled delay, and can inject 429s and 500s, so the generation
+path can be exercised and benchmarked without spending quota. The delay
+scales with the requested quality, roughly as the real service's does.
+Requests with "stream": true are answered with server-sent events: the
+requested number of partial images spread over the delay, then the image.
+Several images per request ("n") take longer than one but less than n
+separate requests; n above max_n is refused, and short_rate drops items
+from a response to imitate partial answers.
+
+    python mock_image_server.py --port 8765 --latency-median 2 --throttle-rate 0.05
+
+then point the app at it with COVER_AZURE_ENDPOINT=http://127.0.0.1:8765/openai/deployments/mock/images/generations
+"""
+import argparse
+import base64
+import json
+import math
+import random
+import struct
+import threading
+import time
+import zlib
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Latency multiplier per requested quality
+QUALITY_LATENCY = {"low": 0.3, "medium": 1.0, "high": 2.0}
+# Added latency per extra image in one request, as a fraction of a single image's
+BATCH_LATENCY = 0.35
+
+
+def parse_form(content_type, body):
+    """Text fields of a multipart/form-data body (file parts are dropped)"""
+    message = BytesParser(policy=HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode("latin-1") + body
+    )
+    return {
+        part.get_param("name", header="content-disposition"): part.get_content()
+        for part in message.iter_parts()
+        if not part.get_filename()
+    }
+
+
+def make_png(target_bytes, seed=0):
+    """A valid RGB PNG of roughly target_bytes, filled with incompressible noise"""
+    side = max(1, int(math.sqrt(target_bytes / 3)))
+    rng = random.Random(seed)
+    raw = b"".join(b"\x00" + rng.randbytes(side * 3) for _ in range(side))
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", side, side, 8, 2, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", header)
+        + chunk(b"IDAT", zlib.compress(raw, 1))
+        + chunk(b"IEND", b"")
+    )
+
+
+class MockConfig:
+    """Behaviour knobs; read by request handlers, so keep them simple values"""
+
+    def __init__(
+        self,
+        latency_median=1.0,
+        latency_sigma=0.25,
+        error_rate=0.0,
+        throttle_rate=0.0,
+        retry_after=1.0,
+        image_bytes=1_500_000,
+        distinct_images=4,
+        stall_rate=0.0,
+        stall_seconds=60.0,
+        streaming=True,
+        max_n=10,
+        short_rate=0.0,
+        seed=None
+    ):
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.stall_rate = stall_rate
+        self.stall_seconds = stall_seconds
+        self.streaming = streaming
+        self.max_n = max_n
+        self.short_rate = short_rate
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        # Encoding images per request would make the mock the bottleneck
+        self.images_b64 = [
+            base64.b64encode(make_png(image_bytes, seed=n)).decode("ascii")
+            for n in range(distinct_images)
+        ]
+        # Partial frames are smaller, like the coarse early renders of the real service
+        self.partials_b64 = [
+            base64.b64encode(make_png(max(1000, image_bytes // 16), seed=1000 + n)).decode("ascii")
+            for n in range(3)
+        ]
+        self.requests = 0
+        self.images_served = 0
+
+    def sample(self):
+        """(outcome, latency seconds) for the next request"""
+        with self.rng_lock:
+            self.requests += 1
+            roll = self.rng.random()
+            latency = self.latency_median * math.exp(self.rng.gauss(0, self.latency_sigma))
+            if self.rng.random() < self.stall_rate:
+                latency = self.stall_seconds
+        if roll < self.throttle_rate:
+            return "throttle", 0.0
+        if roll < self.throttle_rate + self.error_rate:
+            return "error", latency / 2
+        return "ok", latency
+
+    def short(self):
+        """Whether to leave one item of a multi-image response out"""
+        with self.rng_lock:
+            return self.rng.random() < self.short_rate
+
+    def pick_image(self):
+        with self.rng_lock:
+            self.images_served += 1
+            return self.rng.choice(self.images_b64)
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real endpoint
+    config = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_events(self, events, latency):
+        """Stream (type, b64 image) events as SSE, spread evenly over latency seconds"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for n, (event_type, image_b64) in enumerate(events):
+            time.sleep(latency / len(events))
+            data = json.dumps({"type": event_type, "b64_json": image_b64, "partial_image_index": n})
+            chunk = f"event: {event_type}\ndata: {data}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(chunk):x}\r\n".encode("ascii") + chunk + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        path = self.path.split("?")[0]
+        try:
+            if path.endswith("/images/generations"):
+                payload = json.loads(body)
+            elif path.endswith("/images/edits"):
+                payload = parse_form(self.headers.get("Content-Type", ""), body)
+            else:
+                self._send_json(404, {"error": {"message": "not found"}})
+                return
+        except ValueError:
+            self._send_json(400, {"error": {"message": "invalid request body"}})
+            return
+
+        # JSON bodies carry a boolean, form fields its JSON spelling
+        stream = payload.get("stream") in (True, "true")
+        if stream and not self.config.streaming:
+            self._send_json(400, {"error": {"message": "stream is not supported for this deployment"}})
+            return
+
+        count = int(payload.get("n", 1))
+        if not 1 <= count <= self.config.max_n:
+            self._send_json(400, {"error": {"message": f"n must be between 1 and {self.config.max_n}"}})
+            return
+
+        outcome, latency = self.config.sample()
+        latency *= QUALITY_LATENCY.get(payload.get("quality"), 1.0) * (1 + BATCH_LATENCY * (count - 1))
+        if stream and outcome == "ok":
+            partials = min(3, max(0, int(payload.get("partial_images", 0))))
+            self._send_events(
+                [("image_generation.partial_image", self.config.partials_b64[n]) for n in range(partials)]
+                + [("image_generation.completed", self.config.pick_image())],
+                latency
+            )
+            return
+        time.sleep(latency)
+
+        if outcome == "throttle":
+            self._send_json(
+                429,
+                {"error": {"code": "429", "message": "Rate limit exceeded"}},
+                headers={"Retry-After": f"{self.config.retry_after:g}"}
+            )
+        elif outcome == "error":
+            self._send_json(500, {"error": {"message": "Internal server error"}})
+        else:
+            data = []
+            for _ in range(count):
+                if self.config.short():
+                    # Alternate the two ways a response comes up short: a missing item, an item without an image
+                    if len(data) % 2:
+                        data.append({"revised_prompt": payload.get("prompt", "")})
+                    continue
+                data.append({"b64_json": self.config.pick_image()})
+            self._send_json(200, {"created": int(time.time()), "data": data})
+
+
+def start_mock_server(host="127.0.0.1", port=0, config=None):
+    """Serve in a daemon thread; returns (server, endpoint_url). Stop with server.shutdown()"""
+    handler = type("BoundMockHandler", (MockHandler,), {"config": config or MockConfig()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="mock-image-server", daemon=True)
+    thread.start()
+    url = f"http://{host}:{server.server_address[1]}/openai/deployments/mock/images/generations"
+    return server, url
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock image-generation endpoint")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-median", type=float, default=1.0, help="Median response time in seconds")
+    parser.add_argument("--latency-sigma", type=float, default=0.25, help="Log-normal spread of response time")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction answered with 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--image-bytes", type=int, default=1_500_000, help="Approximate PNG size per image")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="Fraction of requests that hang")
+    parser.add_argument("--stall-seconds", type=float, default=60.0, help="How long a hanging request takes")
+    parser.add_argument("--max-n", type=int, default=10, help="Largest n accepted per request")
+    parser.add_argument("--short-rate", type=float, default=0.0, help="Chance each image is left out of a response")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    config = MockConfig(
+        latency_median=args.latency_median,
+        latency_sigma=args.latency_sigma,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        retry_after=args.retry_after,
+        image_bytes=args.image_bytes,
+        stall_rate=args.stall_rate,
+        stall_seconds=args.stall_seconds,
+        max_n=args.max_n,
+        short_rate=args.short_rate,
+        seed=args.seed
+    )
+    server, url = start_mock_server(args.host, args.port, config)
+    print(f"Mock endpoint: {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""Near-duplicate detection for stored covers with perceptual hashes.
+
+Variations of one prompt often come back almost identical. Each stored
+image gets two 64-bit fingerprints computed from its thumbnail: a pHash
+(sign of the low-frequency DCT coefficients against their median) and a
+dHash (sign of horizontal brightness gradients). Two images are near
+duplicates when both Hamming distances are small. The index keeps every
+fingerprint in NumPy arrays, so one lookup is an XOR and popcount over the
+whole history: well under a millisecond for tens of thousands of covers.
+"""
+import os
+import threading
+import time
+
+import metrics
+
+HASH_SIZE = 8
+PHASH_SIDE = 32
+DEFAULT_MAX_DISTANCE = 8  # COVER_DUPLICATE_DISTANCE overrides it
+
+
+def _grayscale(source, width, height):
+    """Decode an image (path or bytes-like) into a float array of the given size"""
+    import io
+
+    import numpy as np
+    from PIL import Image
+
+    if not isinstance(source, (str, os.PathLike)):
+        source = io.BytesIO(source)
+    with Image.open(source) as img:
+        img.draft("L", (width * 4, height * 4))
+        pixels = img.convert("L").resize((width, height), Image.LANCZOS)
+        return np.asarray(pixels, dtype=np.float32)
+
+
+def _pack(bits):
+    import numpy as np
+
+    return int(np.packbits(bits.ravel().astype(np.uint8)).view(">u8")[0])
+
+
+_dct_matrix = None
+
+
+def _dct():
+    # Orthonormal DCT-II basis; the 2-D transform is then two matrix products
+    global _dct_matrix
+    if _dct_matrix is None:
+        import numpy as np
+
+        n = np.arange(PHASH_SIDE)
+        matrix = np.cos(np.pi * (2 * n[None, :] + 1) * n[:, None] / (2 * PHASH_SIDE))
+        matrix[0] *= np.sqrt(1 / PHASH_SIDE)
+        matrix[1:] *= np.sqrt(2 / PHASH_SIDE)
+        _dct_matrix = matrix.astype(np.float32)
+    return _dct_matrix
+
+
+def dhash(source):
+    """64-bit difference hash: is each pixel brighter than its right neighbour"""
+    pixels = _grayscale(source, HASH_SIZE + 1, HASH_SIZE)
+    return _pack(pixels[:, 1:] > pixels[:, :-1])
+
+
+def phash(source):
+    """64-bit DCT hash of the image's coarse structure"""
+    import numpy as np
+
+    pixels = _grayscale(source, PHASH_SIDE, PHASH_SIDE)
+    matrix = _dct()
+    low = (matrix @ pixels @ matrix.T)[:HASH_SIZE, :HASH_SIZE]
+    # The DC term only encodes overall brightness, so it doesn't set the threshold
+    return _pack(low > np.median(low.ravel()[1:]))
+
+
+def image_hashes(source):
+    """(phash, dhash) of an encoded image or image file"""
+    return phash(source), dhash(source)
+
+
+class DuplicateIndex:
+    """Perceptual hashes of every stored image, kept in memory for lookups.
+
+    The index loads from the history store on first use and is updated as
+    check() hashes new covers. It is safe to share between threads.
+    """
+
+    def __init__(self, history_store, max_distance=None):
+        if max_distance is None:
+            max_distance = int(os.getenv("COVER_DUPLICATE_DISTANCE", DEFAULT_MAX_DISTANCE))
+        self.history_store = history_store
+        self.max_distance = max_distance
+        self._image_hashes = []
+        self._phashes = None
+        self._dhashes = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        # Caller holds the lock
+        import numpy as np
+
+        rows = self.history_store.perceptual_hashes()
+        self._image_hashes = [row[0] for row in rows]
+        # Stored as signed integers; the bit patterns are what matter
+        self._phashes = np.array([row[1] for row in rows], dtype=np.int64).view(np.uint64)
+        self._dhashes = np.array([row[2] for row in rows], dtype=np.int64).view(np.uint64)
+        self._loaded = True
+
+    def reload(self):
+        """Forget everything and read the hashes from the store again (e.g. after a clear)"""
+        with self._lock:
+            self._loaded = False
+
+    def __len__(self):
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            return len(self._image_hashes)
+
+    def nearest(self, phash_value, dhash_value, exclude=()):
+        """(image hash, distance) of the closest indexed near duplicate, or None.
+
+        Both hashes must be within max_distance bits; the distance returned is
+        their sum. exclude holds image hashes to skip (the image itself).
+        """
+        import numpy as np
+
+        started = time.perf_counter()
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            image_hashes, phashes, dhashes = self._image_hashes, self._phashes, self._dhashes
+        if not image_hashes:
+            return None
+
+        p_distance = np.bitwise_count(phashes ^ np.uint64(phash_value))
+        d_distance = np.bitwise_count(dhashes ^ np.uint64(dhash_value))
+        total = p_distance.astype(np.int32) + d_distance
+        total[(p_distance > self.max_distance) | (d_distance > self.max_distance)] = 255
+        if exclude:
+            for position in np.flatnonzero(total < 255):
+                if image_hashes[position] in exclude:
+                    total[position] = 255
+        best = int(np.argmin(total))
+        metrics.observe("duplicate_lookup_seconds", time.perf_counter() - started)
+        if total[best] == 255:
+            return None
+        return image_hashes[best], int(total[best])
+
+    def _add(self, image_hash, phash_value, dhash_value):
+        import numpy as np
+
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            # Appending copies the arrays; lookups keep using the references they took
+            self._image_hashes = self._image_hashes + [image_hash]
+            self._phashes = np.append(self._phashes, np.uint64(phash_value))
+            self._dhashes = np.append(self._dhashes, np.uint64(dhash_value))
+
+    def check(self, record, related=()):
+        """Hash a stored cover if needed; returns the image hash it duplicates, or None.
+
+        Only images hashed before this one count as originals, so the first
+        of a group of look-alikes is the one left unflagged. A cover reusing
+        an image an earlier cover already shows (a cache hit) duplicates
+        that image itself. related holds image hashes the cover is meant to
+        resemble (the draft a final was rendered from), which never count;
+        nor do other letterings of the same base art.
+        """
+        stored = self.history_store.perceptual_hash(record["image_hash"])
+        if stored is not None:
+            if stored[2] is None and "id" in record:
+                if self.history_store.first_cover_id(record["image_hash"]) not in (None, record["id"]):
+                    return record["image_hash"]
+            return stored[2]
+
+        with metrics.timer("duplicate_hash_seconds"):
+            phash_value, dhash_value = image_hashes(record["thumb_path"] or record["path"])
+        exclude = {record["image_hash"], *related, *self.history_store.same_base_images(record["image_hash"])}
+        match = self.nearest(phash_value, dhash_value, exclude=exclude)
+        duplicate_of = match[0] if match else None
+        self.history_store.set_perceptual_hash(record["image_hash"], phash_value, dhash_value, duplicate_of)
+        self._add(record["image_hash"], phash_value, dhash_value)
+        if duplicate_of:
+            metrics.increment("duplicates_total")
+        return duplicate_of
+
+    def backfill(self, batch_size=200):
+        """Hash images stored before the index existed; returns how many were hashed"""
+        hashed = 0
+        while True:
+            pending = self.history_store.unhashed_images(batch_size)
+            if not pending:
+                return hashed
+            for record in pending:
+                try:
+                    self.check(record)
+                except Exception:
+                    # Unreadable image: give it an all-zero hash so it isn't retried forever
+                    self.history_store.set_perceptual_hash(record["image_hash"], 0, 0)
+                hashed += 1
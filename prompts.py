@@ -0,0 +1,100 @@
+"""Prompt construction for book cover generation"""
+
+# Thematic palette per book category; the keys are the UI's category list
+CATEGORY_PALETTES = {
+    "Personal Growth": "warm soft tones",
+    "Business Strategy": "structured warm neutrals with dark accents",
+    "Marketing": "bright high contrast warm colors",
+    "Sales": "warm reds with deep navy",
+    "Startups": "blue dominant tones with warm highlights",
+    "Psychology": "purple blue with subtle warm accents",
+    "Sociology": "natural greens and earth tones",
+    "Biographies": "soft natural colors, stylized portrait or silhouette",
+    "History": "earth tones with deep blues",
+    "Religious": "soft earth tones with golden light",
+    "Spirituality": "warm mystical hues",
+    "Philosophy": "neutral tones with strong contrast",
+    "Language Learning": "warm friendly tones",
+    "Children's Books": "bright playful colors and rounded shapes"
+}
+BOOK_CATEGORIES = list(CATEGORY_PALETTES)
+
+STYLE_OPTIONS = ["Vector", "Geometric", "Minimalist", "Bold", "Elegant", "Modern", "Classic", "Abstract"]
+DEFAULT_STYLES = ["Vector", "Geometric", "Minimalist"]
+COLOR_OPTIONS = ["Warm", "Cool", "Neutral", "Vibrant", "Pastel", "Bold"]
+DEFAULT_COLORS = ["Warm"]
+
+# Last line of every built prompt
+CLOSING = (
+    "Generate a visually striking, professional book cover that immediately communicates the book's theme "
+    "and appeals to the target audience."
+)
+
+
+# Starting point for writing a prompt by hand
+PROMPT_TEMPLATE = """Create a professional book cover for: "{TITLE}"
+
+Key Visual Elements:
+- [Describe main visual element]
+- [Describe secondary element]
+- [Describe background]
+
+Style & Colors:
+- Style: [Vector/Realistic/Illustration/Abstract]
+- Primary Colors: [Color 1, Color 2, Color 3]
+- Tone: [Professional/Creative/Modern/Classic]
+
+Text:
+- Title: "{TITLE}" - [Size/Position/Style]
+- Subtitle: [If applicable]
+
+Additional Notes:
+- [Any special requirements]
+- [Avoid: List what to avoid]
+- [Target audience: Who will see this?]"""
+
+
+def build_prompt(title, summary, category, styles, colors, additional, include_title=True):
+    """Build the complete prompt for image generation.
+
+    Without include_title the prompt asks for artwork with no lettering and
+    leaves the title out entirely, so one base image serves any title set
+    on it locally (see lettering.py).
+    """
+    
+    styles_str = ", ".join(styles) if styles else "Vector, Geometric, Minimalist"
+    colors_str = ", ".join(colors) if colors else "Warm"
+    color_palette = CATEGORY_PALETTES.get(category, "warm soft tones")
+    
+    subject = f'for: "{title}"' if include_title else "(artwork only, no text)"
+    title_rule = (
+        f'- Include title at bottom: "{title}"' if include_title
+        else "- No text, letters or numbers anywhere; keep the bottom third calm for a title added later"
+    )
+    
+    prompt = f"""Create a professional book cover illustration {subject}
+
+Book Category: {category}
+Book Summary: {summary}
+
+Design Requirements:
+- Style: {styles_str}
+- Color Tone: {colors_str}
+- Color Palette: {color_palette}
+- Layout: Vertical (3 by 2 ratio)
+- Format: Clean editorial vector style
+
+Composition Rules:
+- Use large, bold geometric vector shapes
+- Create one clear metaphor that represents the book's core idea
+- Keep forms solid, crisp, and immediately readable
+- Avoid small icons or decorative clutter
+- Use soft gradients and minimal grain texture for depth
+{title_rule}
+- No realism - pure vector design
+
+{f'Additional Requirements: {additional}' if additional else ''}
+
+{CLOSING}"""
+    
+    return prompt
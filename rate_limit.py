@@ -0,0 +1,190 @@
+"""Client-side throttling for calls to the image endpoint"""
+import threading
+import time
+
+
+# Default burst: the tokens a bucket earns in this many seconds
+BURST_SECONDS = 5.0
+
+
+class TokenBucket:
+    """Allow `rate` tokens per `per` seconds, with bursts of up to `capacity`.
+
+    capacity defaults to BURST_SECONDS worth of tokens (at least one), so a
+    fresh bucket can't send a whole period's quota at once; pass a larger
+    capacity to allow that. acquire() blocks until enough tokens are
+    available. Safe to share between threads.
+    """
+
+    def __init__(self, rate, per=60.0, capacity=None):
+        self.rate = rate / per  # tokens per second
+        self.capacity = capacity if capacity is not None else max(1.0, self.rate * BURST_SECONDS)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def drain(self):
+        """Empty the bucket, as if a burst had just used it up"""
+        with self._lock:
+            self._tokens = 0.0
+            self._updated = time.monotonic()
+
+    def wait_time(self, tokens=1):
+        """Seconds until tokens would be available, without taking them"""
+        with self._lock:
+            self._refill(time.monotonic())
+            return max(0.0, (min(tokens, self.capacity) - self._tokens) / self.rate)
+
+    def acquire(self, tokens=1):
+        """Take tokens, sleeping until they are available; returns seconds waited"""
+        # A request larger than the bucket waits for a full one and leaves it in
+        # debt, so later callers still pay for every token
+        needed = min(tokens, self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= needed:
+                    self._tokens -= tokens
+                    return waited
+                delay = (needed - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+# Responses that mean "slow down" rather than "this request is bad"
+THROTTLE_STATUS = {429, 503}
+
+
+class AdaptiveConcurrency:
+    """AIMD limit on requests in flight.
+
+    Each success raises the limit by about `increase` per window of `limit`
+    requests; a throttling response multiplies it by `decrease`. Throttles
+    from requests that started before the last cut are ignored, so one
+    burst of 429s shrinks the window once, not once per request. A
+    Retry-After pauses every caller until it has passed.
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=16, increase=1.0, decrease=0.5):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.limit = float(min(max(initial, minimum), maximum))
+        self._in_flight = 0
+        self._last_decrease = 0.0
+        self._paused_until = 0.0
+        self._cond = threading.Condition()
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def paused_for(self):
+        """Seconds left of a Retry-After pause (0 when not paused)"""
+        with self._cond:
+            return max(0.0, self._paused_until - time.monotonic())
+
+    def acquire(self):
+        """Block until a slot is free; returns the start time to pass to release()"""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    self._cond.wait(self._paused_until - now)
+                elif self._in_flight < max(self.minimum, int(self.limit)):
+                    break
+                else:
+                    self._cond.wait()
+            self._in_flight += 1
+            return now
+
+    def release(self, started, outcome="success", retry_after=None):
+        """Free a slot; outcome is "success", "throttled" or "error" (no change)"""
+        with self._cond:
+            self._in_flight -= 1
+            now = time.monotonic()
+            if outcome == "throttled":
+                if started >= self._last_decrease:
+                    self.limit = max(self.minimum, self.limit * self.decrease)
+                    self._last_decrease = now
+                if retry_after:
+                    self._paused_until = max(self._paused_until, now + retry_after)
+            elif outcome == "success":
+                self.limit = min(self.maximum, self.limit + self.increase / self.limit)
+            self._cond.notify_all()
+
+
+class Throttle:
+    """Everything a caller waits on before sending a request to the endpoint.
+
+    Combines request and image token buckets (the deployment's per-minute
+    quotas; None means unlimited) with adaptive concurrency. One instance
+    should be shared by every caller in the process.
+    """
+
+    def __init__(self, requests_per_minute=None, images_per_minute=None, max_concurrency=8, initial_concurrency=4):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.images = TokenBucket(images_per_minute) if images_per_minute else None
+        self.concurrency = AdaptiveConcurrency(initial=initial_concurrency, maximum=max_concurrency)
+        self.successes = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def drain(self):
+        """Empty the quota buckets, leaving only the sustained rate"""
+        for bucket in (self.requests, self.images):
+            if bucket:
+                bucket.drain()
+
+    def acquire(self, images=1):
+        """Wait for a concurrency slot and quota; returns a ticket for release()"""
+        started = self.concurrency.acquire()
+        try:
+            if self.requests:
+                self.requests.acquire()
+            if self.images:
+                self.images.acquire(images)
+        except BaseException:
+            self.concurrency.release(started, outcome="error")
+            raise
+        return started
+
+    def release(self, ticket, status=None, retry_after=None):
+        """Report how the request went; status None means no response"""
+        if status in THROTTLE_STATUS:
+            outcome = "throttled"
+        elif status is not None and status < 400:
+            outcome = "success"
+        else:
+            outcome = "error"
+
+        with self._lock:
+            if outcome == "throttled":
+                self.throttled += 1
+            elif outcome == "success":
+                self.successes += 1
+        self.concurrency.release(ticket, outcome=outcome, retry_after=retry_after)
+
+    def wait_time(self, images=1):
+        """Rough seconds a new request would wait for quota or a Retry-After pause"""
+        waits = [self.concurrency.paused_for()]
+        if self.requests:
+            waits.append(self.requests.wait_time())
+        if self.images:
+            waits.append(self.images.wait_time(images))
+        return max(waits)
+
+    def stats(self):
+        return {
+            "concurrency_limit": self.concurrency.limit,
+            "in_flight": self.concurrency.in_flight,
+            "successes": self.successes,
+            "throttled": self.throttled
+        }
@@ -0,0 +1,261 @@
+"""Spreading requests over several image deployments.
+
+Each deployment has its own endpoint, key, weight and quota, and its own
+Throttle, so adding a deployment adds its quota to the total. The router
+sends each request to the better of two randomly sampled healthy
+deployments, judged by observed latency, error rate, requests in flight
+and the wait its quota would impose. A circuit breaker takes a deployment
+out of rotation after repeated failures and probes it again after a
+cooldown; a request that fails on one deployment moves on to another.
+
+Deployments are configured as a JSON list, inline or in a file:
+
+    [{"name": "east", "endpoint": "https://east.openai.azure.com/openai/deployments/img/images/generations",
+      "api_key_env": "EAST_KEY", "weight": 2, "rpm": 20, "ipm": 20},
+     {"name": "west", "endpoint": "...", "api_key_env": "WEST_KEY", "rpm": 10}]
+"""
+import json
+import os
+import random
+import threading
+import time
+
+import metrics
+from generation import API_VERSION, endpoint_url
+from rate_limit import THROTTLE_STATUS, Throttle
+
+# The request itself was refused (e.g. a prompt the content filter rejects);
+# every deployment would answer the same, so these neither fail over nor count
+# against a deployment's health. Other 4xx (a bad key, a missing deployment) do.
+CLIENT_ERROR_STATUS = {400, 413, 422}
+ATTEMPTS_PER_HOP = 2    # HTTP attempts on one deployment before failing over
+
+FAILURE_THRESHOLD = 5   # consecutive failures that open a deployment's circuit
+COOLDOWN = 30.0         # seconds an open circuit waits before a probe
+MAX_COOLDOWN = 300.0
+EWMA_ALPHA = 0.2        # weight of the newest sample in latency and error averages
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class Deployment:
+    """One endpoint with its quota and health; used by the router as a request's throttle"""
+
+    def __init__(
+        self,
+        name,
+        url,
+        api_key=None,
+        weight=1.0,
+        requests_per_minute=None,
+        images_per_minute=None,
+        max_concurrency=8
+    ):
+        self.name = name
+        self.url = url
+        self.api_key = api_key
+        self.weight = weight
+        self.throttle = Throttle(
+            requests_per_minute=requests_per_minute,
+            images_per_minute=images_per_minute,
+            max_concurrency=max_concurrency,
+            initial_concurrency=min(4, max_concurrency)
+        )
+        self.latency = None  # EWMA of seconds per attempt, None until measured
+        self.error_rate = 0.0
+        self.state = CLOSED
+        self.requests = 0
+        self.failures = 0
+        self._consecutive_failures = 0
+        self._cooldown = COOLDOWN
+        self._open_until = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def available(self):
+        """Whether a request may be sent here now (one probe at a time when half-open)"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() >= self._open_until:
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == HALF_OPEN and not self._probing:
+                return True
+            return False
+
+    def begin(self):
+        """Note that a request was routed here; it is the probe of a half-open circuit"""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probing = True
+
+    def cost(self, default_latency):
+        """Expected seconds for a request sent here now, scaled down by weight"""
+        latency = self.latency if self.latency is not None else default_latency
+        limit = max(1, int(self.throttle.concurrency.limit))
+        load = self.throttle.concurrency.in_flight / limit
+        return (latency * (1 + load) * (1 + 4 * self.error_rate) + self.throttle.wait_time()) / self.weight
+
+    def record(self, seconds, status):
+        """Fold one attempt's outcome into the averages and the circuit state"""
+        failed = status is None or (
+            status >= 400 and status not in THROTTLE_STATUS and status not in CLIENT_ERROR_STATUS
+        )
+        with self._lock:
+            self.requests += 1
+            if status is not None and status not in THROTTLE_STATUS:
+                self.latency = seconds if self.latency is None else (
+                    EWMA_ALPHA * seconds + (1 - EWMA_ALPHA) * self.latency
+                )
+            self.error_rate = EWMA_ALPHA * failed + (1 - EWMA_ALPHA) * self.error_rate
+            if not failed:
+                self._consecutive_failures = 0
+                if self.state != CLOSED:
+                    self.state = CLOSED
+                    self._cooldown = COOLDOWN
+                return
+            self.failures += 1
+            self._consecutive_failures += 1
+            # Late failures from requests sent before the circuit opened don't extend it
+            if self.state == HALF_OPEN or (self.state == CLOSED and self._consecutive_failures >= FAILURE_THRESHOLD):
+                if self.state == HALF_OPEN:
+                    self._cooldown = min(MAX_COOLDOWN, self._cooldown * 2)
+                self.state = OPEN
+                self._open_until = time.monotonic() + self._cooldown
+                opened = True
+            else:
+                opened = False
+        if opened:
+            metrics.increment("circuit_opened_total", deployment=self.name)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "name": self.name,
+                "state": self.state,
+                "weight": self.weight,
+                "requests": self.requests,
+                "failures": self.failures,
+                "latency_s": self.latency,
+                "error_rate": self.error_rate,
+                "in_flight": self.throttle.concurrency.in_flight,
+                "concurrency_limit": self.throttle.concurrency.limit
+            }
+
+
+class _Attempt:
+    """Throttle handed to post_with_retry for one routed request.
+
+    Forwards to the deployment's throttle, feeds each HTTP attempt into
+    the deployment's health, and remembers the last status seen.
+    """
+
+    def __init__(self, deployment):
+        self.deployment = deployment
+        self.status = None
+
+    def acquire(self, images=1):
+        ticket = self.deployment.throttle.acquire(images=images)
+        return ticket, time.monotonic()
+
+    def release(self, ticket, status=None, retry_after=None):
+        throttle_ticket, sent_at = ticket
+        self.status = status
+        self.deployment.throttle.release(throttle_ticket, status, retry_after)
+        self.deployment.record(time.monotonic() - sent_at, status)
+
+
+class Router:
+    """Pick a deployment per request and fail over when one misbehaves"""
+
+    def __init__(self, deployments, max_hops=None, attempts_per_hop=ATTEMPTS_PER_HOP):
+        if not deployments:
+            raise ValueError("At least one deployment is required")
+        self.deployments = list(deployments)
+        self.max_hops = max_hops or max(2, len(self.deployments))
+        self.attempts_per_hop = attempts_per_hop
+        self.failovers = 0
+        self._lock = threading.Lock()
+
+    def pick(self, exclude=()):
+        """Cheaper of two random healthy deployments, or None if all are out"""
+        candidates = [d for d in self.deployments if d not in exclude and d.available()]
+        if not candidates:
+            return None
+        if len(candidates) == 1:
+            return candidates[0]
+        # Two random choices spread load without every thread herding to the same "best" target
+        first, second = random.sample(candidates, 2)
+        measured = [d.latency for d in self.deployments if d.latency is not None]
+        default_latency = sum(measured) / len(measured) if measured else 1.0
+        return min((first, second), key=lambda d: d.cost(default_latency))
+
+    def run(self, fn):
+        """Call fn(deployment, throttle) on routed deployments until one succeeds.
+
+        fn makes the request with the given throttle and returns (result,
+        error). A refused request (CLIENT_ERROR_STATUS) is returned as is,
+        since another deployment would refuse it too; anything else moves
+        on to a deployment not yet tried, or back to a healthy one.
+        """
+        tried = []
+        result, error = None, "No healthy deployment available"
+        for hop in range(self.max_hops):
+            deployment = self.pick(exclude=tried) or (self.pick() if tried else None)
+            if deployment is None:
+                break
+            if hop:
+                with self._lock:
+                    self.failovers += 1
+                metrics.increment("failovers_total", deployment=deployment.name)
+            tried.append(deployment)
+            deployment.begin()
+
+            attempt = _Attempt(deployment)
+            try:
+                result, error = fn(deployment, attempt)
+            except Exception as e:
+                result, error = None, str(e)
+            metrics.increment("routed_requests_total", deployment=deployment.name, outcome="ok" if not error else "error")
+            if not error:
+                return result, None
+            if attempt.status in CLIENT_ERROR_STATUS:
+                return result, error
+        return result, error
+
+    def stats(self):
+        return [deployment.stats() for deployment in self.deployments]
+
+
+def load_deployments(config, default_api_key=None):
+    """Deployments from a JSON list, given inline or as a path to a JSON file.
+
+    Keys per entry: endpoint (required; the images/generations URL without
+    api-version), name, api_version, api_key or api_key_env (else
+    default_api_key, i.e. the caller's key), weight, rpm, ipm,
+    max_concurrency.
+    """
+    text = config.strip()
+    if not text.startswith("["):
+        with open(text, encoding="utf-8") as f:
+            text = f.read()
+    entries = json.loads(text)
+
+    deployments = []
+    for n, entry in enumerate(entries):
+        api_key = entry.get("api_key")
+        if not api_key and entry.get("api_key_env"):
+            api_key = os.getenv(entry["api_key_env"])
+        deployments.append(Deployment(
+            entry.get("name", f"deployment-{n + 1}"),
+            endpoint_url(entry["endpoint"], entry.get("api_version", API_VERSION)),
+            api_key=api_key or default_api_key,
+            weight=float(entry.get("weight", 1.0)),
+            requests_per_minute=entry.get("rpm"),
+            images_per_minute=entry.get("ipm"),
+            max_concurrency=int(entry.get("max_concurrency", 8))
+        ))
+    return deployments
@@ -0,0 +1,106 @@
+"""Process-wide request scheduling: coalescing and per-session fair queueing"""
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+import metrics
+
+
+class FairScheduler:
+    """Run callables on a fixed set of worker threads, fairly across owners.
+
+    Each owner (a browser session, a batch run) gets its own FIFO, and
+    workers take from the owners in round-robin order, so a long batch from
+    one owner cannot hold back a single request from another. An owner can
+    also be capped to a number of tasks running at once.
+
+    Tasks submitted with a key that is already queued or running are not run
+    again: the caller gets the Future of the existing task, so identical
+    requests from several sessions share one execution.
+    """
+
+    def __init__(self, workers=8, name="scheduler"):
+        self.name = name
+        self.submitted = 0
+        self.coalesced = 0
+        self._cond = threading.Condition()
+        self._queues = OrderedDict()  # owner -> deque of (key, fn, future, queued_at), in rotation order
+        self._in_flight = {}          # key -> Future, while queued or running
+        self._running = {}            # owner -> tasks currently executing
+        self._limits = {}             # owner -> max tasks executing at once
+
+        for n in range(workers):
+            thread = threading.Thread(target=self._work, name=f"{name}-{n}", daemon=True)
+            thread.start()
+
+    def submit(self, owner, key, fn, limit=None):
+        """Queue fn() for owner and return a Future for its result.
+
+        key identifies equivalent work (None disables coalescing); limit caps
+        how many of this owner's tasks run at the same time.
+        """
+        with self._cond:
+            self.submitted += 1
+            if key is not None and key in self._in_flight:
+                self.coalesced += 1
+                return self._in_flight[key]
+
+            future = Future()
+            if key is not None:
+                self._in_flight[key] = future
+            if limit:
+                self._limits[owner] = limit
+            self._queues.setdefault(owner, deque()).append((key, fn, future, time.perf_counter()))
+            self._cond.notify()
+            return future
+
+    def _next_task(self):
+        # Caller holds the lock. The chosen owner moves to the back of the rotation.
+        for owner in list(self._queues):
+            if self._running.get(owner, 0) >= self._limits.get(owner, float("inf")):
+                continue
+            tasks = self._queues.pop(owner)
+            task = tasks.popleft()
+            if tasks:
+                self._queues[owner] = tasks
+            self._running[owner] = self._running.get(owner, 0) + 1
+            return owner, task
+        return None
+
+    def _work(self):
+        while True:
+            with self._cond:
+                picked = self._next_task()
+                while picked is None:
+                    self._cond.wait()
+                    picked = self._next_task()
+
+            owner, (key, fn, future, queued_at) = picked
+            metrics.observe("queue_wait_seconds", time.perf_counter() - queued_at, queue=self.name)
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn())
+                except BaseException as e:
+                    future.set_exception(e)
+
+            with self._cond:
+                if key is not None and self._in_flight.get(key) is future:
+                    del self._in_flight[key]
+                self._running[owner] -= 1
+                if not self._running[owner]:
+                    del self._running[owner]
+                    if owner not in self._queues:
+                        self._limits.pop(owner, None)
+                # A freed owner slot may make a different waiting task eligible
+                self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "queue_depth": sum(len(tasks) for tasks in self._queues.values()),
+                "running": sum(self._running.values()),
+                "waiting_owners": len(self._queues),
+                "submitted": self.submitted,
+                "coalesced": self.coalesced
+            }
@@ -0,0 +1,85 @@
+"""Parameter sweeps: one cover per combination of styles, colors, categories and sizes.
+
+A sweep expands the chosen values of each axis into prompts with
+build_prompt, collapses combinations that produce the same request (style
+and color sets in another order, or the defaults spelled out), and lays
+the requests out as a matrix: one row per style and color combination,
+one column per category and size. The requests then run as a single job,
+in parallel within the shared rate limits.
+"""
+import os
+
+from prompts import COLOR_OPTIONS, DEFAULT_COLORS, DEFAULT_STYLES, STYLE_OPTIONS, build_prompt
+
+# Largest number of distinct requests one sweep may make; COVER_SWEEP_MAX_CELLS overrides it
+MAX_CELLS = 24
+
+
+def _normalize(values, options, default):
+    """Canonical order of a style or color set; an empty set means the default one"""
+    chosen = set(values) or set(default)
+    return tuple(option for option in options if option in chosen)
+
+
+def expand_grid(
+    title, summary, additional, style_sets, color_sets, categories, sizes, max_cells=None, include_title=True
+):
+    """Expand the axes into (cells, grid).
+
+    cells are the distinct requests, as dicts with prompt, size, category,
+    styles and colors. grid has the row labels, the column labels and a
+    matrix of cell indexes, where equivalent combinations share a cell.
+    Raises ValueError when an axis is empty or the sweep needs more than
+    max_cells requests (COVER_SWEEP_MAX_CELLS, read per call, by default).
+    include_title is passed on to build_prompt.
+    """
+    if max_cells is None:
+        max_cells = int(os.getenv("COVER_SWEEP_MAX_CELLS", MAX_CELLS))
+    style_sets = list(dict.fromkeys(_normalize(styles, STYLE_OPTIONS, DEFAULT_STYLES) for styles in style_sets))
+    color_sets = list(dict.fromkeys(_normalize(colors, COLOR_OPTIONS, DEFAULT_COLORS) for colors in color_sets))
+    categories = list(dict.fromkeys(categories))
+    sizes = list(dict.fromkeys(sizes))
+    if not (style_sets and color_sets and categories and sizes):
+        raise ValueError("Pick at least one value for every axis")
+
+    cells = []
+    positions = {}  # (prompt, size) -> cell index
+    matrix = []
+    for styles in style_sets:
+        for colors in color_sets:
+            row = []
+            for category in categories:
+                prompt = build_prompt(title, summary, category, list(styles), list(colors), additional, include_title)
+                for size in sizes:
+                    if (prompt, size) not in positions:
+                        positions[(prompt, size)] = len(cells)
+                        cells.append({
+                            "prompt": prompt,
+                            "size": size,
+                            "category": category,
+                            "styles": list(styles),
+                            "colors": list(colors)
+                        })
+                    row.append(positions[(prompt, size)])
+            matrix.append(row)
+
+    if len(cells) > max_cells:
+        raise ValueError(f"This sweep needs {len(cells)} covers; the limit is {max_cells}")
+
+    grid = {
+        "rows": [f"{' + '.join(styles)} · {' + '.join(colors)}" for styles in style_sets for colors in color_sets],
+        "columns": [f"{category} · {size}" for category in categories for size in sizes],
+        "matrix": matrix
+    }
+    return cells, grid
+
+
+def cell_covers(cells, records):
+    """Map cell indexes to the stored cover made for each, matched by prompt and size"""
+    by_request = {(record["prompt"], record["size"]): record for record in records}
+    covers = {}
+    for index, cell in enumerate(cells):
+        record = by_request.get((cell["prompt"], cell["size"]))
+        if record is not None:
+            covers[index] = record
+    return covers
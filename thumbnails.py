@@ -0,0 +1,28 @@
+"""Small gallery previews of generated covers"""
+import io
+import os
+
+THUMBNAIL_MAX_SIDE = 320
+THUMBNAIL_FORMAT = "webp"
+THUMBNAIL_QUALITY = 80
+
+
+def make_thumbnail(data, max_side=THUMBNAIL_MAX_SIDE, image_format=THUMBNAIL_FORMAT, quality=THUMBNAIL_QUALITY):
+    """Downscale an encoded image (bytes-like or a file path) into a compact preview"""
+    # Pillow is imported here so importing this module stays cheap
+    from PIL import Image
+
+    # A path lets Pillow read the stored file instead of copying the bytes into a BytesIO
+    source = data if isinstance(data, (str, os.PathLike)) else io.BytesIO(data)
+    with Image.open(source) as img:
+        # draft() lets the JPEG decoder skip work when shrinking a lot
+        img.draft("RGB", (max_side, max_side))
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "transparency" in img.info else "RGB")
+        if image_format == "jpeg" and img.mode == "RGBA":
+            img = img.convert("RGB")
+
+        buffer = io.BytesIO()
+        img.save(buffer, format=image_format.upper(), quality=quality)
+        return buffer.getvalue()